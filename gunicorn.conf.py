@@ -0,0 +1,49 @@
+"""
+Gunicorn configuration for rice_detect (picked up automatically from the
+working directory by ``gunicorn rice_detect.wsgi:application``).
+
+The Django app (without TensorFlow) is loaded once in the master. The model
+is not: TensorFlow must not start before the fork (its thread pools deadlock
+in the children), so each worker loads and warms up a model of its own in
+post_fork, before taking requests. Model memory is per worker, nothing of
+it is shared: budget the TensorFlow runtime and model, roughly 500 MB, once
+for every worker in WEB_CONCURRENCY (and every INFERENCE_WORKERS process).
+
+With SERVER_INTERFACE=asgi (``gunicorn rice_detect.asgi:application``, see
+render.yaml) the workers are uvicorn event loops instead of threads; the
+hooks below apply unchanged.
+"""
+
+import os
+
+# gunicorn's preload_app: the Django app, not the model. Without it each
+# worker also loads its model lazily, on its first classification
+preload_app = os.environ.get('GUNICORN_PRELOAD_APP', 'True').lower() == 'true'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+if os.environ.get('SERVER_INTERFACE', 'wsgi') == 'asgi':
+    worker_class = 'uvicorn_worker.UvicornWorker'
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from riceapp.disease_info import knowledge_base
+    from riceapp.metrics import metrics
+
+    # Samples of workers from earlier runs would be summed in forever
+    metrics.remove_dead()
+
+    # Parsed once here; workers re-read it only if the file changes
+    knowledge_base.get()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    from riceapp.registry import registry, ModelUnavailable
+
+    try:
+        registry.get()
+    except ModelUnavailable as e:
+        # Keep the worker up; the registry retries on the first request
+        print(f"Worker {worker.pid}: {e}")
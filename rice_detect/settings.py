@@ -4,6 +4,7 @@ Django settings for rice_detect project.
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -36,7 +37,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "riceapp.middleware.AsyncWhiteNoiseMiddleware",
+    "riceapp.middleware.PeakMemoryMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -82,6 +84,30 @@ else:
         }
     }
 
+# Caches: "default" is per-process; "predictions" is a database table shared
+# by every worker (created by `manage.py createcachetable` in build.sh)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Local to the host but shared by all its worker processes: with a
+    # per-process (locmem) cache, a logout in one worker would leave the
+    # session valid in the others' caches
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SESSION_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'rice_detect_sessions')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'predictions': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'riceapp_prediction_cache',
+        # `load_test` runs under a prefix of its own so that it neither reads nor feeds real entries
+        'KEY_PREFIX': os.environ.get('PREDICTION_CACHE_KEY_PREFIX', ''),
+        'TIMEOUT': 60 * 60 * 24 * 30,  # 30 days
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -106,7 +132,7 @@ USE_TZ = True
 
 # Static files (CSS, JavaScript, Images)
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 
 STATIC_URL = "static/"
 
@@ -116,8 +142,16 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
 
-# Enhanced WhiteNoise configuration for static files
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+STORAGES = {
+    # Uploads are stored once per distinct content (riceapp/storage.py)
+    "default": {
+        "BACKEND": "riceapp.storage.ContentAddressedStorage",
+    },
+    # Enhanced WhiteNoise configuration for static files
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
 
 # WhiteNoise configuration for better performance
 WHITENOISE_MAX_AGE = 31536000  # 1 year for cache
@@ -148,12 +182,102 @@ if not DEBUG:
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
 
-# File upload settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
+# File upload settings: uploads larger than FILE_UPLOAD_MAX_MEMORY_SIZE are
+# streamed to a temporary file instead of being held in worker memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.environ.get('FILE_UPLOAD_MAX_MEMORY_SIZE', 1048576))  # 1MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 
-# Session settings
-SESSION_ENGINE = "django.contrib.sessions.backends.db"
+# Pixel budget of a decoded upload. The size is read from the image header;
+# JPEGs are decoded at reduced scale, anything that would still exceed the
+# budget (about 3 bytes per pixel) is rejected before decoding
+MAX_IMAGE_PIXELS = int(float(os.environ.get('MAX_IMAGE_MEGAPIXELS', 24)) * 1_000_000)
+
+# Log the peak RSS of each request (see riceapp.middleware)
+LOG_REQUEST_MEMORY = os.environ.get('LOG_REQUEST_MEMORY', 'True').lower() == 'true'
+
+# Identifies the deployed code (Render sets RENDER_GIT_COMMIT); part of the
+# ETag of cached pages, which link to release-specific static files
+RELEASE = os.environ.get('RELEASE', os.environ.get('RENDER_GIT_COMMIT', ''))[:12]
+
+# Rendered result detail pages are cached per result for this long
+RESULT_PAGE_CACHE_SECONDS = int(os.environ.get('RESULT_PAGE_CACHE_SECONDS', 60 * 60))
+
+# Disease knowledge base shown on result pages; workers reload it when the
+# file's mtime changes
+DISEASE_INFO_PATH = os.environ.get('DISEASE_INFO_PATH', BASE_DIR / 'rice_disease_info.json')
+
+# SavedModels live in MODELS_DIR/<version>/; MODEL_VERSION selects the one served
+MODELS_DIR = BASE_DIR / 'models'
+MODEL_VERSION = os.environ.get('MODEL_VERSION', '2')
+
+# Inference backend: 'tensorflow' runs the SavedModel, 'tflite' runs the
+# quantized artifact written by `manage.py convert_model` (check the
+# accuracy report next to it before switching)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'tensorflow')
+INFERENCE_TFLITE_QUANTIZATION = os.environ.get('INFERENCE_TFLITE_QUANTIZATION', 'int8')
+
+# Predictions are cached by upload hash and model; this bounds the in-worker LRU
+PREDICTION_CACHE_ALIAS = 'predictions'
+PREDICTION_CACHE_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 1024))
+
+# Uploads whose perceptual hash is within this many bits (of 64) of an earlier
+# result reuse that result instead of running the model; -1 disables reuse
+PHASH_MAX_DISTANCE = int(os.environ.get('PHASH_MAX_DISTANCE', 4))
+
+# Inference batching: concurrent classify requests in a worker are grouped
+# into one forward pass of up to INFERENCE_MAX_BATCH_SIZE images, waiting at
+# most INFERENCE_MAX_WAIT_MS for the batch to fill. A batch size of 1 disables it.
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 15))
+
+# Under ASGI (rice_detect.asgi, see render.yaml) the async classify view
+# decodes uploads on a pool of this many threads per worker
+ASYNC_DECODE_THREADS = int(os.environ.get('ASYNC_DECODE_THREADS', 4))
+
+# Compile the serving graph with XLA (often slower than plain graphs on small
+# CPU models, so measure before enabling) and trace it when the worker boots
+INFERENCE_XLA = os.environ.get('INFERENCE_XLA', 'False').lower() == 'true'
+INFERENCE_WARMUP = os.environ.get('INFERENCE_WARMUP', 'True').lower() == 'true'
+
+# Batch classification (/classify/batch/): most photos per request and largest
+# single file accepted from a ZIP archive
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 500))
+BATCH_MAX_FILE_SIZE = int(os.environ.get('BATCH_MAX_FILE_SIZE', 20 * 1024 * 1024))
+DATA_UPLOAD_MAX_NUMBER_FILES = BATCH_MAX_FILES
+
+# Widths (px) of the WebP/JPEG thumbnails generated for each stored upload
+THUMBNAIL_WIDTHS = [int(w) for w in os.environ.get('THUMBNAIL_WIDTHS', '160,320,640').split(',')]
+# Made on a background thread of the web worker once the result is committed;
+# False makes them inside the request (the tests, whose data other threads can't see)
+THUMBNAILS_IN_BACKGROUND = os.environ.get('THUMBNAILS_IN_BACKGROUND', 'True').lower() == 'true'
+
+# Unreferenced uploads (anonymous ones, or those of deleted results) are
+# removed by `manage.py gc_uploads` once untouched for this long
+UPLOAD_GC_TTL_HOURS = float(os.environ.get('UPLOAD_GC_TTL_HOURS', 24))
+
+# Cards per page of /history/ (later pages load as the user scrolls)
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 24))
+
+# Classification jobs (/classify/jobs/), run by `manage.py run_inference_workers`.
+# A job still running after JOB_TIMEOUT_SECONDS is assumed lost with its worker
+# and queued again, up to JOB_MAX_ATTEMPTS tries in total.
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+JOB_TIMEOUT_SECONDS = int(os.environ.get('JOB_TIMEOUT_SECONDS', 300))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# Worker processes started next to the web server (render.yaml). Each holds a
+# model of its own; with none, a job is classified in the request that queues it
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+
+# Prometheus metrics at /metrics: each process writes its samples to a file
+# in METRICS_DIR (empty: this process only), the endpoint sums them. Staff
+# users, or scrapers sending "Authorization: Bearer <METRICS_TOKEN>", can read it
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'rice_detect_metrics'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Session settings: sessions are read from the 'sessions' cache and only go
+# to the database when they change or fall out of the cache
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', "django.contrib.sessions.backends.cached_db")
+SESSION_CACHE_ALIAS = 'sessions'
 SESSION_COOKIE_AGE = 1209600  # 2 weeks in seconds
 
 # Logging configuration
@@ -0,0 +1,129 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Groups concurrent single-image predictions into one forward pass.
+
+    Callers hand ``submit`` one preprocessed image (no batch dimension) and
+    block until their own row of the batched prediction comes back. A
+    background thread waits for up to ``max_wait_ms`` after the first queued
+    image, or until ``max_batch_size`` images are queued, then calls
+    ``predict_fn`` once on the stacked batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=15):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+        self._total_predict = 0.0
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so a worker started in the gunicorn
+        # master (or before a fork) has to be restarted in the child.
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._reset_stats()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, image):
+        """Queue one image and return a future resolving to its prediction row."""
+        future = Future()
+        if self.max_batch_size == 1:
+            # Batching disabled: predict inline on the caller's thread
+            start = time.perf_counter()
+            try:
+                future.set_result(self.predict_fn(np.expand_dims(image, 0))[0])
+            except Exception as e:
+                future.set_exception(e)
+            with self._lock:
+                self._requests += 1
+                self._batch_sizes[1] += 1
+                self._total_predict += time.perf_counter() - start
+            return future
+
+        self._ensure_worker()
+        self._queue.put((image, future, time.perf_counter()))
+        with self._lock:
+            self._requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def predict(self, image, timeout=None):
+        """Blocking helper: submit one image and wait for its prediction row."""
+        return self.submit(image).result(timeout=timeout)
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            started = time.perf_counter()
+            try:
+                predictions, error = self.predict_fn(np.stack([image for image, _, _ in items])), None
+            except Exception as e:
+                predictions, error = None, e
+            finished = time.perf_counter()
+
+            # Recorded before the callers are woken, so they see their batch in stats()
+            with self._lock:
+                self._batch_sizes[len(items)] += 1
+                self._total_wait += sum(started - queued_at for _, _, queued_at in items)
+                self._total_predict += finished - started
+
+            if error is not None:
+                for _, future, _ in items:
+                    future.set_exception(error)
+            else:
+                for row, (_, future, _) in zip(predictions, items):
+                    future.set_result(row)
+
+    def stats(self):
+        """Snapshot of queue depth and batch-size statistics for tuning."""
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            images = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'requests': self._requests,
+                'batches': batches,
+                'avg_batch_size': round(images / batches, 2) if batches else 0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'avg_queue_wait_ms': round(1000 * self._total_wait / images, 2) if images else 0,
+                'avg_predict_ms': round(1000 * self._total_predict / batches, 2) if batches else 0,
+            }
@@ -0,0 +1,236 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from PIL import Image, UnidentifiedImageError
+from django.conf import settings
+
+from .batching import MicroBatcher
+from .disease_info import disease_info_version
+from .metrics import metrics
+from .models import ClassificationResult
+from .phash import dhash, perceptual_index, to_signed
+from .prediction_cache import hash_upload, prediction_cache
+from .preprocessing import ImageTooLarge, is_leaf_like, prepare_image
+from .registry import registry
+
+# Models are loaded lazily by the registry (and in post_fork by gunicorn.conf.py);
+# concurrent requests in this worker are grouped into one forward pass
+def _predict(batch):
+    with metrics.timer('predict'):
+        return registry.get().predict(batch)
+
+
+batcher = MicroBatcher(
+    _predict,
+    max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+    max_wait_ms=settings.INFERENCE_MAX_WAIT_MS,
+)
+
+# Async views decode uploads here instead of on the event loop. Bounded, so a
+# burst of uploads waits its turn rather than decoding all at once
+decode_executor = ThreadPoolExecutor(settings.ASYNC_DECODE_THREADS, thread_name_prefix='decode')
+
+
+class Outcome:
+    """What the pipeline concluded about one uploaded file.
+
+    ``status`` is ``'ok'`` (``predictions`` holds the model output), ``'not_leaf'``
+    (rejected by the leaf check) or ``'error'`` (``error`` says why). ``source``
+    says where predictions came from: ``'cache'``, ``'near_duplicate'`` or ``'model'``.
+    """
+
+    def __init__(self, upload, content_hash=None):
+        self.upload = upload
+        self.content_hash = content_hash
+        self.status = 'ok'
+        self.error = None
+        self.predictions = None
+        self.phash = None
+        self.reused_result = None
+        self.phash_distance = None
+        self.source = None
+        self.model_tag = registry.model_tag()
+
+
+def find_near_duplicate(image_phash):
+    """Closest earlier result of the active model within PHASH_MAX_DISTANCE bits"""
+    matches = perceptual_index.nearest(image_phash, settings.PHASH_MAX_DISTANCE, registry.model_tag())
+    for result_id, distance in matches:
+        # The index can still hold ids of results deleted since it was loaded
+        result = ClassificationResult.objects.filter(id=result_id).only('id', 'class_probabilities').first()
+        if result is not None:
+            return result, distance
+    return None, None
+
+
+def _hash(upload):
+    with metrics.timer('hash'):
+        return Outcome(upload, hash_upload(upload))
+
+
+def _cached(outcome):
+    """Settle the outcome from the prediction cache; False on a miss."""
+    # Re-uploads of the same photo reuse the stored outcome without touching TensorFlow
+    cached = prediction_cache.get(outcome.content_hash)
+    if cached is None:
+        return False
+    outcome.source = 'cache'
+    if not cached['is_leaf']:
+        outcome.status = 'not_leaf'
+    else:
+        outcome.predictions = np.array(cached['probabilities'])
+        outcome.phash = cached.get('phash')
+    return True
+
+
+def _decode(outcome):
+    """Decoded, model-sized image, or None (and an error outcome) if unreadable."""
+    # Decode once, straight to model resolution; the leaf check and the
+    # perceptual hash both run on that small image
+    upload = outcome.upload
+    try:
+        with Image.open(upload) as image:
+            return prepare_image(image, max_pixels=settings.MAX_IMAGE_PIXELS)
+    except (ImageTooLarge, Image.DecompressionBombError) as e:
+        outcome.status = 'error'
+        outcome.error = f'Image is too large: {e}'
+    except (UnidentifiedImageError, OSError) as e:
+        outcome.status = 'error'
+        outcome.error = f'Could not read image: {e}'
+    finally:
+        # Rewind after decoding so the whole file gets saved later
+        upload.seek(0)
+    return None
+
+
+def _match(outcome, prepared):
+    """Second half: near-duplicate lookup and leaf check; returns the model input or None."""
+    # Re-encoded copies of an earlier upload reuse that result's prediction
+    with metrics.timer('near_duplicate'):
+        outcome.phash = dhash(prepared.image)
+        outcome.reused_result, outcome.phash_distance = find_near_duplicate(outcome.phash)
+    if outcome.reused_result is not None:
+        outcome.source = 'near_duplicate'
+        outcome.predictions = np.array([
+            outcome.reused_result.class_probabilities.get(name, 0) / 100
+            for name in registry.class_names()
+        ])
+        _remember(outcome)
+        return None
+
+    with metrics.timer('leaf_check'):
+        leaf_like = is_leaf_like(prepared.image)
+    if not leaf_like:
+        outcome.status = 'not_leaf'
+        prediction_cache.set(outcome.content_hash, {'is_leaf': False})
+        return None
+    outcome.source = 'model'
+    return prepared.array
+
+
+def _analyse(upload):
+    """Everything short of inference: returns (outcome, model input or None)."""
+    outcome = _hash(upload)
+    if _cached(outcome):
+        return outcome, None
+    prepared = _decode(outcome)
+    if prepared is None:
+        return outcome, None
+    return outcome, _match(outcome, prepared)
+
+
+def _remember(outcome):
+    prediction_cache.set(outcome.content_hash, {
+        'is_leaf': True,
+        'probabilities': outcome.predictions.tolist(),
+        'phash': outcome.phash,
+    })
+
+
+def classify_uploads(uploads):
+    """Run a list of uploaded files through the classify pipeline.
+
+    Each file is hashed, looked up in the prediction cache, decoded at reduced
+    scale, matched against earlier near-duplicates and leaf-checked. Only the
+    files left after that are submitted to the batcher, all at once, so they
+    share forward passes. Returns one Outcome per upload, in order. Raises
+    ModelUnavailable if the model can't be loaded.
+    """
+    outcomes, pending = [], []
+    for upload in uploads:
+        outcome, array = _analyse(upload)
+        outcomes.append(outcome)
+        if array is not None:
+            pending.append((outcome, batcher.submit(array)))
+
+    for outcome, future in pending:
+        with metrics.timer('inference'):
+            outcome.predictions = future.result()
+        _remember(outcome)
+    for outcome in outcomes:
+        _count(outcome)
+    return outcomes
+
+
+def _count(outcome):
+    if outcome.status == 'not_leaf':
+        metrics.inc('rice_leaf_check_rejections_total')
+    elif outcome.status == 'error':
+        metrics.inc('rice_upload_errors_total')
+    else:
+        predicted_class = registry.class_names()[np.argmax(outcome.predictions)]
+        metrics.inc('rice_predictions_total', predicted_class=predicted_class, source=outcome.source)
+
+
+def classify_upload(upload):
+    return classify_uploads([upload])[0]
+
+
+async def aclassify_upload(upload):
+    """classify_upload for async views.
+
+    The same stages as _analyse: hashing and decoding run on the bounded
+    decode_executor and the forward pass on the batcher's thread, so the
+    event loop only waits. The stages that query the database (the shared
+    prediction cache, near-duplicate lookup) go through sync_to_async like
+    any other ORM call from async code.
+    """
+    loop = asyncio.get_running_loop()
+    outcome = await loop.run_in_executor(decode_executor, _hash, upload)
+    if not await sync_to_async(_cached)(outcome):
+        prepared = await loop.run_in_executor(decode_executor, _decode, outcome)
+        array = await sync_to_async(_match)(outcome, prepared) if prepared is not None else None
+        if array is not None:
+            # With batching disabled submit() predicts inline, so it isn't called on the loop
+            future = await loop.run_in_executor(decode_executor, batcher.submit, array)
+            with metrics.timer('inference'):
+                outcome.predictions = await asyncio.wrap_future(future)
+            await sync_to_async(_remember)(outcome)
+    _count(outcome)
+    return outcome
+
+
+def prediction_fields(predictions, class_names):
+    """The ClassificationResult fields that follow from one row of model output"""
+    predicted_class = class_names[np.argmax(predictions)]
+    return {
+        'predicted_class': predicted_class,
+        'confidence': round(100 * float(np.max(predictions)), 2),
+        'class_probabilities': {
+            name: round(float(predictions[i]) * 100, 2) for i, name in enumerate(class_names)
+        },
+        'disease_info_version': disease_info_version(predicted_class),
+    }
+
+
+def build_result(outcome, user):
+    """Unsaved ClassificationResult for a successful pipeline outcome"""
+    return ClassificationResult(
+        user=user,
+        image=outcome.upload,  # This will save to MEDIA_ROOT/classification_images/
+        model_version=outcome.model_tag,
+        phash=to_signed(outcome.phash) if outcome.phash is not None else None,
+        **prediction_fields(outcome.predictions, registry.class_names()),
+    )
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Fields every entry needs, and the shape of the optional ones the guide shows
+REQUIRED_FIELDS = ('disease_name', 'scientific_name', 'prevention_methods')
+TEXT_FIELDS = ('disease_name', 'scientific_name')
+TREATMENT_FIELDS = ('organic_cures', 'chemical_pesticides')
+
+# Guides are small and there are a handful per class; this only bounds
+# edits piling up in a long-lived worker
+GUIDE_CACHE_SIZE = 256
+
+
+def validate_disease_info(data):
+    """Raise ImproperlyConfigured unless ``data`` is ``{class: entry}`` as the templates expect."""
+    if not isinstance(data, dict) or not data:
+        raise ImproperlyConfigured("Disease info must be a non-empty object keyed by class name")
+    for predicted_class, entry in data.items():
+        where = f"Disease info for {predicted_class!r}"
+        if not isinstance(entry, dict):
+            raise ImproperlyConfigured(f"{where} must be an object")
+        missing = [field for field in REQUIRED_FIELDS if field not in entry]
+        if missing:
+            raise ImproperlyConfigured(f"{where} is missing {', '.join(missing)}")
+        for field, value in entry.items():
+            if field in TEXT_FIELDS:
+                valid = isinstance(value, str)
+            elif field in TREATMENT_FIELDS:
+                valid = isinstance(value, list) and all(isinstance(item, dict) and 'name' in item for item in value)
+            else:
+                valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+            if not valid:
+                raise ImproperlyConfigured(f"{where}: {field!r} has the wrong type")
+
+
+class KnowledgeBase:
+    """The parsed disease knowledge base (DISEASE_INFO_PATH) of this process.
+
+    The file is read and validated once, and again only when its mtime
+    changes; a reload that fails keeps the previous copy. The per-disease
+    management guide is rendered from disease_guide.html once per distinct
+    content (old versions referenced by stored results included), so result
+    pages don't walk the nested lists on every request.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.data = None
+        self.guides = {}
+
+    def _path(self):
+        return self.path or settings.DISEASE_INFO_PATH
+
+    def get(self):
+        path = self._path()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError as e:
+            if self.data is None:
+                raise ImproperlyConfigured(f"Disease info file {path} is not readable: {e}")
+            return self.data
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    self._load(path, mtime)
+        return self.data
+
+    def _load(self, path, mtime):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            validate_disease_info(data)
+        except (OSError, ValueError, ImproperlyConfigured) as e:
+            if self.data is None:
+                raise ImproperlyConfigured(f"Could not load disease info from {path}: {e}")
+            print(f"Keeping the previous disease info; reloading {path} failed: {e}")
+            self.mtime = mtime
+            return
+        self.data, self.mtime = data, mtime
+        print(f"Loaded disease info for {len(data)} classes from {path}")
+
+    def entry(self, predicted_class):
+        return self.get().get(predicted_class)
+
+    def guide_html(self, predicted_class, content=None, digest=None):
+        """The rendered management guide for ``content`` (default: the current entry)."""
+        if content is None:
+            content = self.entry(predicted_class) or {}
+        key = (predicted_class, digest or content_hash(content))
+        html = self.guides.get(key)
+        if html is None:
+            html = mark_safe(render_to_string(
+                'disease_guide.html', {'predicted_class': predicted_class, 'disease_info': content},
+            ))
+            if len(self.guides) >= GUIDE_CACHE_SIZE:
+                self.guides.clear()
+            self.guides[key] = html
+        return html
+
+
+knowledge_base = KnowledgeBase()
+
+
+def content_hash(content):
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def disease_info_version(predicted_class, content=None):
+    """The DiseaseInfo row holding ``content`` (by default the current entry for
+    the class), created as the next version the first time it is seen.
+
+    Returns None when there is no information for the class.
+    """
+    from .models import DiseaseInfo
+
+    if content is None:
+        content = knowledge_base.entry(predicted_class)
+    if not content:
+        return None
+    digest = content_hash(content)
+    for _ in range(3):
+        existing = DiseaseInfo.objects.filter(predicted_class=predicted_class, content_hash=digest).first()
+        if existing is not None:
+            return existing
+        latest = DiseaseInfo.objects.filter(predicted_class=predicted_class).aggregate(v=Max('version'))['v'] or 0
+        try:
+            with transaction.atomic():
+                return DiseaseInfo.objects.create(
+                    predicted_class=predicted_class, version=latest + 1, content=content, content_hash=digest,
+                )
+        except IntegrityError:
+            # Another worker stored a version at the same moment; look again
+            continue
+    raise RuntimeError(f"Could not store disease info for {predicted_class!r}")
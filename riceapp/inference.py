@@ -0,0 +1,92 @@
+import os
+import time
+
+import numpy as np
+# Seconds of startup and a few hundred MB: this module is only imported where
+# a model is built (the registry, model commands), never by views or the
+# URLconf. StartupTests checks that `manage.py check` stays free of it.
+import tensorflow as tf
+from tensorflow.core.protobuf import saved_model_pb2
+
+
+def saved_model_classes(path):
+    """Output width of a SavedModel's serving signature, read from saved_model.pb without loading it."""
+    saved_model = saved_model_pb2.SavedModel()
+    with open(os.path.join(str(path), 'saved_model.pb'), 'rb') as f:
+        saved_model.ParseFromString(f.read())
+    outputs = saved_model.meta_graphs[0].signature_def['serving_default'].outputs
+    if len(outputs) != 1:
+        raise ValueError(f"{path} has {len(outputs)} outputs in its serving signature, expected one")
+    return next(iter(outputs.values())).tensor_shape.dim[-1].size
+
+
+class InferenceModel:
+    """Fixed-signature, warmed-up wrapper around a Keras SavedModel.
+
+    ``model.predict`` builds a new data adapter on every call, which costs more
+    than the forward pass itself for a single 256x256 image. Here the model is
+    called through one ``tf.function`` traced with a fixed input signature, so
+    every request after warm-up reuses the same concrete graph.
+
+    With ``jit_compile`` the graph is compiled by XLA. XLA specialises on the
+    exact input shape, so batches are zero-padded up to the next power of two
+    (capped at ``max_batch_size``) and each of those shapes is compiled during
+    warm-up instead of on a user's request.
+    """
+
+    def __init__(self, path, max_batch_size=8, jit_compile=False):
+        self.path = str(path)
+        self.model = tf.keras.models.load_model(self.path, compile=False)
+        self.input_shape = tuple(self.model.input_shape[1:])
+        self.num_classes = int(self.model.output_shape[-1])
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.jit_compile = jit_compile
+        self._forward = tf.function(
+            self._call,
+            input_signature=[tf.TensorSpec((None,) + self.input_shape, tf.float32)],
+            jit_compile=jit_compile,
+        )
+        self.warmup_seconds = None
+
+    @tf.autograph.experimental.do_not_convert
+    def _call(self, batch):
+        return self.model(batch, training=False)
+
+    def batch_buckets(self):
+        """Batch sizes that get their own compiled program."""
+        if not self.jit_compile:
+            return [1]
+        buckets, size = [], 1
+        while size < self.max_batch_size:
+            buckets.append(size)
+            size *= 2
+        buckets.append(self.max_batch_size)
+        return buckets
+
+    def _padded_size(self, n):
+        for size in self.batch_buckets():
+            if size >= n:
+                return size
+        return n
+
+    def warmup(self, passes=2):
+        """Trace (and XLA-compile) every batch bucket before serving traffic."""
+        start = time.perf_counter()
+        for size in self.batch_buckets():
+            dummy = np.zeros((size,) + self.input_shape, dtype=np.float32)
+            for _ in range(passes):
+                self._forward(dummy).numpy()
+        self.warmup_seconds = time.perf_counter() - start
+        return self.warmup_seconds
+
+    def predict(self, batch):
+        """Run a (N, H, W, C) float batch and return (N, num_classes) probabilities."""
+        batch = np.asarray(batch, dtype=np.float32)
+        n = len(batch)
+        if self.jit_compile and n <= self.max_batch_size:
+            padded = self._padded_size(n)
+            if padded != n:
+                batch = np.concatenate(
+                    [batch, np.zeros((padded - n,) + batch.shape[1:], dtype=np.float32)]
+                )
+        return self._forward(batch).numpy()[:n]
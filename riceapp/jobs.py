@@ -0,0 +1,234 @@
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .classification import build_result, classify_uploads
+from .models import ClassificationJob, InferenceWorker
+from .registry import ModelUnavailable, registry
+
+# How often an idle worker refreshes its heartbeat row
+HEARTBEAT_SECONDS = 5
+
+# Number of recently started jobs the queue latency figures are computed over
+LATENCY_WINDOW = 100
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(user, upload):
+    """Store an upload and queue it for classification.
+
+    Without inference workers (INFERENCE_WORKERS = 0) nothing would ever
+    claim the job, so it is run right away and comes back finished.
+    """
+    job = ClassificationJob.objects.create(user=user, image=upload)
+    if not settings.INFERENCE_WORKERS:
+        run_inline(job)
+    return job
+
+
+def run_inline(job):
+    """Claim and process one job in this process, failing it on errors."""
+    ClassificationJob.objects.filter(id=job.id).update(
+        status=ClassificationJob.RUNNING, worker=worker_name(), started_at=timezone.now(), attempts=F('attempts') + 1,
+    )
+    job.refresh_from_db()
+    try:
+        process_jobs([job])
+    except Exception as e:
+        # Queued again, it would wait for a worker that doesn't exist
+        print(f"Job {job.id} failed: {e}")
+        error = 'The classification model is unavailable.' if isinstance(e, ModelUnavailable) else str(e)
+        job.status, job.error, job.finished_at = ClassificationJob.FAILED, error, timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+
+
+def claim_jobs(worker, limit=1):
+    """Move up to ``limit`` of the oldest queued jobs to running for ``worker``.
+
+    A job is claimed with a conditional UPDATE (``WHERE status = 'queued'``),
+    so when several workers race for the same row exactly one of them gets
+    it. This works the same on SQLite and PostgreSQL and needs no broker.
+    """
+    claimed = []
+    while len(claimed) < limit:
+        candidates = list(
+            ClassificationJob.objects
+            .filter(status=ClassificationJob.QUEUED)
+            .order_by('created_at', 'id')
+            .values_list('id', flat=True)[:limit - len(claimed)]
+        )
+        if not candidates:
+            break
+        for job_id in candidates:
+            updated = ClassificationJob.objects.filter(id=job_id, status=ClassificationJob.QUEUED).update(
+                status=ClassificationJob.RUNNING,
+                worker=worker,
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1,
+            )
+            if updated:
+                claimed.append(job_id)
+    return list(
+        ClassificationJob.objects.filter(id__in=claimed).select_related('user').order_by('created_at', 'id')
+    )
+
+
+def release_jobs(jobs, error):
+    """Queue jobs again after a failure, or fail them once out of attempts.
+
+    Only jobs still running are touched: those of the batch that finished
+    before the failure keep their result instead of being classified twice.
+    """
+    for job in jobs:
+        if job.attempts < settings.JOB_MAX_ATTEMPTS:
+            changes = {'status': ClassificationJob.QUEUED, 'worker': '', 'started_at': None}
+        else:
+            changes = {'status': ClassificationJob.FAILED, 'error': error, 'finished_at': timezone.now()}
+        ClassificationJob.objects.filter(id=job.id, status=ClassificationJob.RUNNING).update(**changes)
+
+
+def requeue_stale_jobs():
+    """Release jobs whose worker died (or hung) while running them.
+
+    Heartbeat rows of workers not seen for as long are dropped as well.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS)
+    InferenceWorker.objects.filter(last_seen__lt=cutoff).delete()
+    stale = list(ClassificationJob.objects.filter(status=ClassificationJob.RUNNING, started_at__lt=cutoff))
+    if stale:
+        print(f"Releasing {len(stale)} stale classification job(s)")
+        release_jobs(stale, 'The worker running this job stopped responding.')
+    return len(stale)
+
+
+def process_jobs(jobs):
+    """Classify claimed jobs together and store their outcomes.
+
+    All images share forward passes through the batcher, the same as a chunk
+    of /classify/batch/. A successful job gets a ClassificationResult that
+    points at the job's own image file (nothing is copied).
+    """
+    for job in jobs:
+        job.image.open('rb')
+    try:
+        outcomes = classify_uploads([job.image for job in jobs])
+    finally:
+        for job in jobs:
+            job.image.close()
+
+    for job, outcome in zip(jobs, outcomes):
+        with transaction.atomic():
+            if outcome.status == 'ok':
+                result = build_result(outcome, job.user)
+                result.image = job.image.name
+                result.save()
+                job.result, job.status = result, ClassificationJob.DONE
+            elif outcome.status == 'not_leaf':
+                job.status = ClassificationJob.NOT_LEAF
+            else:
+                job.status, job.error = ClassificationJob.FAILED, outcome.error
+            job.finished_at = timezone.now()
+            job.save(update_fields=['result', 'status', 'error', 'finished_at'])
+
+
+class Worker:
+    """One inference worker process: claims queued jobs and runs them.
+
+    Keeps an InferenceWorker row up to date with its heartbeat and the time
+    spent classifying, from which queue_stats() reports utilization.
+    """
+
+    def __init__(self, name=None, batch_size=None, poll_interval=None):
+        self.name = name or worker_name()
+        self.batch_size = batch_size or settings.INFERENCE_MAX_BATCH_SIZE
+        self.poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+        now = timezone.now()
+        self.record, _ = InferenceWorker.objects.update_or_create(
+            name=self.name,
+            defaults={'started_at': now, 'last_seen': now, 'busy_seconds': 0, 'jobs_done': 0},
+        )
+        self._last_heartbeat = 0
+
+    def heartbeat(self, busy_seconds=0, jobs_done=0):
+        self.record.busy_seconds += busy_seconds
+        self.record.jobs_done += jobs_done
+        self.record.last_seen = timezone.now()
+        self.record.save(update_fields=['busy_seconds', 'jobs_done', 'last_seen'])
+        self._last_heartbeat = time.monotonic()
+
+    def run_once(self):
+        """Claim and process one batch of jobs. Returns how many were processed."""
+        jobs = claim_jobs(self.name, self.batch_size)
+        if not jobs:
+            if time.monotonic() - self._last_heartbeat >= HEARTBEAT_SECONDS:
+                requeue_stale_jobs()
+                self.heartbeat()
+            return 0
+
+        start = time.perf_counter()
+        try:
+            process_jobs(jobs)
+        except ModelUnavailable as e:
+            print(f"Worker {self.name}: {e}")
+            release_jobs(jobs, 'The classification model is unavailable.')
+        except Exception as e:
+            print(f"Worker {self.name}: jobs {[job.id for job in jobs]} failed: {e}")
+            release_jobs(jobs, str(e))
+        self.heartbeat(busy_seconds=time.perf_counter() - start, jobs_done=len(jobs))
+        return len(jobs)
+
+    def run(self, stop_event):
+        """Work until ``stop_event`` is set, sleeping between empty polls."""
+        try:
+            registry.get()
+        except ModelUnavailable as e:
+            # Keep polling; the registry retries when the first jobs arrive
+            print(f"Worker {self.name}: {e}")
+        print(f"Worker {self.name} ready")
+        while not stop_event.is_set():
+            if not self.run_once():
+                stop_event.wait(self.poll_interval)
+        self.record.delete()
+        print(f"Worker {self.name} stopped")
+
+
+def queue_stats():
+    """Queue depth, queue latency and per-worker utilization, from the database."""
+    now = timezone.now()
+    counts = dict(ClassificationJob.objects.values_list('status').annotate(Count('id')).order_by())
+    oldest = (
+        ClassificationJob.objects.filter(status=ClassificationJob.QUEUED)
+        .order_by('created_at').values_list('created_at', flat=True).first()
+    )
+    recent = list(
+        ClassificationJob.objects.filter(started_at__isnull=False)
+        .order_by('-started_at').values_list('created_at', 'started_at', 'finished_at')[:LATENCY_WINDOW]
+    )
+    waits = [(started - created).total_seconds() for created, started, _ in recent]
+    runs = [(finished - started).total_seconds() for _, started, finished in recent if finished is not None]
+    return {
+        'jobs': {status: counts.get(status, 0) for status, _ in ClassificationJob.STATUS_CHOICES},
+        'oldest_queued_seconds': round((now - oldest).total_seconds(), 3) if oldest else None,
+        'avg_queue_seconds': round(sum(waits) / len(waits), 3) if waits else None,
+        'max_queue_seconds': round(max(waits), 3) if waits else None,
+        'avg_run_seconds': round(sum(runs) / len(runs), 3) if runs else None,
+        'workers': [
+            {
+                'name': worker.name,
+                'alive': (now - worker.last_seen).total_seconds() < 3 * HEARTBEAT_SECONDS,
+                'last_seen_seconds': round((now - worker.last_seen).total_seconds(), 3),
+                'jobs_done': worker.jobs_done,
+                'utilization': worker.utilization,
+            }
+            for worker in InferenceWorker.objects.order_by('name')
+        ],
+    }
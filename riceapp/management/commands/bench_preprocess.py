@@ -0,0 +1,104 @@
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from riceapp.memory import peak_rss_bytes, reset_peak_rss, rss_bytes
+from riceapp.preprocessing import MODEL_INPUT_SIZE, is_leaf_like, prepare_image
+
+
+def legacy_preprocess(path):
+    """The pre-fusion classify path: full decode, full-size HSV check, then resize."""
+    import cv2
+
+    image = Image.open(path)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    img_array = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    hsv = cv2.cvtColor(img_array, cv2.COLOR_BGR2HSV)
+    green_mask = cv2.inRange(hsv, np.array([35, 40, 40]), np.array([85, 255, 255]))
+    is_leaf = np.sum(green_mask > 0) / (image.size[0] * image.size[1]) > 0.15
+    image = image.resize(MODEL_INPUT_SIZE)
+    # img_to_array + expand_dims, as done through tf.keras before
+    batch = np.expand_dims(np.asarray(image, dtype=np.float32), 0)
+    return is_leaf, batch
+
+
+def fused_preprocess(path):
+    with Image.open(path) as image:
+        prepared = prepare_image(image)
+    return is_leaf_like(prepared.image), np.expand_dims(prepared.array, 0)
+
+
+PIPELINES = {'legacy': legacy_preprocess, 'fused': fused_preprocess}
+
+
+class Command(BaseCommand):
+    help = "Compare latency and peak memory of the legacy and fused upload preprocessing on 12 MP photos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            default=os.path.join(settings.MEDIA_ROOT, 'classification_images'),
+            help='Folder of leaf photos to upscale into synthetic camera images',
+        )
+        parser.add_argument('--count', type=int, default=5, help='Number of synthetic photos')
+        parser.add_argument('--size', default='4000x3000', help='Synthetic photo size (12 MP by default)')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        width, height = (int(v) for v in options['size'].lower().split('x'))
+        sources = sorted(
+            os.path.join(options['source'], name)
+            for name in os.listdir(options['source'])
+            if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+        )[:options['count']]
+        if not reset_peak_rss():
+            self.stderr.write('Peak RSS can only be reset on Linux; memory figures will be cumulative.')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            photos = []
+            for i, source in enumerate(sources):
+                path = os.path.join(tmp, f'photo_{i}.jpg')
+                with Image.open(source) as image:
+                    image.convert('RGB').resize((width, height), Image.BICUBIC).save(path, 'JPEG', quality=92)
+                photos.append(path)
+            self.stdout.write(
+                f"{len(photos)} synthetic {width}x{height} JPEGs "
+                f"(avg {sum(map(os.path.getsize, photos)) / len(photos) / 2**20:.1f} MiB)"
+            )
+
+            results = {}
+            for name, pipeline in PIPELINES.items():
+                latencies, peaks, outputs = [], [], []
+                for path in photos:
+                    for _ in range(options['repeat']):
+                        reset_peak_rss()
+                        baseline = rss_bytes()
+                        start = time.perf_counter()
+                        is_leaf, batch = pipeline(path)
+                        latencies.append(time.perf_counter() - start)
+                        peaks.append(peak_rss_bytes() - baseline)
+                    outputs.append((is_leaf, batch))
+                results[name] = outputs
+                self.stdout.write(
+                    f"{name:>7}: median {1000 * statistics.median(latencies):7.1f} ms, "
+                    f"max {1000 * max(latencies):7.1f} ms, "
+                    f"peak memory +{max(peaks) / 2**20:6.1f} MiB"
+                )
+
+            leaf_agreement = sum(
+                a[0] == b[0] for a, b in zip(results['legacy'], results['fused'])
+            ) / len(photos)
+            pixel_diff = max(
+                float(np.mean(np.abs(a[1] - b[1]))) for a, b in zip(results['legacy'], results['fused'])
+            )
+            self.stdout.write(
+                f"leaf-check agreement {leaf_agreement:.0%}, "
+                f"max mean |pixel difference| {pixel_diff:.2f} (0-255 scale)"
+            )
@@ -0,0 +1,84 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Imports that should only happen where a model is actually used
+HEAVY_MODULES = ('tensorflow', 'keras', 'cv2')
+
+# Python run in a fresh interpreter per stage; each ends by reporting the
+# modules it pulled in and its peak RSS
+SETUP = (
+    "import os, django; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rice_detect.settings'); django.setup()"
+)
+STAGES = {
+    # What every management command pays before its own work
+    'django.setup': SETUP,
+    # A web worker without gunicorn's preload_app, up to the first request
+    'wsgi app': SETUP + "\nimport rice_detect.wsgi, rice_detect.urls",
+    'asgi app': SETUP + "\nimport rice_detect.asgi, rice_detect.urls",
+    # ... and until it can classify
+    'worker with model': SETUP + "\nimport rice_detect.wsgi, rice_detect.urls\n"
+                         "from riceapp.registry import registry\nregistry.get()",
+}
+REPORT = """
+import json, sys
+from riceapp.memory import peak_rss_bytes
+print(json.dumps({'modules': [m for m in %r if m in sys.modules], 'peak_rss': peak_rss_bytes()}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Report cold-boot time, peak RSS and heavy ML imports of web workers and management commands, "
+        "each measured in a fresh interpreter."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per stage; the median is reported')
+        parser.add_argument(
+            '--commands', nargs='*', default=['check'],
+            help='manage.py commands (quoted with their arguments) to time end to end',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'stage':<32} {'median':>8} {'min':>8} {'peak RSS':>9}  heavy imports")
+        for stage, code in STAGES.items():
+            runs = [self.run_code(code) for _ in range(options['repeat'])]
+            self.write_row(stage, runs)
+        for command in options['commands']:
+            runs = [self.run_command(command) for _ in range(options['repeat'])]
+            self.write_row(f'manage.py {command}', runs)
+
+    def run_code(self, code):
+        start = time.perf_counter()
+        output = self.run([sys.executable, '-c', code + REPORT % (HEAVY_MODULES,)])
+        seconds = time.perf_counter() - start
+        report = json.loads(output.strip().splitlines()[-1])
+        return seconds, report['modules'], report['peak_rss']
+
+    def run_command(self, command):
+        start = time.perf_counter()
+        self.run([sys.executable, 'manage.py'] + command.split())
+        # Modules and memory of a bare command come from its stage above
+        return time.perf_counter() - start, None, None
+
+    def run(self, argv):
+        process = subprocess.run(argv, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise CommandError(f"{' '.join(argv[:3])} failed:\n{process.stderr[-2000:]}")
+        return process.stdout
+
+    def write_row(self, stage, runs):
+        seconds = [run[0] for run in runs]
+        modules, peak = runs[-1][1], runs[-1][2]
+        self.stdout.write(
+            f"{stage:<32} {statistics.median(seconds):7.2f}s {min(seconds):7.2f}s "
+            f"{f'{peak / 2**20:.0f} MB' if peak else '-':>9}  "
+            f"{'-' if modules is None else ', '.join(modules) or 'none'}"
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from riceapp.models import ClassificationResult
+from riceapp.query_plans import check_query_plans
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the history and stats queries and fail on full table scans or sorts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='User whose queries to plan (default: the one with most results)')
+        parser.add_argument('--show-plans', action='store_true')
+
+    def handle(self, *args, **options):
+        user_id = options['user_id']
+        if user_id is None:
+            busiest = (
+                ClassificationResult.objects.order_by().values('user_id')
+                .annotate(n=Count('id')).order_by('-n').first()
+            )
+            user_id = busiest['user_id'] if busiest else 0
+
+        try:
+            report = check_query_plans(user_id)
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+
+        failures = 0
+        for name, queries in report.items():
+            for sql, plan, problems in queries:
+                status = 'FAIL (' + ', '.join(problems) + ')' if problems else 'ok'
+                self.stdout.write(f"{name}: {status}")
+                if problems or options['show_plans']:
+                    self.stdout.write(f"  {sql}\n  " + plan.replace('\n', '\n  '))
+                failures += bool(problems)
+        if failures:
+            raise CommandError(f"{failures} quer{'y' if failures == 1 else 'ies'} on {connection.vendor} without a usable index")
@@ -0,0 +1,255 @@
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, UnidentifiedImageError
+
+from riceapp.memory import peak_rss_bytes, reset_peak_rss, rss_bytes
+from riceapp.models import ClassificationResult
+from riceapp.preprocessing import prepare_image
+from riceapp.registry import ModelVersion, registry
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+MB = 1024 * 1024
+
+
+def count_matrix(rows, columns, pairs):
+    """{row label: {column label: count}} over (row, column) pairs, every cell present."""
+    matrix = {row: dict.fromkeys(columns, 0) for row in rows}
+    for row, column in pairs:
+        matrix.setdefault(row, dict.fromkeys(columns, 0))
+        matrix[row][column] = matrix[row].get(column, 0) + 1
+    return matrix
+
+
+def folder_images(folder):
+    """[(path, label)]; photos in a sub-folder are labelled with its name, loose ones with None."""
+    images = []
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        if entry.is_dir():
+            images += [
+                (os.path.join(entry.path, name), entry.name)
+                for name in sorted(os.listdir(entry.path)) if name.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            images.append((entry.path, None))
+    return images
+
+
+class Command(BaseCommand):
+    help = (
+        "Run several model directories over a labelled image folder or the stored results and report "
+        "load time, memory, throughput per batch size, accuracy and where the models disagree."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*',
+            help='Version names under MODELS_DIR or SavedModel directories (default: every version)',
+        )
+        parser.add_argument(
+            '--images', default=os.path.join(settings.MEDIA_ROOT, 'classification_images'),
+            help='Image folder; photos in sub-folders named after a class are scored against that label',
+        )
+        parser.add_argument('--results', type=int, help='Use the images of the latest N stored results instead')
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+        parser.add_argument('--repeat', type=int, default=3, help='Timed passes per batch size')
+        parser.add_argument(
+            '--class-names', action='append', default=[], metavar='MODEL=FILE',
+            help='JSON list of labels, in output order, for a model without class_names.json',
+        )
+        parser.add_argument('--json', metavar='PATH', help='Also write the full report to this file')
+
+    def handle(self, *args, **options):
+        sources = self.image_sources(options)
+        if not sources:
+            raise CommandError("No images to compare on")
+        models = self.model_classes(self.model_paths(options['models']), self.class_name_files(options['class_names']))
+        self.skipped = set()
+
+        report = {'images': 0, 'labelled': 0, 'models': {}, 'disagreement': {}}
+        # Start the TensorFlow runtime first so that it isn't counted against the first model
+        import tensorflow as tf
+
+        tf.constant(0).numpy()
+        predictions, first = {}, None
+        for name, path, class_names in models:
+            stats, predicted, labels = self.run_model(name, path, class_names, sources, options)
+            if first is None:
+                # Unreadable images are skipped the same way for every model
+                first = name
+                labelled = [i for i, label in enumerate(labels) if label is not None]
+                report.update(images=len(labels), labelled=len(labelled))
+                self.stdout.write(f"{len(labels)} image(s), {len(labelled)} labelled")
+            predictions[name] = predicted
+            if labelled:
+                stats['accuracy'] = round(sum(predicted[i] == labels[i] for i in labelled) / len(labelled), 4)
+                stats['confusion'] = count_matrix(
+                    sorted({labels[i] for i in labelled}), stats['class_names'],
+                    [(labels[i], predicted[i]) for i in labelled],
+                )
+            report['models'][name] = stats
+            self.write_model(name, stats)
+
+        names = list(predictions)
+        for i, first in enumerate(names):
+            for second in names[i + 1:]:
+                pairs = list(zip(predictions[first], predictions[second]))
+                key = f'{first} vs {second}'
+                rows, columns = report['models'][first]['class_names'], report['models'][second]['class_names']
+                entry = report['disagreement'][key] = {'matrix': count_matrix(rows, columns, pairs)}
+                if set(rows) == set(columns):
+                    entry['rate'] = round(sum(a != b for a, b in pairs) / len(pairs), 4)
+                    title = f"{key}: disagree on {entry['rate']:.1%}"
+                else:
+                    # Predictions of different classes can only be cross-tabulated
+                    title = f"{key}: different classes, no disagreement rate"
+                self.write_matrix(f"{title} (rows {first}, columns {second})", entry['matrix'])
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['json']}")
+
+    def model_paths(self, models):
+        found = []
+        for model in models or registry.versions():
+            path = model if os.path.isdir(model) else os.path.join(registry.models_dir, model)
+            if not os.path.exists(os.path.join(path, 'saved_model.pb')):
+                raise CommandError(f"{model} is neither a version in {registry.models_dir} nor a SavedModel directory")
+            found.append((model, path))
+        return found
+
+    def model_classes(self, paths, given):
+        """[(name, path, class names)], checked against each model's output width before any model loads."""
+        from riceapp.inference import saved_model_classes
+
+        models = []
+        for name, path in paths:
+            try:
+                width = saved_model_classes(path)
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                raise CommandError(f"Can't read the outputs of {name}: {e}")
+            class_names = given.get(name) or ModelVersion(name, path).read_class_names(width)
+            if len(class_names) != width:
+                raise CommandError(f"{name} has {width} outputs but {len(class_names)} class names")
+            models.append((name, path, class_names))
+        return models
+
+    def class_name_files(self, values):
+        """{model: labels in output order} from MODEL=FILE arguments."""
+        class_names = {}
+        for value in values:
+            model, sep, path = value.partition('=')
+            if not sep:
+                raise CommandError(f"--class-names takes MODEL=FILE, not {value!r}")
+            try:
+                with open(path, encoding='utf-8') as f:
+                    class_names[model] = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read class names from {path}: {e}")
+        return class_names
+
+    def image_sources(self, options):
+        """[(name, label, opener)] of the images to compare on; nothing is decoded yet."""
+        if options['results']:
+            names = (
+                ClassificationResult.objects.exclude(image='').order_by('-id')
+                .values_list('image', flat=True)[:options['results']]
+            )
+            return [(name, None, default_storage.open) for name in names]
+        return [(path, label, open) for path, label in folder_images(options['images'])]
+
+    def batches(self, sources, size):
+        """Yield (model input batch, labels), decoding ``size`` images at a time.
+
+        Only one batch is held in memory, so a large folder costs no more
+        than a small one; each model decodes the images again.
+        """
+        arrays, labels = [], []
+        for name, label, opener in sources:
+            try:
+                with opener(name, 'rb') as f, Image.open(f) as image:
+                    arrays.append(prepare_image(image, max_pixels=settings.MAX_IMAGE_PIXELS).array)
+                    labels.append(label)
+            except (OSError, UnidentifiedImageError, ValueError) as e:
+                if name not in self.skipped:
+                    self.skipped.add(name)
+                    self.stderr.write(f"Skipping {name}: {e}")
+            if len(arrays) == size:
+                yield np.stack(arrays), labels
+                arrays, labels = [], []
+        if arrays:
+            yield np.stack(arrays), labels
+
+    def run_model(self, name, path, class_names, sources, options):
+        """Load one model and time it; returns (stats, predicted class and label of every image)."""
+        from riceapp.inference import InferenceModel
+
+        reset_peak_rss()
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        entry = ModelVersion(name, path, class_names)
+        # No padding to XLA buckets: every batch size runs as given
+        entry.model = InferenceModel(path, max_batch_size=max(options['batch_sizes']))
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        entry.model.warmup()
+        warmup_seconds = time.perf_counter() - start
+
+        predicted, labels, first_batch = [], [], None
+        for batch, batch_labels in self.batches(sources, max(options['batch_sizes'])):
+            first_batch = batch if first_batch is None else first_batch
+            predicted += [class_names[i] for i in np.argmax(entry.model.predict(batch), axis=1)]
+            labels += batch_labels
+        if first_batch is None:
+            raise CommandError("No readable images to compare on")
+
+        throughput = {}
+        for size in options['batch_sizes']:
+            # Cycle through the images when there are fewer than a batch
+            sample = first_batch[np.arange(size) % len(first_batch)]
+            entry.model.predict(sample)
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                entry.model.predict(sample)
+            elapsed = (time.perf_counter() - start) / options['repeat']
+            throughput[size] = {'batch_ms': round(elapsed * 1000, 2), 'images_per_second': round(size / elapsed, 1)}
+
+        rss_after, peak = rss_bytes(), peak_rss_bytes()
+        stats = {
+            'path': path,
+            'class_names': class_names,
+            'load_seconds': round(load_seconds, 3),
+            'warmup_seconds': round(warmup_seconds, 3),
+            'rss_growth_mb': round((rss_after - rss_before) / MB, 1) if rss_before and rss_after else None,
+            'peak_rss_mb': round(peak / MB, 1) if peak else None,
+            'throughput': throughput,
+            'predicted': {label: predicted.count(label) for label in class_names},
+        }
+        return stats, predicted, labels
+
+    def write_model(self, name, stats):
+        self.stdout.write(
+            f"\nModel {name} ({stats['path']}): loaded in {stats['load_seconds']}s, "
+            f"warm-up {stats['warmup_seconds']}s, RSS +{stats['rss_growth_mb']} MB, peak {stats['peak_rss_mb']} MB"
+        )
+        for size, row in stats['throughput'].items():
+            self.stdout.write(
+                f"  batch {size:>3}: {row['batch_ms']:9.1f} ms/batch {row['images_per_second']:8.1f} images/s"
+            )
+        self.stdout.write("  predicted: " + ', '.join(f"{label} {n}" for label, n in stats['predicted'].items()))
+        if 'accuracy' in stats:
+            self.write_matrix(f"  accuracy {stats['accuracy']:.1%} (rows label, columns prediction)", stats['confusion'])
+
+    def write_matrix(self, title, matrix):
+        self.stdout.write(title)
+        columns = list(dict.fromkeys(column for row in matrix.values() for column in row))
+        width = max([len(c) for c in columns] + [len(r) for r in matrix] + [5])
+        self.stdout.write(' ' * width + ' ' + ' '.join(f'{c:>{width}}' for c in columns))
+        for row, cells in matrix.items():
+            self.stdout.write(f'{row:>{width}} ' + ' '.join(f'{cells.get(c, 0):>{width}}' for c in columns))
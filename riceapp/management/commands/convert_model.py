@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from riceapp.inference import InferenceModel
+from riceapp.preprocessing import load_image_array
+from riceapp.quantized import QUANTIZATIONS, TFLiteModel, convert_saved_model, tflite_path
+from riceapp.registry import ModelRegistry
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def list_images(directory):
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def split_images(paths):
+    """(calibration, report) halves of ``paths``, with identical files kept on the same side.
+
+    Copies of one photo (re-uploads are stored under new names) would
+    otherwise let the report score the quantized model on its own calibration data.
+    """
+    groups = {}
+    for path in paths:
+        groups.setdefault(file_hash(path), []).append(path)
+    distinct = list(groups.values())
+    return (
+        [path for group in distinct[0::2] for path in group],
+        [path for group in distinct[1::2] for path in group],
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert SavedModels under MODELS_DIR to quantized TFLite artifacts and "
+        "write an accuracy-diff report against the original model."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('versions', nargs='*', help='Model versions to convert (default: the active one)')
+        parser.add_argument('--quantization', choices=QUANTIZATIONS, default='int8')
+        parser.add_argument(
+            '--images',
+            default=os.path.join(settings.MEDIA_ROOT, 'classification_images'),
+            help='Images used for int8 calibration (and, without --report-images, half of them for the report)',
+        )
+        parser.add_argument(
+            '--report-images',
+            help='Separate image folder for the accuracy report; nothing in it is used for calibration',
+        )
+        parser.add_argument('--calibration-size', type=int, default=100)
+        parser.add_argument('--skip-report', action='store_true')
+
+    def handle(self, *args, **options):
+        registry = ModelRegistry()
+        versions = options['versions'] or [registry.active_version]
+        images = self.folder_images(options['images'])
+        if options['report_images']:
+            calibration_images, report_images = images, self.folder_images(options['report_images'])
+        elif options['quantization'] == 'int8':
+            calibration_images, report_images = split_images(images)
+            if not report_images:
+                raise CommandError(
+                    f"{options['images']} holds a single distinct image; pass --report-images to measure accuracy"
+                )
+        else:
+            calibration_images, report_images = [], images
+        calibration_images = calibration_images[:options['calibration_size']]
+        if options['quantization'] == 'int8':
+            # A report folder can hold copies of calibration photos too
+            calibration_hashes = {file_hash(path) for path in calibration_images}
+            report_images = [path for path in report_images if file_hash(path) not in calibration_hashes]
+            if not report_images:
+                raise CommandError("Every report image is also a calibration image")
+        calibration_arrays = [load_image_array(path) for path in calibration_images]
+
+        for version in versions:
+            if version not in registry.versions():
+                raise CommandError(f"Unknown model version {version!r}")
+            model_dir = os.path.join(registry.models_dir, version)
+            quantization = options['quantization']
+            output = tflite_path(model_dir, quantization)
+
+            start = time.perf_counter()
+            calibration = calibration_arrays if quantization == 'int8' else None
+            flatbuffer = convert_saved_model(model_dir, quantization, calibration)
+            with open(output, 'wb') as f:
+                f.write(flatbuffer)
+            self.stdout.write(
+                f"Model {version}: wrote {output} ({len(flatbuffer) / 1024:.0f} KiB) "
+                f"in {time.perf_counter() - start:.1f}s"
+            )
+
+            if options['skip_report']:
+                continue
+            report = self.accuracy_report(
+                registry, version, output, report_images, len(calibration) if calibration is not None else 0,
+            )
+            report_path = output[:-len('.tflite')] + '.report.json'
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            summary = report['summary']
+            self.stdout.write(
+                f"  top-1 agreement {summary['top1_agreement']:.2%} over {summary['images']} images "
+                f"(none of the {summary['calibration_images']} calibration images), "
+                f"max |Δp| {summary['max_abs_probability_diff']:.4f}, "
+                f"latency {summary['original_ms_per_image']:.1f}ms -> {summary['quantized_ms_per_image']:.1f}ms"
+            )
+            self.stdout.write(f"  report: {report_path}")
+
+    def folder_images(self, folder):
+        if not os.path.isdir(folder):
+            raise CommandError(f"Image folder {folder} does not exist")
+        images = list_images(folder)
+        if not images:
+            raise CommandError(f"No images found in {folder}")
+        return images
+
+    def accuracy_report(self, registry, version, path, images, calibration_count):
+        # Always compare against the full-precision SavedModel, whatever INFERENCE_BACKEND says
+        original = InferenceModel(os.path.join(registry.models_dir, version))
+        quantized = TFLiteModel(path)
+        class_names = registry.class_names(version)
+
+        rows = []
+        original_seconds = quantized_seconds = 0.0
+        for image_path in images:
+            batch = np.expand_dims(load_image_array(image_path), 0)
+            start = time.perf_counter()
+            expected = original.predict(batch)[0]
+            original_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            actual = quantized.predict(batch)[0]
+            quantized_seconds += time.perf_counter() - start
+            rows.append({
+                'image': os.path.basename(image_path),
+                'original': class_names[int(np.argmax(expected))],
+                'quantized': class_names[int(np.argmax(actual))],
+                'max_abs_probability_diff': round(float(np.max(np.abs(expected - actual))), 5),
+            })
+
+        disagreements = [row for row in rows if row['original'] != row['quantized']]
+        diffs = [row['max_abs_probability_diff'] for row in rows]
+        return {
+            'model_version': version,
+            'artifact': os.path.basename(path),
+            'summary': {
+                'images': len(rows),
+                # Disjoint from the images scored above
+                'calibration_images': calibration_count,
+                'top1_agreement': 1 - len(disagreements) / len(rows),
+                'mean_abs_probability_diff': round(float(np.mean(diffs)), 5),
+                'max_abs_probability_diff': round(float(np.max(diffs)), 5),
+                'original_ms_per_image': round(1000 * original_seconds / len(rows), 2),
+                'quantized_ms_per_image': round(1000 * quantized_seconds / len(rows), 2),
+                'original_size_bytes': sum(
+                    os.path.getsize(os.path.join(root, name))
+                    for root, _, names in os.walk(os.path.join(registry.models_dir, version))
+                    for name in names
+                    if not name.endswith(('.tflite', '.json'))
+                ),
+                'quantized_size_bytes': os.path.getsize(path),
+            },
+            'disagreements': disagreements,
+        }
@@ -0,0 +1,85 @@
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from riceapp.models import ClassificationJob, ClassificationResult, StoredFile
+from riceapp.thumbnails import delete_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Delete uploads that no classification result has referenced for a TTL."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-hours', type=float, default=settings.UPLOAD_GC_TTL_HOURS)
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument(
+            '--untracked',
+            action='store_true',
+            help='Also delete unreferenced files stored before content addressing '
+                 '(in classification_images/ and the MEDIA_ROOT top level)',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['ttl_hours'])
+        # Uploads waiting for an inference worker have no result yet
+        pending_jobs = set(
+            ClassificationJob.objects
+            .filter(status__in=[ClassificationJob.QUEUED, ClassificationJob.RUNNING])
+            .values_list('image', flat=True)
+        )
+
+        deleted = freed = 0
+        candidates = StoredFile.objects.filter(refcount__lte=0, touched_at__lt=cutoff).values_list('id', 'name')
+        for file_id, name in list(candidates):
+            if name in pending_jobs:
+                continue
+            with transaction.atomic():
+                # Re-check under the row lock: an upload of the same bytes may have just touched it
+                record = (
+                    StoredFile.objects.select_for_update()
+                    .filter(id=file_id, refcount__lte=0, touched_at__lt=cutoff).first()
+                )
+                if record is None:
+                    continue
+                if not options['dry_run']:
+                    default_storage.delete(name)
+                    delete_thumbnails(name)
+                    record.delete()
+            deleted += 1
+            freed += record.size
+
+        if options['untracked']:
+            for name, size in self.untracked_files(cutoff, pending_jobs):
+                if not options['dry_run']:
+                    default_storage.delete(name)
+                    delete_thumbnails(name)
+                deleted += 1
+                freed += size
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(f"{verb} {deleted} file(s), {freed / 2**20:.1f} MiB")
+
+    def untracked_files(self, cutoff, pending_jobs):
+        """Old files with neither a StoredFile row nor a result or job pointing at them."""
+        referenced = set(ClassificationResult.objects.values_list('image', flat=True)) | pending_jobs
+        tracked = set(StoredFile.objects.values_list('name', flat=True))
+        root = settings.MEDIA_ROOT
+        paths = [
+            os.path.join(root, entry) for entry in os.listdir(root)
+            if os.path.isfile(os.path.join(root, entry))
+        ]
+        for directory, _, files in os.walk(os.path.join(root, 'classification_images')):
+            paths.extend(os.path.join(directory, f) for f in files)
+
+        for path in paths:
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if name in referenced or name in tracked or os.path.basename(name).startswith('.'):
+                continue
+            stat = os.stat(path)
+            if datetime.fromtimestamp(stat.st_mtime, tz=cutoff.tzinfo) < cutoff:
+                yield name, stat.st_size
@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import time
+from functools import partial
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from PIL import UnidentifiedImageError
+
+from riceapp.models import ClassificationResult
+from riceapp.thumbnails import generate_thumbnails
+
+
+def generate(name, overwrite):
+    """Pool task: returns (name, original width, number of files written, error or None)."""
+    try:
+        image_width, written = generate_thumbnails(name, overwrite=overwrite)
+        return name, image_width, len(written), None
+    except (OSError, UnidentifiedImageError) as e:
+        return name, None, 0, str(e)
+
+
+class Command(BaseCommand):
+    help = "Generate the WebP/JPEG thumbnails of stored classification images, in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--overwrite', action='store_true', help='Regenerate thumbnails that already exist')
+
+    def handle(self, *args, **options):
+        results = ClassificationResult.objects.exclude(image='')
+        if not options['overwrite']:
+            results = results.filter(thumbnails_ready=False)
+        ids_by_name = {}
+        for result_id, name in results.values_list('id', 'image'):
+            ids_by_name.setdefault(name, []).append(result_id)
+        self.stdout.write(f"{len(ids_by_name)} image(s) to process with {options['processes']} process(es)")
+
+        # Pool workers only read and write files; they never touch the database
+        connections.close_all()
+        start = time.perf_counter()
+        done, written, failed = {}, 0, 0
+        with multiprocessing.Pool(options['processes'], initializer=django.setup) as pool:
+            tasks = pool.imap_unordered(partial(generate, overwrite=options['overwrite']), ids_by_name, chunksize=4)
+            for name, image_width, count, error in tasks:
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{name}: {error}")
+                    continue
+                written += count
+                done.setdefault(image_width, []).extend(ids_by_name[name])
+
+        # One UPDATE per distinct width (photos mostly share a handful)
+        for image_width, ids in done.items():
+            for i in range(0, len(ids), 500):
+                ClassificationResult.objects.filter(id__in=ids[i:i + 500]).update(
+                    thumbnails_ready=True, image_width=image_width,
+                )
+        self.stdout.write(
+            f"Wrote {written} thumbnail(s) for {len(ids_by_name) - failed} image(s) "
+            f"in {time.perf_counter() - start:.1f}s; {failed} failed"
+        )
@@ -0,0 +1,364 @@
+import copy
+import itertools
+import json
+import mimetypes
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from PIL import Image
+
+from riceapp.memory import child_pids, peak_rss_bytes, reset_peak_rss
+from riceapp.models import ClassificationResult, StoredFile
+from riceapp.thumbnails import thumbnail_executor
+
+SCENARIOS = ('classify', 'history', 'detail')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+MB = 1024 * 1024
+
+
+def unique_upload(path, tag):
+    """A photo with a trailer after its image data, which decoders ignore.
+
+    Every upload of the run is then new to the prediction cache, including
+    repeats of a photo, and is stored under a name of its own.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return SimpleUploadedFile(os.path.basename(path), data + f'\n{tag}'.encode(), content_type=content_type)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class InProcessTarget:
+    """Requests through Django's test client, in this process, one client per thread."""
+
+    name = 'inprocess'
+
+    def __init__(self, session_cookie):
+        self.session_cookie = session_cookie
+        self.local = threading.local()
+
+    def client(self):
+        if not hasattr(self.local, 'client'):
+            # Server errors count as failed requests instead of stopping the run
+            self.local.client = Client(raise_request_exception=False)
+            self.local.client.cookies[settings.SESSION_COOKIE_NAME] = self.session_cookie
+        return self.local.client
+
+    def get(self, path):
+        return self.client().get(path, secure=True).status_code
+
+    def post_image(self, path, upload):
+        return self.client().post(path, {'image': upload}, secure=True).status_code
+
+    def worker_pids(self):
+        return [os.getpid()]
+
+    def close(self):
+        # Thumbnails queued by the run must be made while MEDIA_ROOT still points at its files
+        thumbnail_executor.submit(lambda: None).result()
+
+
+class GunicornTarget:
+    """Requests over HTTP to a gunicorn started for the run, sharing this database."""
+
+    name = 'gunicorn'
+
+    def __init__(self, session_cookie, workers, media_root, log_path, cache_prefix, interface='wsgi'):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.base = f'http://127.0.0.1:{self.port}'
+        # Not DEBUG: the server believes a proxy terminated HTTPS for it
+        scheme = 'http' if settings.DEBUG else 'https'
+        csrf_secret = get_random_string(32)
+        self.headers = {
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={session_cookie}; {settings.CSRF_COOKIE_NAME}={csrf_secret}',
+            'X-CSRFToken': csrf_secret,
+            'X-Forwarded-Proto': scheme,
+            'Origin': f'{scheme}://127.0.0.1:{self.port}',
+        }
+        env = dict(
+            os.environ, MEDIA_ROOT=media_root, LOG_REQUEST_MEMORY='False', WEB_CONCURRENCY=str(workers),
+            SERVER_INTERFACE=interface, PREDICTION_CACHE_KEY_PREFIX=cache_prefix, PHASH_MAX_DISTANCE='-1',
+        )
+        self.log = open(log_path, 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', f'rice_detect.{interface}:application', '--bind', f'127.0.0.1:{self.port}'],
+            cwd=settings.BASE_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        self.wait_ready(workers)
+
+    def wait_ready(self, workers, timeout=180):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise CommandError(f"gunicorn exited with status {self.process.returncode}; see {self.log.name}")
+            try:
+                if self.get('/') == 200 and len(self.worker_pids()) >= workers:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.5)
+        self.close()
+        raise CommandError(f"gunicorn did not answer within {timeout}s; see {self.log.name}")
+
+    def request(self, path, data=None, content_type=None):
+        headers = dict(self.headers)
+        if content_type:
+            headers['Content-Type'] = content_type
+        request = urllib.request.Request(self.base + path, data=data, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def get(self, path):
+        return self.request(path)
+
+    def post_image(self, path, upload):
+        return self.request(path, encode_multipart(BOUNDARY, {'image': upload}), MULTIPART_CONTENT)
+
+    def worker_pids(self):
+        return child_pids(self.process.pid)
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay leaf photos against /classify/, /history/ and the result page at a set concurrency; "
+        "report latency percentiles, requests/s and peak RSS per worker, and compare with a JSON baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['inprocess', 'gunicorn'], default='inprocess')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=50, help='Requests per scenario')
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (gunicorn mode)')
+        parser.add_argument(
+            '--interface', choices=['wsgi', 'asgi'], default='wsgi',
+            help='Serve the WSGI app with threads or the ASGI app with uvicorn workers (gunicorn mode)',
+        )
+        parser.add_argument(
+            '--source', default=os.path.join(settings.MEDIA_ROOT, 'classification_images'),
+            help='Folder of leaf photos to upload',
+        )
+        parser.add_argument('--synthetic', type=int, default=2, help='Number of synthetic camera photos to add')
+        parser.add_argument('--size', default='4000x3000', help='Synthetic photo size (12 MP by default)')
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the report to this JSON file')
+        parser.add_argument('--baseline', metavar='PATH', help='Fail if worse than this earlier report')
+        parser.add_argument(
+            '--max-regression', type=float, default=0.2,
+            help='Allowed relative increase of p95 latency / decrease of requests/s against the baseline',
+        )
+
+    def handle(self, *args, **options):
+        work_dir = tempfile.mkdtemp(prefix='load-test-')
+        media_root = os.path.join(work_dir, 'media')
+        self.run_tag = f'load-test-{get_random_string(8).lower()}'
+        user = User.objects.create_user(self.run_tag, password=None)
+        # Classify requests must reach the model: nothing cached before the
+        # run is visible to it, and near-duplicate reuse is off
+        caches_setting = copy.deepcopy(settings.CACHES)
+        caches_setting[settings.PREDICTION_CACHE_ALIAS]['KEY_PREFIX'] = self.run_tag
+        try:
+            images = self.images(options, work_dir)
+            client = Client()
+            client.force_login(user)
+            session_cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+            overrides = override_settings(
+                MEDIA_ROOT=media_root, ALLOWED_HOSTS=['*'], SECURE_SSL_REDIRECT=False, LOG_REQUEST_MEMORY=False,
+                CACHES=caches_setting, PHASH_MAX_DISTANCE=-1,
+            )
+            with overrides:
+                if options['mode'] == 'gunicorn':
+                    target = GunicornTarget(
+                        session_cookie, options['workers'], media_root, os.path.join(work_dir, 'gunicorn.log'),
+                        self.run_tag, options['interface'],
+                    )
+                else:
+                    target = InProcessTarget(session_cookie)
+                try:
+                    report = self.run(target, user, images, options)
+                finally:
+                    target.close()
+                    self.forget_cached_predictions()
+        finally:
+            self.delete_run_data(user)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Baseline written to {options['save_baseline']}")
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['max_regression'])
+
+    def forget_cached_predictions(self):
+        """Drop the run's rows from a database prediction cache; other backends let them expire."""
+        alias = settings.PREDICTION_CACHE_ALIAS
+        if settings.CACHES[alias]['BACKEND'] != 'django.core.cache.backends.db.DatabaseCache':
+            return
+        table = connection.ops.quote_name(settings.CACHES[alias]['LOCATION'])
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE cache_key LIKE %s", [f'{self.run_tag}:%'])
+
+    def delete_run_data(self, user):
+        # The uploads carry the run tag, so these names belong to no other result
+        names = list(ClassificationResult.objects.filter(user=user).values_list('image', flat=True))
+        # Cascades to the results; their files are in the temporary MEDIA_ROOT
+        user.delete()
+        StoredFile.objects.filter(name__in=names).delete()
+
+    def images(self, options, work_dir):
+        source = options['source']
+        photos = sorted(
+            os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not photos:
+            raise CommandError(f"No photos in {source}")
+        width, height = (int(v) for v in options['size'].lower().split('x'))
+        for i, path in enumerate(photos[:options['synthetic']]):
+            synthetic = os.path.join(work_dir, f'camera_{i}.jpg')
+            with Image.open(path) as image:
+                image.convert('RGB').resize((width, height), Image.BICUBIC).save(synthetic, 'JPEG', quality=92)
+            photos.insert(2 * i, synthetic)
+        return photos
+
+    def run(self, target, user, images, options):
+        report = {
+            'mode': target.name,
+            'interface': options['interface'] if target.name == 'gunicorn' else None,
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'workers': len(target.worker_pids()),
+            'release': settings.RELEASE,
+            'created': timezone.now().isoformat(),
+            'scenarios': {},
+        }
+        server = f"{target.name} ({report['interface']})" if report['interface'] else target.name
+        self.stdout.write(
+            f"{server}, {report['workers']} worker(s), concurrency {options['concurrency']}, "
+            f"{options['requests']} requests per scenario, {len(images)} photos"
+        )
+        for scenario in SCENARIOS:
+            if scenario not in options['scenarios']:
+                continue
+            if scenario == 'classify':
+                photos = itertools.cycle(images)
+                calls = [
+                    lambda photo=next(photos), tag=f'{self.run_tag} {i}': target.post_image(
+                        '/classify/', unique_upload(photo, tag),
+                    )
+                    for i in range(options['requests'])
+                ]
+            elif scenario == 'history':
+                calls = [lambda: target.get('/history/')] * options['requests']
+            else:
+                ids = list(ClassificationResult.objects.filter(user=user).values_list('id', flat=True))
+                if not ids:
+                    self.stderr.write("detail: skipped, no results (run the classify scenario too)")
+                    continue
+                result_ids = itertools.cycle(ids)
+                calls = [lambda i=next(result_ids): target.get(f'/history/{i}/') for _ in range(options['requests'])]
+            stats = self.measure(target, calls, options['concurrency'])
+            report['scenarios'][scenario] = stats
+            self.stdout.write(
+                f"{scenario:>9}: p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  "
+                f"p99 {stats['p99_ms']:8.1f} ms  {stats['rps']:7.1f} req/s  {stats['errors']} error(s)  "
+                f"peak RSS {', '.join(f'{mb:.0f}' for mb in stats['peak_rss_mb'])} MB"
+            )
+        return report
+
+    def measure(self, target, calls, concurrency):
+        pids = target.worker_pids()
+        for pid in pids:
+            reset_peak_rss(None if pid == os.getpid() else pid)
+
+        def timed(call):
+            start = time.perf_counter()
+            try:
+                status = call()
+            except OSError:
+                status = None
+            elapsed = time.perf_counter() - start
+            if target.name == 'inprocess':
+                # The test client leaves each thread's connection open
+                connection.close()
+            return elapsed, status
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            samples = list(executor.map(timed, calls))
+        wall = time.perf_counter() - start
+
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        peaks = [peak_rss_bytes(None if pid == os.getpid() else pid) for pid in pids]
+        return {
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'rps': round(len(samples) / wall, 2),
+            'errors': sum(status is None or status >= 400 for _, status in samples),
+            'peak_rss_mb': [round(peak / MB, 1) for peak in peaks if peak is not None],
+        }
+
+    def compare(self, report, path, max_regression):
+        with open(path) as f:
+            baseline = json.load(f)
+        for setting in ('mode', 'interface', 'concurrency', 'requests', 'workers'):
+            if baseline.get(setting) != report.get(setting):
+                raise CommandError(
+                    f"{path} was measured with {setting}={baseline.get(setting)}, this run used {report.get(setting)}"
+                )
+        regressions = []
+        for scenario, stats in report['scenarios'].items():
+            before = baseline.get('scenarios', {}).get(scenario)
+            if before is None:
+                continue
+            if stats['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+                regressions.append(f"{scenario}: p95 {before['p95_ms']} -> {stats['p95_ms']} ms")
+            if stats['rps'] < before['rps'] * (1 - max_regression):
+                regressions.append(f"{scenario}: {before['rps']} -> {stats['rps']} req/s")
+            if stats['errors'] > before['errors']:
+                regressions.append(f"{scenario}: {before['errors']} -> {stats['errors']} errors")
+        if regressions:
+            raise CommandError(
+                f"Regressed by more than {max_regression:.0%} against {path}:\n  " + '\n  '.join(regressions)
+            )
+        self.stdout.write(f"Within {max_regression:.0%} of {path}")
@@ -0,0 +1,83 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from riceapp.models import ClassificationResult
+
+DB_SESSIONS = 'django.contrib.sessions.backends.db'
+
+
+class Command(BaseCommand):
+    help = "Count the database queries per request of the main pages, for each session engine."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engines', nargs='+', default=[DB_SESSIONS, settings.SESSION_ENGINE],
+            help='Session engines to compare (default: the plain database one and the configured one)',
+        )
+        parser.add_argument(
+            '--image', default=str(settings.BASE_DIR / 'media' / 'classification_images' / 'aug_0_33.jpg'),
+            help='Leaf photo to post to /classify/',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'engine':<12} {'page':<15} {'first':>12} {'repeat':>12}   (session queries)")
+        for engine in dict.fromkeys(options['engines']):
+            for page, counts in self.measure(engine, options['image']).items():
+                cells = [f"{total} ({session})" for total, session in counts]
+                self.stdout.write(f"{engine.rsplit('.', 1)[-1]:<12} {page:<15} {cells[0]:>12} {cells[1]:>12}")
+
+    def measure(self, engine, image):
+        """{page: [(queries, session queries) of the first request, of the repeat]}
+
+        Runs against the configured database in a transaction that is rolled
+        back, with uploads going to a temporary MEDIA_ROOT.
+        """
+        media_root = tempfile.mkdtemp()
+        overrides = override_settings(
+            SESSION_ENGINE=engine, MEDIA_ROOT=media_root, ALLOWED_HOSTS=['*'],
+            SECURE_SSL_REDIRECT=False, LOG_REQUEST_MEMORY=False,
+        )
+        report = {}
+        try:
+            with overrides, transaction.atomic():
+                user = User.objects.create_user('query-count', password=None)
+                client = Client()
+                client.force_login(user)
+
+                def upload():
+                    with open(image, 'rb') as f:
+                        return client.post('/classify/', {'image': f})
+
+                pages = [
+                    ('home', lambda: client.get('/')),
+                    ('classify form', lambda: client.get('/classify/')),
+                    ('classify', upload),
+                    ('history', lambda: client.get('/history/')),
+                    ('detail', lambda: client.get(f'/history/{self.latest_result(user)}/')),
+                ]
+                for page, request in pages:
+                    report[page] = [self.count(request) for _ in range(2)]
+                # Drops the session from the cache as well
+                client.logout()
+                transaction.set_rollback(True)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+        return report
+
+    def latest_result(self, user):
+        return ClassificationResult.objects.filter(user=user).latest('id').id
+
+    def count(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        if response.status_code >= 400:
+            self.stderr.write(f"HTTP {response.status_code} from {response.request['PATH_INFO']}")
+        session = sum('django_session' in query['sql'] for query in queries.captured_queries)
+        return len(queries), session
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from riceapp.stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-user classification rollups from ClassificationResult."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='Only rebuild these users (default: everyone)')
+
+    def handle(self, *args, **options):
+        count = rebuild_user_stats(options['user_ids'] or None)
+        self.stdout.write(f"Rebuilt classification stats for {count} user(s)")
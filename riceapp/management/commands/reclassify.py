@@ -0,0 +1,164 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from PIL import Image, UnidentifiedImageError
+
+from riceapp.classification import prediction_fields
+from riceapp.models import ClassificationResult
+from riceapp.preprocessing import ImageTooLarge, prepare_image
+from riceapp.registry import ModelUnavailable, registry
+from riceapp.stats import rescore_results
+
+UPDATE_FIELDS = ['predicted_class', 'confidence', 'class_probabilities', 'disease_info_version', 'model_version']
+
+
+def init_decoder():
+    django.setup()
+
+
+def paced(items, rate):
+    """Yields the items no faster than `rate` per second (0: unthrottled)."""
+    interval, next_at = 1 / rate if rate else 0, time.perf_counter()
+    for item in items:
+        if interval:
+            time.sleep(max(0, next_at - time.perf_counter()))
+            next_at += interval
+        yield item
+
+
+def decode(item):
+    """Pool task: (result id, model input or None, error or None). Never touches TensorFlow."""
+    result_id, name = item
+    try:
+        with default_storage.open(name, 'rb') as f, Image.open(f) as image:
+            return result_id, prepare_image(image, max_pixels=settings.MAX_IMAGE_PIXELS).array, None
+    except (OSError, UnidentifiedImageError, ImageTooLarge, Image.DecompressionBombError) as e:
+        return result_id, None, str(e)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-score stored classification results with another model version, resumably, "
+        "decoding in a process pool and throttled to run next to live traffic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-version', help='Model version to score with (default: MODEL_VERSION)')
+        parser.add_argument('--chunk-size', type=int, default=256, help='Results read and written per transaction')
+        parser.add_argument('--batch-size', type=int, default=32, help='Images per forward pass')
+        parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+        parser.add_argument('--max-rate', type=float, default=0, help='Images per second at most (0: unthrottled)')
+        parser.add_argument('--nice', type=int, default=10, help='Niceness added to this command and its decoders')
+        parser.add_argument('--tf-threads', type=int, default=0, help='TensorFlow intra-op threads (0: TF default)')
+        parser.add_argument('--checkpoint', help='Progress file (default: one per model in the temp directory)')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint of an earlier run')
+
+    def handle(self, *args, **options):
+        version = options['model_version'] or registry.active_version
+        tag = registry.model_tag(version)
+        path = options['checkpoint'] or os.path.join(tempfile.gettempdir(), f'reclassify-{tag}.json')
+        checkpoint = {'model_tag': tag, 'last_id': 0, 'updated': 0, 'failed': 0}
+        if os.path.exists(path) and not options['restart']:
+            with open(path) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('model_tag') != tag:
+                raise CommandError(f"{path} belongs to a run with {checkpoint.get('model_tag')}; pass --restart")
+            self.stdout.write(f"Resuming after result {checkpoint['last_id']} ({checkpoint['updated']} done)")
+
+        # Results already scored by this model are skipped, so an interrupted
+        # run without its checkpoint loses nothing either; the checkpoint also
+        # skips past images that could not be read
+        pending = ClassificationResult.objects.exclude(model_version=tag).exclude(image='').order_by('id')
+        self.stdout.write(f"{pending.filter(id__gt=checkpoint['last_id']).count()} result(s) to re-score with {tag}")
+
+        if options['nice']:
+            # Inherited by the decoders
+            os.nice(options['nice'])
+        # The pool is forked before TensorFlow starts, which would deadlock the children
+        connections.close_all()
+        pool = multiprocessing.Pool(options['processes'], initializer=init_decoder)
+        try:
+            if options['tf_threads'] and registry.backend == 'tensorflow':
+                import tensorflow as tf
+
+                tf.config.threading.set_intra_op_parallelism_threads(options['tf_threads'])
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            try:
+                model = registry.get(version)
+            except ModelUnavailable as e:
+                raise CommandError(str(e))
+            class_names = registry.class_names(version)
+
+            start = time.perf_counter()
+            while True:
+                # Keyset chunks rather than one long-lived cursor: rows are
+                # updated while the run goes on
+                rows = list(
+                    pending.filter(id__gt=checkpoint['last_id'])
+                    .values_list('id', 'image')[:options['chunk_size']]
+                )
+                if not rows:
+                    break
+                updated = self.score_chunk(pool, model, class_names, tag, rows, checkpoint, options)
+                checkpoint['last_id'] = rows[-1][0]
+                checkpoint['updated'] += updated
+                self.save_checkpoint(path, checkpoint)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"up to id {checkpoint['last_id']}: {checkpoint['updated']} re-scored, "
+                    f"{checkpoint['failed']} unreadable ({len(rows) / max(elapsed, 1e-9):.1f}/s this chunk)"
+                )
+                start = time.perf_counter()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.stdout.write(f"Done: {checkpoint['updated']} re-scored, {checkpoint['failed']} unreadable")
+
+    def score_chunk(self, pool, model, class_names, tag, rows, checkpoint, options):
+        decoded = []
+        # imap hands out tasks as fast as its input yields them, so the rate is
+        # kept where rows go in: the reads and decodes follow it, and so does
+        # the inference on what they return
+        for result_id, array, error in pool.imap(decode, paced(rows, options['max_rate']), chunksize=4):
+            if error:
+                checkpoint['failed'] += 1
+                self.stderr.write(f"Result {result_id}: {error}")
+            else:
+                decoded.append((result_id, array))
+
+        changes = []
+        for i in range(0, len(decoded), options['batch_size']):
+            batch = decoded[i:i + options['batch_size']]
+            predictions = model.predict(np.stack([array for _, array in batch]))
+            for (result_id, _), row in zip(batch, predictions):
+                result = ClassificationResult(id=result_id, model_version=tag)
+                for field, value in prediction_fields(row, class_names).items():
+                    setattr(result, field, value)
+                changes.append(result)
+        with transaction.atomic():
+            # The rollups only follow inserts; they get the change of class and
+            # confidence in the same transaction as the rows
+            before = ClassificationResult.objects.select_for_update().only(
+                'user_id', 'predicted_class', 'confidence',
+            ).in_bulk([result.id for result in changes])
+            # Deleted while the chunk was scored
+            changes = [result for result in changes if result.id in before]
+            ClassificationResult.objects.bulk_update(changes, UPDATE_FIELDS, batch_size=500)
+            rescore_results((before[result.id], result) for result in changes)
+        return len(changes)
+
+    def save_checkpoint(self, path, checkpoint):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_path, path)
@@ -0,0 +1,76 @@
+import multiprocessing
+import signal
+import threading
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def worker_main(batch_size, poll_interval):
+    # Ctrl-C reaches the whole process group; the parent stops each worker
+    # with SIGTERM, which lets it finish the jobs it has claimed
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    django.setup()
+    # Never share the parent's database connections across fork
+    connections.close_all()
+
+    from riceapp.jobs import Worker
+
+    Worker(batch_size=batch_size, poll_interval=poll_interval).run(stop_event)
+
+
+class Command(BaseCommand):
+    help = "Run a pool of inference worker processes for queued classification jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Number of worker processes')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.INFERENCE_MAX_BATCH_SIZE,
+            help='Most jobs a worker claims and classifies together',
+        )
+        parser.add_argument('--poll-interval', type=float, default=settings.JOB_POLL_INTERVAL)
+
+    def handle(self, *args, **options):
+        # Workers are forked before anything touches TensorFlow or the database,
+        # and each loads its own model
+        connections.close_all()
+        worker_args = (options['batch_size'], options['poll_interval'])
+        stopping = []
+
+        def stop(*args):
+            stopping.append(True)
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        processes = []
+        for _ in range(options['processes']):
+            process = multiprocessing.Process(target=worker_main, args=worker_args)
+            process.start()
+            processes.append(process)
+        self.stdout.write(f"Started {len(processes)} inference worker(s): {[p.pid for p in processes]}")
+
+        # Replace workers that die (e.g. killed for memory) until asked to stop
+        while not stopping:
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    self.stderr.write(f"Worker {process.pid} exited with code {process.exitcode}; restarting")
+                    processes[i] = multiprocessing.Process(target=worker_main, args=worker_args)
+                    processes[i].start()
+            time.sleep(1)
+
+        self.stdout.write("Stopping inference workers")
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + settings.JOB_TIMEOUT_SECONDS
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
@@ -0,0 +1,67 @@
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _proc_status(field, pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def rss_bytes():
+    """Current resident set size of this process, in bytes (None if unknown)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No procfs (macOS): fall back to the peak, which is the best we have
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes(pid=None):
+    """Peak resident set size since start or the last ``reset_peak_rss``, in bytes.
+
+    ``pid`` reads another process (procfs only). Returns None where it can't
+    be measured (Windows).
+    """
+    peak = _proc_status('VmHWM', pid or 'self')
+    if peak is not None or pid is not None:
+        return peak
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux but bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss(pid=None):
+    """Reset the peak RSS counter to the current RSS (Linux only).
+
+    Returns False when the platform can't do it, in which case
+    ``peak_rss_bytes`` keeps reporting the peak since process start.
+    """
+    try:
+        with open(f'/proc/{pid or "self"}/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def child_pids(pid):
+    """Direct children of a process, e.g. the workers of a gunicorn master (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
@@ -0,0 +1,181 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Histogram buckets (seconds) of the per-stage timers
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help); every metric written must be declared here
+METRICS = {
+    'rice_stage_seconds': ('histogram', 'Time spent in each stage of the classify pipeline'),
+    'rice_leaf_check_rejections_total': ('counter', 'Uploads rejected by the leaf check'),
+    'rice_predictions_total': ('counter', 'Predictions by predicted class and by where they came from'),
+    'rice_upload_errors_total': ('counter', 'Uploads that could not be read'),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _bucket_label(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class Metrics:
+    """Counters and histograms of one process, aggregated across processes on read.
+
+    Each process keeps its samples in memory and a background thread writes
+    them, at most once a second, to METRICS_DIR/<pid>.json. ``render`` sums
+    the files of every process (gunicorn workers, inference workers) into
+    the Prometheus text format. Without METRICS_DIR only this process is
+    reported.
+    """
+
+    def __init__(self, flush_interval=1.0):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.dirty = False
+        self.flusher_pid = None
+
+    def _key(self, name, labels):
+        if name not in METRICS:
+            raise KeyError(f"Undeclared metric {name!r}")
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            self._changed()
+
+    def observe(self, name, value, buckets=STAGE_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+            self._changed()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('rice_stage_seconds', time.perf_counter() - start, stage=stage)
+
+    def _changed(self):
+        self.dirty = True
+        # One flusher per process; a forked child starts its own
+        if self.flusher_pid != os.getpid() and settings.METRICS_DIR:
+            self.flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            self.dirty = False
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, dict(h, counts=list(h['counts']))] for (name, labels), h in self.histograms.items()],
+            }
+
+    def flush(self):
+        directory = settings.METRICS_DIR
+        if not directory or not self.dirty:
+            return
+        data = self.snapshot()
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, os.path.join(directory, f'{os.getpid()}.json'))
+
+    def collect(self):
+        """Snapshots of every process that reported, this one included."""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return [self.snapshot()]
+        self.dirty = True
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Being replaced or left half-written by a killed process
+                continue
+        return snapshots
+
+    def render(self):
+        counters, histograms = {}, {}
+        for snapshot in self.collect():
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, h in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, {'buckets': h['buckets'], 'counts': [0] * len(h['counts']), 'sum': 0.0, 'count': 0})
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], h['counts'])]
+                merged['sum'] += h['sum']
+                merged['count'] += h['count']
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+            for (metric, labels), h in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(h['buckets'] + [float('inf')], h['counts'] + [h['count'] - sum(h['counts'])]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels, [("le", _bucket_label(bound))])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {h["sum"]}')
+                lines.append(f'{name}_count{_labels(labels)} {h["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def remove_dead(self):
+        """Delete the files of processes that have exited (run when the server starts)."""
+        directory = settings.METRICS_DIR
+        for path in glob.glob(os.path.join(directory, '*.json')) if directory else []:
+            try:
+                os.kill(int(os.path.basename(path)[:-5]), 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                os.remove(path)
+            except PermissionError:
+                pass
+
+
+metrics = Metrics()
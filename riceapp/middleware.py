@@ -0,0 +1,129 @@
+import threading
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .memory import peak_rss_bytes, reset_peak_rss, rss_bytes
+
+MB = 1024 * 1024
+
+
+class PeakMemoryMiddleware:
+    """Logs the peak RSS reached while each request was being handled.
+
+    The kernel keeps one peak per process, so it is reset only when no other
+    request is in flight in this worker. Requests that overlapped another
+    one report the peak of the whole overlap and are marked as shared; size
+    worker memory by the largest peaks either way. Streaming responses are
+    measured once their body has been sent.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.LOG_REQUEST_MEMORY:
+            return self.get_response(request)
+
+        before, alone = self.start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.finish(request, before, alone)
+            raise
+        return self.measure(response, request, before, alone)
+
+    async def __acall__(self, request):
+        if not settings.LOG_REQUEST_MEMORY:
+            return await self.get_response(request)
+
+        before, alone = self.start()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self.finish(request, before, alone)
+            raise
+        return self.measure(response, request, before, alone)
+
+    def start(self):
+        with self.lock:
+            alone = self.in_flight == 0
+            self.in_flight += 1
+            if alone:
+                reset_peak_rss()
+        return rss_bytes(), alone
+
+    def measure(self, response, request, before, alone):
+        if not response.streaming:
+            self.finish(request, before, alone)
+        elif response.is_async:
+            response.streaming_content = self.measure_async_stream(response.streaming_content, request, before, alone)
+        else:
+            response.streaming_content = self.measure_stream(response.streaming_content, request, before, alone)
+        return response
+
+    def measure_stream(self, content, request, before, alone):
+        try:
+            yield from content
+        finally:
+            self.finish(request, before, alone)
+
+    async def measure_async_stream(self, content, request, before, alone):
+        try:
+            async for part in content:
+                yield part
+        finally:
+            self.finish(request, before, alone)
+
+    def finish(self, request, before, alone):
+        with self.lock:
+            self.in_flight -= 1
+            shared = not alone or self.in_flight > 0
+        peak = peak_rss_bytes()
+        if peak is not None and before is not None:
+            print(
+                f"{request.method} {request.path}: peak RSS {peak / MB:.0f} MB "
+                f"(+{max(peak - before, 0) / MB:.0f} MB){' shared' if shared else ''}"
+            )
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that also runs in async mode (6.6 is sync only).
+
+    Django runs a sync-only middleware under ASGI by parking each request on
+    a thread for the whole of the view below it, which is what the async
+    views are there to avoid.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            # Opens the file; Django then reads it in a thread
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("riceapp", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="classificationresult",
+            name="model_version",
+            field=models.CharField(blank=True, default="", max_length=50),
+        ),
+        migrations.AddField(
+            model_name="classificationresult",
+            name="phash",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
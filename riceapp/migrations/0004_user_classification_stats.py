@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_rollups(apps, schema_editor):
+    ClassificationResult = apps.get_model("riceapp", "ClassificationResult")
+    UserClassificationStats = apps.get_model("riceapp", "UserClassificationStats")
+    rows = (
+        ClassificationResult.objects.order_by()
+        .values("user_id", "predicted_class")
+        .annotate(
+            count=models.Count("id"),
+            confidence_sum=models.Sum("confidence"),
+            last_uploaded_at=models.Max("uploaded_at"),
+        )
+    )
+    rollups = {}
+    for row in rows:
+        stats = rollups.setdefault(
+            row["user_id"],
+            UserClassificationStats(user_id=row["user_id"], class_counts={}),
+        )
+        stats.total_count += row["count"]
+        stats.class_counts[row["predicted_class"]] = row["count"]
+        stats.confidence_sum += row["confidence_sum"]
+        if (
+            stats.last_uploaded_at is None
+            or row["last_uploaded_at"] > stats.last_uploaded_at
+        ):
+            stats.last_uploaded_at = row["last_uploaded_at"]
+    UserClassificationStats.objects.bulk_create(rollups.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("riceapp", "0003_classification_jobs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserClassificationStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="classification_stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("total_count", models.PositiveIntegerField(default=0)),
+                ("class_counts", models.JSONField(default=dict)),
+                ("confidence_sum", models.FloatField(default=0)),
+                ("last_uploaded_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
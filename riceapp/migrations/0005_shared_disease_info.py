@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("riceapp", "0004_user_classification_stats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DiseaseInfo",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("predicted_class", models.CharField(max_length=100)),
+                ("version", models.PositiveIntegerField()),
+                ("content", models.JSONField()),
+                ("content_hash", models.CharField(max_length=64)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="diseaseinfo",
+            constraint=models.UniqueConstraint(
+                fields=("predicted_class", "version"),
+                name="unique_disease_info_version",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="diseaseinfo",
+            constraint=models.UniqueConstraint(
+                fields=("predicted_class", "content_hash"),
+                name="unique_disease_info_content",
+            ),
+        ),
+        migrations.AddField(
+            model_name="classificationresult",
+            name="disease_info_version",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="results",
+                to="riceapp.diseaseinfo",
+            ),
+        ),
+    ]
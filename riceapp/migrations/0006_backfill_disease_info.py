@@ -0,0 +1,82 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:34
+
+import hashlib
+import json
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def content_hash(content):
+    canonical = json.dumps(
+        content, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def collapse_disease_info(apps, schema_editor):
+    """Point every result at a shared DiseaseInfo row with identical content.
+
+    Distinct contents of a class become versions 1, 2, ... in the order they
+    first appear, so the detail page keeps showing what the user saw.
+    """
+    ClassificationResult = apps.get_model("riceapp", "ClassificationResult")
+    DiseaseInfo = apps.get_model("riceapp", "DiseaseInfo")
+    versions = {}
+    pending = {}
+
+    def flush():
+        for version_id, ids in pending.items():
+            ClassificationResult.objects.filter(id__in=ids).update(
+                disease_info_version_id=version_id
+            )
+        pending.clear()
+
+    rows = (
+        ClassificationResult.objects.exclude(disease_info__isnull=True)
+        .order_by("id")
+        .values_list("id", "predicted_class", "disease_info")
+    )
+    for count, (result_id, predicted_class, content) in enumerate(
+        rows.iterator(chunk_size=BATCH_SIZE), 1
+    ):
+        if not content:
+            continue
+        key = (predicted_class, content_hash(content))
+        if key not in versions:
+            latest = sum(
+                1 for known_class, _ in versions if known_class == predicted_class
+            )
+            versions[key] = DiseaseInfo.objects.create(
+                predicted_class=predicted_class,
+                version=latest + 1,
+                content=content,
+                content_hash=key[1],
+            ).id
+        pending.setdefault(versions[key], []).append(result_id)
+        if count % BATCH_SIZE == 0:
+            flush()
+    flush()
+
+
+def expand_disease_info(apps, schema_editor):
+    ClassificationResult = apps.get_model("riceapp", "ClassificationResult")
+    DiseaseInfo = apps.get_model("riceapp", "DiseaseInfo")
+    for info in DiseaseInfo.objects.all():
+        ClassificationResult.objects.filter(disease_info_version=info).update(
+            disease_info=info.content
+        )
+
+
+class Migration(migrations.Migration):
+    # Its own migration: on PostgreSQL the rows updated here leave deferred FK
+    # trigger events that block an ALTER TABLE in the same transaction
+
+    dependencies = [
+        ("riceapp", "0005_shared_disease_info"),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_disease_info, expand_disease_info),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:34
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("riceapp", "0006_backfill_disease_info"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="classificationresult",
+            name="disease_info",
+        ),
+    ]
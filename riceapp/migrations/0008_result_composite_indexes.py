@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("riceapp", "0007_remove_result_disease_info"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="classificationresult",
+            index=models.Index(
+                fields=["user", "-uploaded_at", "-id"], name="result_user_uploaded_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="classificationresult",
+            index=models.Index(
+                fields=["user", "predicted_class"], name="result_user_class_idx"
+            ),
+        ),
+    ]
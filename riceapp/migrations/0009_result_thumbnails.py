@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("riceapp", "0008_result_composite_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="classificationresult",
+            name="image_width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="classificationresult",
+            name="thumbnails_ready",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,7 +1,29 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+# Class name of the "no disease" prediction
+HEALTHY_CLASS = 'Healthy Rice Leaf'
+
+class DiseaseInfo(models.Model):
+    """One version of the knowledge-base entry for a class, shared by every result that showed it"""
+    predicted_class = models.CharField(max_length=100)
+    version = models.PositiveIntegerField()
+    content = models.JSONField()
+    # sha256 of the canonical JSON, to find an existing version by content
+    content_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['predicted_class', 'version'], name='unique_disease_info_version'),
+            models.UniqueConstraint(fields=['predicted_class', 'content_hash'], name='unique_disease_info_content'),
+        ]
+
+    def __str__(self):
+        return f"{self.predicted_class} v{self.version}"
+
+
 class ClassificationResult(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='classifications')
     image = models.ImageField(upload_to='classification_images/')
@@ -9,11 +31,135 @@ class ClassificationResult(models.Model):
     confidence = models.FloatField()
     class_probabilities = models.JSONField()  # Store all class probabilities
     uploaded_at = models.DateTimeField(default=timezone.now)
-    # Disease information (if available)
-    disease_info = models.JSONField(null=True, blank=True)
+    # Disease information shown with the result, exactly as it was at the time
+    disease_info_version = models.ForeignKey(
+        DiseaseInfo, on_delete=models.PROTECT, null=True, blank=True, related_name='results'
+    )
+    # Model tag (version/backend) that produced the prediction
+    model_version = models.CharField(max_length=50, blank=True, default='')
+    # 64-bit perceptual hash of the image, for near-duplicate reuse
+    phash = models.BigIntegerField(null=True, blank=True)
+    # Resized WebP/JPEG copies narrower than image_width exist under thumbnails/
+    thumbnails_ready = models.BooleanField(default=False)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
     
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # History pages: one user's rows newest first, id breaking ties (see pagination.py)
+            models.Index(fields=['user', '-uploaded_at', '-id'], name='result_user_uploaded_idx'),
+            # Per-class counts of one user
+            models.Index(fields=['user', 'predicted_class'], name='result_user_class_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.predicted_class} ({self.confidence}%)"
+    
+    @property
+    def disease_info(self):
+        if self.disease_info_version_id is None:
+            return None
+        return self.disease_info_version.content
     
+    def save(self, *args, **kwargs):
+        # The post_save handler updates UserClassificationStats in this same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class UserClassificationStats(models.Model):
+    """Running totals of one user's classifications (see riceapp.stats)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='classification_stats')
+    total_count = models.PositiveIntegerField(default=0)
+    class_counts = models.JSONField(default=dict)  # predicted_class -> count
+    confidence_sum = models.FloatField(default=0)
+    last_uploaded_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.total_count} classifications"
+
+    @property
+    def healthy_count(self):
+        return self.class_counts.get(HEALTHY_CLASS, 0)
+
+    @property
+    def disease_count(self):
+        return self.total_count - self.healthy_count
+
+    @property
+    def avg_confidence(self):
+        return self.confidence_sum / self.total_count if self.total_count else 0
+
+class ClassificationJob(models.Model):
+    """An upload waiting for (or done with) classification by an inference worker"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    NOT_LEAF = 'not_leaf'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (NOT_LEAF, 'Not a leaf'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='classification_jobs')
+    # Stored where results keep their images, so the result can reuse the file
+    image = models.ImageField(upload_to='classification_images/')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True, default='')
+    result = models.ForeignKey(ClassificationResult, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    worker = models.CharField(max_length=100, blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status})"
+
+    @property
+    def queue_seconds(self):
+        """Time spent waiting for a worker"""
+        if self.started_at is None:
+            return None
+        return (self.started_at - self.created_at).total_seconds()
+
+
+class InferenceWorker(models.Model):
+    """Heartbeat of one run_inference_workers process"""
+    name = models.CharField(max_length=100, unique=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
+    busy_seconds = models.FloatField(default=0)
+    jobs_done = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def utilization(self):
+        """Share of its lifetime the worker spent classifying"""
+        alive = (self.last_seen - self.started_at).total_seconds()
+        return round(min(self.busy_seconds / alive, 1.0), 3) if alive > 0 else 0.0
+
+
+class StoredFile(models.Model):
+    """A content-addressed upload and how many results reference it (see storage.py)"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Last upload or reference change; garbage collection waits a TTL after it
+    touched_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['refcount', 'touched_at'])]
+
     def __str__(self):
-        return f"{self.user.username} - {self.predicted_class} ({self.confidence}%)"
\ No newline at end of file
+        return f"{self.name} ({self.refcount} refs)"
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+
+from .models import ClassificationResult
+
+
+def result_page_key(result_id):
+    return f'result-page:{result_id}'
+
+
+def result_etag(request, result_id):
+    """ETag of a result's detail page, or None if the user can't see the result.
+
+    A result is fixed at creation except for the fields that change how it
+    renders later (thumbnails, a reclassification), so those are part of
+    the tag, as is the deployed release, whose static file names the page
+    links to. The row is looked up once per request.
+    """
+    if not hasattr(request, '_result_version'):
+        request._result_version = (
+            ClassificationResult.objects.filter(id=result_id, user=request.user)
+            .values_list('uploaded_at', 'thumbnails_ready', 'model_version', 'disease_info_version_id')
+            .first()
+        )
+    version = request._result_version
+    if version is None:
+        return None
+    uploaded_at, thumbnails_ready, model_version, disease_info_id = version
+    return (
+        f'{result_id}-{int(uploaded_at.timestamp() * 1_000_000)}-{int(thumbnails_ready)}'
+        f'-{model_version}-{disease_info_id}-{settings.RELEASE}'
+    )
+
+
+def result_last_modified(request, result_id):
+    # Only once the page can't change any more; until then the ETag decides
+    result_etag(request, result_id)
+    version = request._result_version
+    if version is None or not version[1]:
+        return None
+    return version[0]
+
+
+def cached_result_page(result_id, etag):
+    cached = caches['default'].get(result_page_key(result_id))
+    if cached is not None and cached[0] == etag:
+        return cached[1]
+    return None
+
+
+def cache_result_page(request, result_id, etag, content):
+    """Keep the rendered page unless it holds per-request state (a CSRF token, pending messages)."""
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        return
+    if len(get_messages(request)):
+        return
+    caches['default'].set(result_page_key(result_id), (etag, content), settings.RESULT_PAGE_CACHE_SECONDS)
+
+
+def forget_result_page(result_id):
+    caches['default'].delete(result_page_key(result_id))
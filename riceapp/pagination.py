@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import Q
+
+# Columns a history card renders; pages of /history/ load only these
+HISTORY_CARD_FIELDS = (
+    'id', 'image', 'predicted_class', 'confidence', 'class_probabilities', 'uploaded_at',
+    'thumbnails_ready', 'image_width',
+)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_cursor(row):
+    """Opaque position of a row in ``-uploaded_at, -id`` order."""
+    return f"{(row.uploaded_at - _EPOCH) // _MICROSECOND}_{row.id}"
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; returns None for a missing or malformed cursor."""
+    try:
+        micros, row_id = cursor.split('_')
+        return _EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def keyset_page(queryset, cursor=None, size=24):
+    """One page of ``queryset`` newest first, starting after ``cursor``.
+
+    Unlike OFFSET pagination, each page is a range scan that starts right
+    where the previous one ended, so page 100 costs the same as page 1 and
+    rows inserted meanwhile don't shift later pages. ``id`` breaks ties
+    between rows uploaded in the same microsecond.
+
+    Returns ``(rows, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    queryset = queryset.order_by('-uploaded_at', '-id')
+    position = decode_cursor(cursor)
+    if position is not None:
+        uploaded_at, row_id = position
+        queryset = queryset.filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=row_id))
+    # One extra row tells whether another page follows
+    rows = list(queryset[:size + 1])
+    if len(rows) > size:
+        return rows[:size], encode_cursor(rows[size - 1])
+    return rows, None
@@ -0,0 +1,98 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Set bits in every byte value, for popcounting packed uint64 hashes
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def dhash(image):
+    """64-bit difference hash of a PIL image.
+
+    The image is shrunk to 9x8 greyscale and each bit records whether a pixel
+    is brighter than its right-hand neighbour. Re-encoding, resizing and mild
+    recompression (WhatsApp, phone galleries) flip only a few bits, so near
+    duplicates are within a small Hamming distance of each other.
+    """
+    small = np.asarray(image.convert('L').resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def to_signed(value):
+    """Store an unsigned 64-bit hash in a signed BigIntegerField."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming_distances(hashes, value):
+    """Hamming distance between one hash and every hash in a uint64 array."""
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PerceptualIndex:
+    """In-memory dHash index over ClassificationResult rows of one model.
+
+    Hashes are kept in a packed uint64 NumPy array and scanned with one
+    vectorised XOR + popcount, which handles hundreds of thousands of rows in
+    a few milliseconds. The index is loaded lazily and topped up with rows
+    newer than the last id it has seen before each lookup, so every worker
+    picks up results saved by the others.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, model_tag):
+        self.model_tag = model_tag
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._last_id = 0
+
+    def refresh(self, model_tag):
+        from .models import ClassificationResult
+
+        with self._lock:
+            if model_tag != self.model_tag:
+                self._reset(model_tag)
+            rows = list(
+                ClassificationResult.objects
+                .filter(id__gt=self._last_id, model_version=model_tag, phash__isnull=False)
+                .order_by('id')
+                .values_list('id', 'phash')
+            )
+            if rows:
+                ids, hashes = zip(*rows)
+                self._ids = np.concatenate([self._ids, np.array(ids, dtype=np.int64)])
+                self._hashes = np.concatenate(
+                    [self._hashes, np.array([to_unsigned(h) for h in hashes], dtype=np.uint64)]
+                )
+                self._last_id = ids[-1]
+
+    def nearest(self, value, max_distance, model_tag):
+        """Ids of indexed results within ``max_distance`` bits, closest first.
+
+        Returns a list of ``(result_id, distance)`` pairs.
+        """
+        if max_distance < 0:
+            return []
+        self.refresh(model_tag)
+        with self._lock:
+            if not len(self._hashes):
+                return []
+            distances = hamming_distances(self._hashes, value)
+            matches = np.flatnonzero(distances <= max_distance)
+            order = matches[np.argsort(distances[matches], kind='stable')]
+            return [(int(self._ids[i]), int(distances[i])) for i in order]
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+perceptual_index = PerceptualIndex()
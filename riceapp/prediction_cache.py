@@ -0,0 +1,92 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .registry import registry
+
+
+def hash_upload(uploaded_file):
+    """SHA-256 of an uploaded file's bytes, leaving the file rewound."""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """Two-tier cache of inference outcomes keyed by upload hash and model.
+
+    Entries are ``{'is_leaf': False}`` for uploads rejected by the leaf check
+    or ``{'is_leaf': True, 'probabilities': [...]}`` with the raw model
+    output. The first tier is a bounded LRU in this worker; the second is the
+    Django cache named by ``PREDICTION_CACHE_ALIAS``, shared by all workers.
+    Keys include the active model tag, so switching MODEL_VERSION or the
+    inference backend makes every old entry unreachable, and the local LRU is
+    dropped as soon as the tag changes.
+    """
+
+    def __init__(self, max_entries=None, alias=None):
+        self.max_entries = max_entries if max_entries is not None else settings.PREDICTION_CACHE_MAX_ENTRIES
+        self.alias = alias or settings.PREDICTION_CACHE_ALIAS
+        self._entries = OrderedDict()
+        self._model_tag = None
+        self._lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = 0
+
+    def _key(self, content_hash):
+        return f"prediction:{self._current_tag()}:{content_hash}"
+
+    def _current_tag(self):
+        tag = registry.model_tag()
+        if tag != self._model_tag:
+            with self._lock:
+                self._entries.clear()
+                self._model_tag = tag
+        return tag
+
+    def get(self, content_hash):
+        key = self._key(content_hash)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        value = caches[self.alias].get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.shared_hits += 1
+        self._remember(key, value)
+        return value
+
+    def set(self, content_hash, value):
+        key = self._key(content_hash)
+        self._remember(key, value)
+        caches[self.alias].set(key, value)
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'model_tag': self._model_tag,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+            }
+
+
+prediction_cache = PredictionCache()
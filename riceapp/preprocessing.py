@@ -0,0 +1,87 @@
+import numpy as np
+from PIL import Image
+
+from .metrics import metrics
+
+# Input resolution of the classification models
+MODEL_INPUT_SIZE = (256, 256)
+
+# Share of green pixels above which an image counts as leaf-like
+LEAF_GREEN_RATIO = 0.15
+
+
+class ImageTooLarge(ValueError):
+    """Raised for images that would decode to more pixels than allowed."""
+
+
+class PreparedImage:
+    """Everything the classify pipeline needs from one decoded upload.
+
+    ``image`` is the small RGB image at model resolution (also used for the
+    leaf check and the perceptual hash), ``array`` the float32 HxWxC model
+    input and ``original_size`` the dimensions of the upload before decoding.
+    """
+
+    def __init__(self, image, array, original_size):
+        self.image = image
+        self.array = array
+        self.original_size = original_size
+
+
+def load_image_array(path, size=MODEL_INPUT_SIZE):
+    """Read an image file into a model-ready float32 array."""
+    with Image.open(path) as image:
+        return prepare_image(image, size).array
+
+
+def prepare_image(image, size=MODEL_INPUT_SIZE, max_pixels=None):
+    """Decode an opened (not yet loaded) PIL image straight to model resolution.
+
+    For JPEGs, ``draft`` makes libjpeg decode at 1/2, 1/4 or 1/8 scale, the
+    smallest that is still at least ``size``. A 12 MP photo is then decoded
+    at about 500x375 and never exists at full resolution in memory. Other
+    formats are decoded in full once and shrunk with ``reducing_gap``, which
+    box-reduces by an integer factor before the final resample.
+
+    Only the header has been read when the size is checked: an image that
+    would still decode to more than ``max_pixels`` after drafting raises
+    ImageTooLarge before any pixel data is allocated.
+    """
+    original_size = image.size
+    image.draft('RGB', size)
+    if max_pixels and image.size[0] * image.size[1] > max_pixels:
+        width, height = original_size
+        raise ImageTooLarge(
+            f'{width}x{height} is larger than the {max_pixels / 1e6:g} megapixel limit'
+        )
+    with metrics.timer('decode'):
+        image.load()
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+    with metrics.timer('resize'):
+        small = image.resize(size, Image.BICUBIC, reducing_gap=3.0)
+    return PreparedImage(small, np.asarray(small, dtype=np.float32), original_size)
+
+
+def green_ratio(image):
+    """Share of pixels in the HSV green band (hue 35-85, saturation and value >= 40)."""
+    import cv2
+
+    hsv = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2HSV)
+    green_mask = cv2.inRange(hsv, np.array([35, 40, 40]), np.array([85, 255, 255]))
+    return cv2.countNonZero(green_mask) / (image.size[0] * image.size[1])
+
+
+def is_leaf_like(image):
+    """Basic checks for leaf-like characteristics.
+
+    Expects a small RGB image; the green share of a photo barely changes with
+    resolution, so run this on ``PreparedImage.image`` instead of the original.
+    """
+    try:
+        # Consider it leaf-like if at least 15% is green
+        return green_ratio(image) > LEAF_GREEN_RATIO
+    except Exception as e:
+        # If any error occurs in leaf detection, proceed with classification
+        print(f"Leaf detection error: {e}")
+        return True
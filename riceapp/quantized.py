@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+QUANTIZATIONS = ('int8', 'float16', 'dynamic')
+
+
+def tflite_path(model_dir, quantization):
+    """Where the TFLite conversion of a SavedModel directory is stored."""
+    return os.path.join(str(model_dir), f'model_{quantization}.tflite')
+
+
+def convert_saved_model(model_dir, quantization='int8', calibration_arrays=None):
+    """Convert a SavedModel to a quantized TFLite flatbuffer and return its bytes.
+
+    ``int8`` quantizes weights and activations and needs ``calibration_arrays``
+    (an iterable of HxWxC float32 images) to pick activation ranges; inputs and
+    outputs stay float32 so the backend is a drop-in replacement. ``float16``
+    halves the weights, ``dynamic`` stores int8 weights with float activations.
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(str(model_dir))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if calibration_arrays is None:
+            raise ValueError('int8 quantization needs calibration images')
+        calibration_arrays = list(calibration_arrays)
+
+        def representative_dataset():
+            for array in calibration_arrays:
+                yield [np.expand_dims(array, 0).astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def _interpreter_class():
+    # The standalone runtime is a few MB instead of all of TensorFlow
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """Runs a converted ``.tflite`` model with the same interface as InferenceModel.
+
+    A TFLite interpreter has fixed tensor shapes and is not thread-safe, so one
+    interpreter is allocated per batch size seen (at most ``max_batch_size``)
+    and calls are serialised with a lock.
+    """
+
+    jit_compile = False
+
+    def __init__(self, path, max_batch_size=8, num_threads=None):
+        self.path = str(path)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.num_threads = num_threads
+        self._interpreters = {}
+        self._lock = threading.Lock()
+        interpreter = self._interpreter(1)
+        input_detail = interpreter.get_input_details()[0]
+        output_detail = interpreter.get_output_details()[0]
+        self.input_shape = tuple(int(d) for d in input_detail['shape'][1:])
+        self.num_classes = int(output_detail['shape'][-1])
+        self.warmup_seconds = None
+
+    def _interpreter(self, batch_size):
+        interpreter = self._interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = _interpreter_class()(model_path=self.path, num_threads=self.num_threads)
+            input_index = interpreter.get_input_details()[0]['index']
+            if batch_size != 1:
+                shape = list(interpreter.get_input_details()[0]['shape'])
+                interpreter.resize_tensor_input(input_index, [batch_size] + shape[1:])
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return interpreter
+
+    def warmup(self, passes=2):
+        start = time.perf_counter()
+        for size in sorted({1, self.max_batch_size}):
+            dummy = np.zeros((size,) + self.input_shape, dtype=np.float32)
+            for _ in range(passes):
+                self.predict(dummy)
+        self.warmup_seconds = time.perf_counter() - start
+        return self.warmup_seconds
+
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            interpreter = self._interpreter(len(batch))
+            interpreter.set_tensor(interpreter.get_input_details()[0]['index'], batch)
+            interpreter.invoke()
+            return interpreter.get_tensor(interpreter.get_output_details()[0]['index']).copy()
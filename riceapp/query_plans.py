@@ -0,0 +1,91 @@
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+
+from .models import HEALTHY_CLASS, ClassificationResult
+from .pagination import HISTORY_CARD_FIELDS, keyset_page
+from .stats import rebuild_user_stats
+
+TABLE = ClassificationResult._meta.db_table
+
+# What a plan must not contain, per database: a full scan of the results
+# table, or a sort the index should have made unnecessary
+PLAN_PROBLEMS = {
+    'sqlite': [
+        (re.compile(rf'\bSCAN {TABLE}\b'), 'full table scan'),
+        (re.compile(r'USE TEMP B-TREE FOR ORDER BY'), 'sort'),
+    ],
+    'postgresql': [
+        (re.compile(rf'Seq Scan on {TABLE}\b'), 'sequential scan'),
+        (re.compile(r'^\s*(->\s*)?(Incremental )?Sort\b', re.MULTILINE), 'sort'),
+    ],
+}
+
+EXPLAIN_PREFIX = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+
+
+def _history_pages(user_id):
+    queryset = ClassificationResult.objects.filter(user_id=user_id).only(*HISTORY_CARD_FIELDS)
+    _, cursor = keyset_page(queryset, None, settings.HISTORY_PAGE_SIZE)
+    # A made-up cursor still exercises the next-page query on a short history
+    keyset_page(queryset, cursor or '0_0', settings.HISTORY_PAGE_SIZE)
+
+
+def _class_count(user_id):
+    ClassificationResult.objects.filter(user_id=user_id, predicted_class=HEALTHY_CLASS).count()
+
+
+def _last_upload(user_id):
+    ClassificationResult.objects.filter(user_id=user_id).aggregate(last=Max('uploaded_at'))
+
+
+# The per-user queries the app runs on ClassificationResult, by name
+CHECKS = {
+    'history pages': _history_pages,
+    'class count': _class_count,
+    'last upload': _last_upload,
+    'stats rebuild for one user': lambda user_id: rebuild_user_stats([user_id]),
+}
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(EXPLAIN_PREFIX[connection.vendor] + sql)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def plan_problems(plan, vendor=None):
+    return [problem for pattern, problem in PLAN_PROBLEMS[vendor or connection.vendor] if pattern.search(plan)]
+
+
+def check_query_plans(user_id):
+    """EXPLAIN every SELECT on the results table issued by each check.
+
+    Returns ``{check name: [(sql, plan, problems), ...]}``. Each check runs in
+    a transaction that is rolled back. On PostgreSQL, sequential scans and
+    sorts are disabled for the duration, so a plan that still uses one means
+    no index can serve the query, however small the table is today.
+    """
+    if connection.vendor not in EXPLAIN_PREFIX:
+        raise NotImplementedError(f"Query plans can't be checked on {connection.vendor}")
+
+    report = {}
+    for name, check in CHECKS.items():
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                    cursor.execute('SET LOCAL enable_sort = off')
+            with CaptureQueriesContext(connection) as captured:
+                check(user_id)
+            report[name] = []
+            for query in captured.captured_queries:
+                sql = query['sql']
+                if sql.lstrip().upper().startswith('SELECT') and TABLE in sql:
+                    plan = explain(sql)
+                    report[name].append((sql, plan, plan_problems(plan)))
+            transaction.set_rollback(True)
+    return report
@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .memory import rss_bytes
+
+# Labels of the current production model (models/2), in output order
+DEFAULT_CLASS_NAMES = ['Bacterial Leaf Blight', 'Brown Spot', 'Healthy Rice Leaf', 'Leaf Blast', 'Sheath Blight']
+
+
+def _rss_growth(before):
+    after = rss_bytes()
+    return after - before if after is not None and before is not None else None
+
+
+class ModelUnavailable(Exception):
+    """Raised when the requested model version can't be loaded."""
+
+
+class ModelVersion:
+    """One SavedModel directory under MODELS_DIR and its load state."""
+
+    def __init__(self, version, path, class_names=None):
+        self.version = version
+        self.path = path
+        self.model = None
+        self.pid = None
+        self.error = None
+        # Given explicitly, they take the place of the version's own labels
+        self._class_names = class_names
+        self.load_seconds = None
+        self.load_rss_bytes = None
+
+    @property
+    def class_names(self):
+        # Read once the model is loaded; until then its output width is unknown
+        if self._class_names is None:
+            if self.model is None:
+                return self.read_class_names()
+            self._class_names = self.read_class_names(self.model.num_classes)
+        return self._class_names
+
+    def read_class_names(self, num_classes=None):
+        """Labels in output order for a model with ``num_classes`` outputs (None: unknown).
+
+        A version can ship its own labels; otherwise it is assumed to use the
+        production labels when the output width matches.
+        """
+        labels_path = os.path.join(self.path, 'class_names.json')
+        if os.path.exists(labels_path):
+            with open(labels_path, encoding='utf-8') as f:
+                return json.load(f)
+        if num_classes is None or num_classes == len(DEFAULT_CLASS_NAMES):
+            return list(DEFAULT_CLASS_NAMES)
+        return [f'Class {i}' for i in range(num_classes)]
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'loaded': self.model is not None and self.pid == os.getpid(),
+            'load_seconds': self.load_seconds,
+            'load_rss_bytes': self.load_rss_bytes,
+            'warmup_seconds': self.model.warmup_seconds if self.model is not None else None,
+            'error': self.error,
+        }
+
+
+class ModelRegistry:
+    """Lazily loads the SavedModels under ``MODELS_DIR``, one per version.
+
+    The active version comes from ``settings.MODEL_VERSION``. Every process
+    loads its own copy: the TensorFlow runtime (some 500 MB, next to a few MB
+    of weights) can't be shared with forked children, so gunicorn workers
+    load the model in post_fork (see gunicorn.conf.py).
+    """
+
+    def __init__(self, models_dir=None, active_version=None):
+        self._models_dir = models_dir
+        self._active_version = active_version
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def models_dir(self):
+        return str(self._models_dir or settings.MODELS_DIR)
+
+    @property
+    def active_version(self):
+        return str(self._active_version or settings.MODEL_VERSION)
+
+    def versions(self):
+        """Version names of every SavedModel directory, oldest first."""
+        found = []
+        if os.path.isdir(self.models_dir):
+            for name in os.listdir(self.models_dir):
+                if os.path.exists(os.path.join(self.models_dir, name, 'saved_model.pb')):
+                    found.append(name)
+        return sorted(found, key=lambda name: (not name.isdigit(), int(name) if name.isdigit() else 0, name))
+
+    def _entry(self, version):
+        version = str(version or self.active_version)
+        if version not in self._versions:
+            if version not in self.versions():
+                raise ImproperlyConfigured(
+                    f"Model version {version!r} not found in {self.models_dir} "
+                    f"(available: {', '.join(self.versions()) or 'none'})"
+                )
+            self._versions[version] = ModelVersion(version, os.path.join(self.models_dir, version))
+        return self._versions[version]
+
+    def get(self, version=None):
+        """Return the loaded InferenceModel for a version, loading it on first use."""
+        entry = self._entry(version)
+        if entry.model is not None and entry.pid == os.getpid():
+            return entry.model
+        with self._lock:
+            if entry.model is None or entry.pid != os.getpid():
+                self._load(entry)
+        return entry.model
+
+    @property
+    def backend(self):
+        return settings.INFERENCE_BACKEND
+
+    def _build(self, entry):
+        if self.backend == 'tflite':
+            from .quantized import TFLiteModel, tflite_path
+
+            path = tflite_path(entry.path, settings.INFERENCE_TFLITE_QUANTIZATION)
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"{path} does not exist; run `manage.py convert_model {entry.version} "
+                    f"--quantization {settings.INFERENCE_TFLITE_QUANTIZATION}`"
+                )
+            return TFLiteModel(path, max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE)
+        if self.backend != 'tensorflow':
+            raise ImproperlyConfigured(f"Unknown INFERENCE_BACKEND {self.backend!r}")
+
+        from .inference import InferenceModel
+
+        return InferenceModel(
+            entry.path,
+            max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+            jit_compile=settings.INFERENCE_XLA,
+        )
+
+    def _load(self, entry):
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        try:
+            model = self._build(entry)
+            if settings.INFERENCE_WARMUP:
+                # Trace the serving graph now so the first request doesn't pay for it
+                model.warmup()
+        except Exception as e:
+            entry.error = str(e)
+            raise ModelUnavailable(f"Model {entry.version} failed to load: {e}") from e
+        entry.model = model
+        entry.pid = os.getpid()
+        entry.error = None
+        entry.load_seconds = round(time.perf_counter() - start, 3)
+        entry.load_rss_bytes = _rss_growth(rss_before)
+        print(f"Model {entry.version} loaded in {entry.load_seconds}s (pid {entry.pid}, RSS +{entry.load_rss_bytes} bytes)")
+
+    def model_tag(self, version=None):
+        """Identifies what produced a prediction: version, backend and quantization."""
+        tag = f"{version or self.active_version}-{self.backend}"
+        if self.backend == 'tflite':
+            tag += f"-{settings.INFERENCE_TFLITE_QUANTIZATION}"
+        return tag
+
+    def class_names(self, version=None):
+        return self._entry(version).class_names
+
+    def stats(self):
+        return {
+            'active_version': self.active_version,
+            'backend': self.backend,
+            'available_versions': self.versions(),
+            'versions': {version: entry.stats() for version, entry in self._versions.items()},
+        }
+
+
+registry = ModelRegistry()
@@ -0,0 +1,53 @@
+import time
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .metrics import metrics
+from .models import ClassificationResult
+from .page_cache import forget_result_page
+from .stats import forget_results, record_results
+from .storage import add_references, release_references
+from .thumbnails import schedule_thumbnails
+
+
+def results_inserted(results):
+    """Bookkeeping for new rows: rollups, file references, thumbnails.
+
+    Run by post_save for single saves and explicitly after ``bulk_create``
+    (which sends no signals), inside the transaction that inserts the rows.
+    """
+    record_results(results)
+    add_references([result.image.name for result in results])
+    for result in results:
+        if result.image and not result.thumbnails_ready:
+            # Once the row (and the file) are committed
+            transaction.on_commit(partial(schedule_thumbnails, result))
+
+
+@receiver(pre_save, sender=ClassificationResult)
+def result_saving(sender, instance, **kwargs):
+    instance._save_started = time.perf_counter()
+
+
+@receiver(post_save, sender=ClassificationResult)
+def result_saved(sender, instance, created, **kwargs):
+    # Only inserts change the rollup; code that rewrites predicted_class or
+    # confidence of an existing row must call stats.rescore_results
+    if created:
+        # Between the two signals: the INSERT alone
+        metrics.observe('rice_stage_seconds', time.perf_counter() - instance._save_started, stage='db_insert')
+        with metrics.timer('post_insert'):
+            results_inserted([instance])
+    elif instance.image and not instance.thumbnails_ready:
+        transaction.on_commit(partial(schedule_thumbnails, instance))
+
+
+@receiver(post_delete, sender=ClassificationResult)
+def result_deleted(sender, instance, **kwargs):
+    # Runs inside the deletion's transaction, for queryset deletes as well
+    forget_results([instance])
+    release_references([instance.image.name])
+    forget_result_page(instance.id)
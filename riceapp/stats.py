@@ -0,0 +1,117 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+
+from .models import ClassificationResult, UserClassificationStats
+
+
+def _by_user(results):
+    grouped = defaultdict(list)
+    for result in results:
+        grouped[result.user_id].append(result)
+    return grouped
+
+
+def record_results(results):
+    """Add newly inserted results to their users' rollups.
+
+    Called by the post_save handler for single saves and explicitly after
+    ``bulk_create`` (which sends no signals). Run it inside the transaction
+    that inserts the rows; the rollup row is locked while it is updated so
+    concurrent inserts for the same user don't lose counts.
+    """
+    for user_id, rows in _by_user(results).items():
+        with transaction.atomic():
+            UserClassificationStats.objects.get_or_create(user_id=user_id)
+            stats = UserClassificationStats.objects.select_for_update().get(user_id=user_id)
+            for result in rows:
+                stats.total_count += 1
+                stats.class_counts[result.predicted_class] = stats.class_counts.get(result.predicted_class, 0) + 1
+                stats.confidence_sum += result.confidence
+                if stats.last_uploaded_at is None or result.uploaded_at > stats.last_uploaded_at:
+                    stats.last_uploaded_at = result.uploaded_at
+            stats.save()
+
+
+def forget_results(results):
+    """Take deleted results out of their users' rollups."""
+    for user_id, rows in _by_user(results).items():
+        with transaction.atomic():
+            # No row means the user is being deleted with everything they own
+            stats = UserClassificationStats.objects.select_for_update().filter(user_id=user_id).first()
+            if stats is None:
+                continue
+            for result in rows:
+                stats.total_count = max(0, stats.total_count - 1)
+                remaining = stats.class_counts.get(result.predicted_class, 0) - 1
+                if remaining > 0:
+                    stats.class_counts[result.predicted_class] = remaining
+                else:
+                    stats.class_counts.pop(result.predicted_class, None)
+                stats.confidence_sum -= result.confidence
+            if not stats.total_count:
+                # Don't let float rounding leave a residue on an empty history
+                stats.confidence_sum = 0
+            if stats.last_uploaded_at in {result.uploaded_at for result in rows}:
+                stats.last_uploaded_at = (
+                    ClassificationResult.objects.filter(user_id=user_id)
+                    .aggregate(last=Max('uploaded_at'))['last']
+                )
+            stats.save()
+
+
+def rescore_results(pairs):
+    """Move re-scored results between classes in their users' rollups.
+
+    ``pairs`` are (before, after) versions of existing results. Run it inside
+    the transaction that updates the rows; each rollup row is locked while
+    it changes, as in ``record_results``, and other users' rollups are left
+    alone.
+    """
+    grouped = defaultdict(list)
+    for before, after in pairs:
+        grouped[before.user_id].append((before, after))
+    for user_id, rows in grouped.items():
+        with transaction.atomic():
+            stats = UserClassificationStats.objects.select_for_update().filter(user_id=user_id).first()
+            if stats is None:
+                # Nothing to adjust; build it from the rows as they are now
+                rebuild_user_stats([user_id])
+                continue
+            for before, after in rows:
+                remaining = stats.class_counts.get(before.predicted_class, 0) - 1
+                if remaining > 0:
+                    stats.class_counts[before.predicted_class] = remaining
+                else:
+                    stats.class_counts.pop(before.predicted_class, None)
+                stats.class_counts[after.predicted_class] = stats.class_counts.get(after.predicted_class, 0) + 1
+                stats.confidence_sum += after.confidence - before.confidence
+            stats.save(update_fields=['class_counts', 'confidence_sum'])
+
+
+def rebuild_user_stats(user_ids=None):
+    """Recompute rollups from ClassificationResult; returns the number of users."""
+    results = ClassificationResult.objects.order_by()
+    if user_ids is not None:
+        results = results.filter(user_id__in=user_ids)
+    rows = results.values('user_id', 'predicted_class').annotate(
+        count=Count('id'), confidence_sum=Sum('confidence'), last_uploaded_at=Max('uploaded_at'),
+    )
+
+    rollups = {}
+    for row in rows:
+        stats = rollups.setdefault(row['user_id'], UserClassificationStats(user_id=row['user_id'], class_counts={}))
+        stats.total_count += row['count']
+        stats.class_counts[row['predicted_class']] = row['count']
+        stats.confidence_sum += row['confidence_sum']
+        if stats.last_uploaded_at is None or row['last_uploaded_at'] > stats.last_uploaded_at:
+            stats.last_uploaded_at = row['last_uploaded_at']
+
+    with transaction.atomic():
+        existing = UserClassificationStats.objects.all()
+        if user_ids is not None:
+            existing = existing.filter(user_id__in=user_ids)
+        existing.delete()
+        UserClassificationStats.objects.bulk_create(rollups.values())
+    return len(rollups)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Uploads stored by content hash; anything else (thumbnails, ...) keeps its name
+HASHED_DIRS = ('classification_images', 'anonymous_uploads')
+
+
+def content_name(directory, content, original_name):
+    """``directory/ab/cd/<sha256><ext>`` for a file, read in chunks."""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    value = digest.hexdigest()
+    extension = os.path.splitext(original_name)[1].lower()
+    return f"{directory}/{value[:2]}/{value[2:4]}/{value}{extension}"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that stores uploads under the hash of their bytes.
+
+    Saving a file whose bytes are already stored writes nothing and returns
+    the existing name. Each stored file has a StoredFile row counting the
+    ClassificationResults that reference it (maintained by riceapp.signals);
+    ``manage.py gc_uploads`` deletes files left unreferenced for a TTL,
+    which covers anonymous uploads as well as deleted results.
+    """
+
+    def __init__(self, *args, hashed_dirs=HASHED_DIRS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hashed_dirs = tuple(hashed_dirs)
+
+    def _hashed(self, name):
+        return name.replace('\\', '/').split('/', 1)[0] in self.hashed_dirs
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not self._hashed(name):
+            return super().save(name, content, max_length=max_length)
+        if not hasattr(content, 'chunks'):
+            from django.core.files import File
+
+            content = File(content, name)
+        directory = name.replace('\\', '/').split('/', 1)[0]
+        name = content_name(directory, content, name)
+        self._register(name, content)
+        return name
+
+    def _register(self, name, content):
+        from .models import StoredFile
+
+        # The row is locked while the file is written, so a concurrent GC of
+        # the same content either finishes first or sees the fresh touch
+        with transaction.atomic():
+            record = StoredFile.objects.select_for_update().filter(name=name).first()
+            if record is None:
+                try:
+                    with transaction.atomic():
+                        record = StoredFile.objects.create(name=name, size=content.size)
+                except IntegrityError:
+                    record = StoredFile.objects.select_for_update().get(name=name)
+            StoredFile.objects.filter(id=record.id).update(touched_at=timezone.now())
+            if not self.exists(name):
+                self._write(name, content)
+
+    def _write(self, name, content):
+        # Write to a temporary file and rename it into place: concurrent
+        # writers of the same content can't leave a partial file behind
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def add_references(names):
+    """Count one more result referencing each stored file name."""
+    _change_references(names, 1)
+
+
+def release_references(names):
+    _change_references(names, -1)
+
+
+def _change_references(names, delta):
+    from .models import StoredFile
+
+    counts = {}
+    for name in names:
+        if name:
+            counts[name] = counts.get(name, 0) + 1
+    for name, count in counts.items():
+        # Files stored before content addressing have no row and are not counted
+        StoredFile.objects.filter(name=name).update(refcount=F('refcount') + delta * count, touched_at=timezone.now())
@@ -0,0 +1,36 @@
+from django import template
+from django.conf import settings
+
+from riceapp.thumbnails import srcset, thumbnail_name, thumbnail_widths
+
+register = template.Library()
+
+
+@register.inclusion_tag('responsive_image.html')
+def responsive_image(result, sizes, css_class='', style='', alt='', lazy=False):
+    """<picture> with WebP and JPEG srcsets of a result's thumbnails.
+
+    Falls back to a plain <img> of the original until the thumbnails exist,
+    and for originals too small to have any. ``sizes`` is the displayed
+    width, as in the HTML attribute.
+    """
+    context = {'sizes': sizes, 'css_class': css_class, 'style': style, 'alt': alt, 'lazy': lazy}
+    name, storage = result.image.name, result.image.storage
+    widths = thumbnail_widths(result.image_width) if result.thumbnails_ready else []
+    if not widths:
+        context['src'] = result.image.url
+        return context
+
+    webp_srcset, jpeg_srcset = srcset(name, 'webp', widths, storage), srcset(name, 'jpeg', widths, storage)
+    if result.image_width <= max(settings.THUMBNAIL_WIDTHS):
+        # A small original is cheap enough to offer as the largest candidate
+        # (browsers sniff the format, so it may sit in the WebP list too)
+        webp_srcset += f", {result.image.url} {result.image_width}w"
+        jpeg_srcset += f", {result.image.url} {result.image_width}w"
+    context.update(
+        webp_srcset=webp_srcset,
+        jpeg_srcset=jpeg_srcset,
+        # For browsers without srcset: the middle width
+        src=storage.url(thumbnail_name(name, widths[len(widths) // 2], 'jpeg')),
+    )
+    return context
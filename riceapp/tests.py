@@ -1,3 +1,933 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.module_loading import import_string
+from django.utils import timezone
+
+from .batching import MicroBatcher
+from .jobs import Worker, claim_jobs, queue_stats, requeue_stale_jobs
+from .models import ClassificationJob, ClassificationResult, StoredFile, UserClassificationStats
+from .pagination import keyset_page
+from .stats import rebuild_user_stats, record_results, rescore_results
+from .disease_info import KnowledgeBase, disease_info_version
+from .query_plans import explain, plan_problems
+from .thumbnails import generate_thumbnails, thumbnail_executor, thumbnail_name
+from .inference import InferenceModel
+from .metrics import Metrics
+from .preprocessing import MODEL_INPUT_SIZE, ImageTooLarge, is_leaf_like, load_image_array, prepare_image
+from .prediction_cache import PredictionCache
+from .phash import PerceptualIndex, dhash, hamming_distances
+from .registry import DEFAULT_CLASS_NAMES, ModelRegistry
+from .management.commands.convert_model import file_hash, split_images
+from .management.commands.reclassify import paced
+
+
+class MicroBatcherTests(TestCase):
+    def test_concurrent_requests_share_a_batch(self):
+        seen_batches = []
+
+        def predict_fn(batch):
+            seen_batches.append(len(batch))
+            # Each row echoes back its own input so callers can check ordering
+            return batch.reshape(len(batch), -1)[:, :1] * 2
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=4, max_wait_ms=200)
+        results = {}
+
+        def worker(i):
+            results[i] = batcher.predict(np.full((2, 2), i, dtype=np.float32), timeout=5)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual({i: float(r[0]) for i, r in results.items()}, {i: 2.0 * i for i in range(4)})
+        self.assertLess(len(seen_batches), 4)
+        stats = batcher.stats()
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(sum(s * c for s, c in stats['batch_size_histogram'].items()), 4)
+
+    def test_stats_include_a_batch_once_its_callers_are_woken(self):
+        batcher = MicroBatcher(lambda batch: batch, max_batch_size=2, max_wait_ms=50)
+        seen = []
+        future = batcher.submit(np.zeros(2))
+        # Done callbacks run as the future is resolved, on the batcher thread
+        future.add_done_callback(lambda f: seen.append(batcher.stats()['batches']))
+        future.result(timeout=5)
+        self.assertEqual(seen, [1])
+
+    def test_errors_propagate_to_every_caller(self):
+        def predict_fn(batch):
+            raise RuntimeError('model failed')
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=2, max_wait_ms=1)
+        with self.assertRaises(RuntimeError):
+            batcher.predict(np.zeros((2, 2)), timeout=5)
+
+    def test_batch_size_one_predicts_inline(self):
+        batcher = MicroBatcher(lambda batch: batch + 1, max_batch_size=1)
+        self.assertEqual(batcher.predict(np.zeros(3)).tolist(), [1, 1, 1])
+        self.assertIsNone(batcher._thread)
+
+
+class InferenceModelTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model = InferenceModel(settings.BASE_DIR / 'models' / '2')
+
+    def test_matches_keras_predict(self):
+        batch = np.random.RandomState(0).rand(3, 256, 256, 3).astype(np.float32) * 255
+        expected = self.model.model.predict(batch, verbose=0)
+        np.testing.assert_allclose(self.model.predict(batch), expected, rtol=1e-4, atol=1e-6)
+
+    def test_xla_buckets_pad_to_power_of_two(self):
+        self.model.jit_compile = True
+        try:
+            self.assertEqual(self.model.batch_buckets(), [1, 2, 4, 8])
+            self.assertEqual(self.model._padded_size(3), 4)
+        finally:
+            self.model.jit_compile = False
+
+
+class ModelRegistryTests(TestCase):
+    def test_discovers_versions(self):
+        self.assertEqual(ModelRegistry().versions(), ['1', '2'])
+
+    def test_unknown_version_is_a_configuration_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ModelRegistry(active_version='99').get()
+
+    def test_loads_version_and_keeps_its_class_names(self):
+        registry = ModelRegistry(active_version='2')
+        batch = np.random.RandomState(1).rand(2, 256, 256, 3).astype(np.float32) * 255
+        reference = InferenceModel(settings.BASE_DIR / 'models' / '2')
+        np.testing.assert_allclose(registry.get().predict(batch), reference.predict(batch), rtol=1e-5, atol=1e-6)
+        stats = registry.stats()['versions']['2']
+        self.assertTrue(stats['loaded'])
+        self.assertIsNotNone(stats['load_seconds'])
+        # Read from disk once, when the model loaded
+        self.assertEqual(registry.class_names(), DEFAULT_CLASS_NAMES)
+        with mock.patch('riceapp.registry.open', create=True) as opened, mock.patch('riceapp.registry.os.path.exists') as exists:
+            self.assertEqual(registry.class_names(), DEFAULT_CLASS_NAMES)
+        opened.assert_not_called()
+        exists.assert_not_called()
+
+    @override_settings(INFERENCE_BACKEND='tflite', INFERENCE_TFLITE_QUANTIZATION='int8')
+    def test_tflite_backend_agrees_with_savedmodel(self):
+        registry = ModelRegistry(active_version='2')
+        # Quantization ranges were calibrated on real leaves, so test on real leaves
+        images = sorted((settings.BASE_DIR / 'media' / 'classification_images').glob('*.jpg'))[:4]
+        batch = np.stack([load_image_array(path) for path in images])
+        reference = InferenceModel(settings.BASE_DIR / 'models' / '2').predict(batch)
+        quantized = registry.get().predict(batch)
+        np.testing.assert_array_equal(quantized.argmax(axis=1), reference.argmax(axis=1))
+        np.testing.assert_allclose(quantized, reference, atol=0.05)
+
+
+class ConvertModelTests(TestCase):
+    def test_report_images_are_split_from_calibration_with_copies_together(self):
+        images = sorted(str(path) for path in (settings.BASE_DIR / 'media' / 'classification_images').glob('*.jpg'))
+        calibration, report = split_images(images)
+        self.assertEqual(sorted(calibration + report), images)
+        self.assertTrue(calibration and report)
+        self.assertFalse({file_hash(path) for path in calibration} & {file_hash(path) for path in report})
+
+
+LEAF_IMAGE = settings.BASE_DIR / 'media' / 'classification_images' / 'aug_0_33.jpg'
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ClassifyViewTestCase(TestCase):
+    """Posts real leaf photos to the views with uploads going to a temporary MEDIA_ROOT"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        # Thumbnails inside the request: a background thread can't see the test transaction
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root, THUMBNAILS_IN_BACKGROUND=False)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user('farmer', password='rice-pass-123')
+        self.client.force_login(self.user)
+
+    def classify(self, path=LEAF_IMAGE):
+        with open(path, 'rb') as f:
+            return self.client.post('/classify/', {'image': f})
+
+    def reencoded(self, path=LEAF_IMAGE, quality=60, scale=0.8):
+        """A recompressed, resized copy of a photo, as a messaging app would send it"""
+        with Image.open(path) as image:
+            image = image.convert('RGB')
+            image = image.resize((int(image.width * scale), int(image.height * scale)))
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality)
+        return SimpleUploadedFile('whatsapp.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class PredictionCacheTests(ClassifyViewTestCase):
+    def setUp(self):
+        super().setUp()
+        from . import views
+
+        views.prediction_cache._entries.clear()
+        caches[settings.PREDICTION_CACHE_ALIAS].clear()
+        self.batcher = views.batcher
+
+    def test_duplicate_upload_skips_inference(self):
+        first = self.classify()
+        requests = self.batcher.stats()['requests']
+        second = self.classify()
+        self.assertEqual(self.batcher.stats()['requests'], requests)
+        self.assertEqual(first.context['class_probabilities'], second.context['class_probabilities'])
+        self.assertEqual(self.user.classifications.count(), 2)
+
+    def test_shared_tier_survives_a_cold_worker_and_model_switch_misses(self):
+        cache = PredictionCache(max_entries=2)
+        cache.set('abc', {'is_leaf': False})
+        cold = PredictionCache(max_entries=2)
+        self.assertEqual(cold.get('abc'), {'is_leaf': False})
+        self.assertEqual(cold.shared_hits, 1)
+        with override_settings(MODEL_VERSION='1'):
+            self.assertIsNone(cold.get('abc'))
+            self.assertEqual(cold.stats()['entries'], 0)
+
+
+class PerceptualHashTests(ClassifyViewTestCase):
+    def setUp(self):
+        super().setUp()
+        from . import views
+
+        self.views = views
+        caches[settings.PREDICTION_CACHE_ALIAS].clear()
+        views.prediction_cache._entries.clear()
+
+    def test_reencoded_upload_reuses_previous_result(self):
+        original = self.classify()
+        self.assertIsNone(original.context['reused_result_id'])
+        requests = self.views.batcher.stats()['requests']
+
+        copy = self.client.post('/classify/', {'image': self.reencoded()})
+        self.assertEqual(self.views.batcher.stats()['requests'], requests)
+        self.assertEqual(copy.context['reused_result_id'], original.context['result_id'])
+        self.assertEqual(copy.context['predicted_class'], original.context['predicted_class'])
+        self.assertContains(copy, 'closely matches one analysed before')
+
+    def test_batch_lines_do_not_reveal_whose_result_was_reused(self):
+        original = self.classify()
+        self.client.force_login(User.objects.create_user('neighbour'))
+        response = self.client.post('/classify/batch/', {'images': [self.reencoded()]})
+        line = json.loads(b''.join(response.streaming_content).splitlines()[0])
+        self.assertEqual(line['source'], 'near_duplicate')
+        self.assertNotIn('reused_result_id', line)
+        self.assertNotEqual(line['result_id'], original.context['result_id'])
+
+    @override_settings(PHASH_MAX_DISTANCE=-1)
+    def test_reuse_can_be_disabled(self):
+        self.classify()
+        copy = self.client.post('/classify/', {'image': self.reencoded()})
+        self.assertIsNone(copy.context['reused_result_id'])
+
+    def test_index_scan(self):
+        with Image.open(LEAF_IMAGE) as image:
+            value = dhash(image)
+        copy = dhash(Image.open(self.reencoded()))
+        self.assertLessEqual(bin(value ^ copy).count('1'), settings.PHASH_MAX_DISTANCE)
+        hashes = np.array([value, value ^ 0b111, ~value & (2**64 - 1)], dtype=np.uint64)
+        self.assertEqual(hamming_distances(hashes, value).tolist(), [0, 3, 64])
+        self.assertEqual(PerceptualIndex().nearest(value, -1, 'any'), [])
+
+
+class PreprocessingTests(TestCase):
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        with Image.open(LEAF_IMAGE) as leaf:
+            buffer = io.BytesIO()
+            leaf.convert('RGB').resize((4000, 3000)).save(buffer, 'JPEG')
+        buffer.seek(0)
+        image = Image.open(buffer)
+        prepared = prepare_image(image)
+        # draft() picked a 1/8 scale decode instead of the full 12 MP
+        self.assertEqual(image.size, (500, 375))
+        self.assertEqual(prepared.original_size, (4000, 3000))
+        self.assertEqual(prepared.array.shape, MODEL_INPUT_SIZE + (3,))
+        self.assertEqual(prepared.array.dtype, np.float32)
+        self.assertTrue(is_leaf_like(prepared.image))
+
+    def test_non_leaf_is_rejected(self):
+        grey = Image.new('RGB', (1200, 900), (128, 128, 128))
+        self.assertFalse(is_leaf_like(prepare_image(grey).image))
+
+    def test_pixel_budget_is_checked_before_decoding(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 900), (40, 150, 40)).save(buffer, 'PNG')
+        buffer.seek(0)
+        with Image.open(buffer) as image:
+            with self.assertRaises(ImageTooLarge):
+                prepare_image(image, max_pixels=1_000_000)
+            self.assertIsNone(image.im)  # nothing was decoded
+        # A JPEG of the same size fits the budget at its draft scale
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 900), (40, 150, 40)).save(buffer, 'JPEG')
+        buffer.seek(0)
+        with Image.open(buffer) as image:
+            self.assertEqual(prepare_image(image, max_pixels=1_000_000).original_size, (1200, 900))
+
+
+class BatchClassifyTests(ClassifyViewTestCase):
+    def read_lines(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_zip_and_files_stream_one_line_per_photo(self):
+        images = sorted((settings.BASE_DIR / 'media' / 'classification_images').glob('*.jpg'))[:3]
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for path in images:
+                zf.write(path, f'field/{path.name}')
+            grey = io.BytesIO()
+            Image.new('RGB', (300, 200), (128, 128, 128)).save(grey, 'PNG')
+            zf.writestr('field/wall.png', grey.getvalue())
+            zf.writestr('field/notes.txt', 'not an image')
+        archive.seek(0)
+
+        with open(LEAF_IMAGE, 'rb') as single:
+            response = self.client.post('/classify/batch/', {
+                'images': [single],
+                'archive': SimpleUploadedFile('field.zip', archive.getvalue(), content_type='application/zip'),
+            })
+        lines = self.read_lines(response)
+
+        photos, summary = lines[:-1], lines[-1]['summary']
+        self.assertEqual([line['name'] for line in photos], ['aug_0_33.jpg'] + [p.name for p in images] + ['wall.png'])
+        self.assertEqual(photos[-1]['status'], 'not_leaf')
+        self.assertEqual(summary, {'ok': 4, 'not_leaf': 1, 'error': 0, 'total': 5})
+        saved = {line['result_id'] for line in photos if line['status'] == 'ok'}
+        self.assertEqual(set(self.user.classifications.values_list('id', flat=True)), saved)
+        # bulk_create bypasses post_save; the batch path updates the rollup itself
+        self.assertEqual(UserClassificationStats.objects.get(user=self.user).total_count, 4)
+
+    def test_rejects_non_zip_archive(self):
+        response = self.client.post('/classify/batch/', {
+            'archive': SimpleUploadedFile('photos.zip', b'not a zip'),
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(INFERENCE_WORKERS=1)
+class ClassificationJobTests(ClassifyViewTestCase):
+    def submit(self, path):
+        with open(path, 'rb') as f:
+            response = self.client.post('/classify/jobs/', {'image': f})
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def test_job_is_queued_then_completed_by_a_worker(self):
+        job = self.submit(LEAF_IMAGE)
+        self.assertEqual(job['status'], 'queued')
+        poll = self.client.get(job['status_url'])
+        self.assertEqual(poll.json()['status'], 'queued')
+        self.assertIn('Retry-After', poll)
+
+        worker = Worker(name='test-worker')
+        self.assertEqual(worker.run_once(), 1)
+
+        done = self.client.get(job['status_url']).json()
+        self.assertEqual(done['status'], 'done')
+        result = self.user.classifications.get(id=done['result_id'])
+        self.assertEqual(result.predicted_class, done['predicted_class'])
+        # The result reuses the file the job stored
+        self.assertEqual(result.image.name, ClassificationJob.objects.get(id=job['job_id']).image.name)
+
+        stats = queue_stats()
+        self.assertEqual(stats['jobs']['done'], 1)
+        self.assertEqual([w['jobs_done'] for w in stats['workers']], [1])
+
+    def test_a_job_is_claimed_by_one_worker_only(self):
+        self.submit(LEAF_IMAGE)
+        self.assertEqual(len(claim_jobs('worker-a', limit=4)), 1)
+        self.assertEqual(claim_jobs('worker-b', limit=4), [])
+
+    def test_stale_running_jobs_are_queued_again(self):
+        self.submit(LEAF_IMAGE)
+        [job] = claim_jobs('lost-worker')
+        ClassificationJob.objects.filter(id=job.id).update(
+            started_at=job.started_at - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS + 1)
+        )
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(ClassificationJob.objects.get(id=job.id).status, 'queued')
+
+    def test_a_failure_only_requeues_the_jobs_not_yet_done(self):
+        first, second = self.submit(LEAF_IMAGE), self.submit(LEAF_IMAGE)
+        from . import jobs
+
+        real_build_result = jobs.build_result
+        calls = []
+
+        def fail_second(outcome, user):
+            calls.append(outcome)
+            if len(calls) == 2:
+                raise RuntimeError('disk full')
+            return real_build_result(outcome, user)
+
+        with mock.patch.object(jobs, 'build_result', fail_second):
+            self.assertEqual(Worker(name='test-worker', batch_size=2).run_once(), 2)
+        statuses = dict(ClassificationJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {first['job_id']: 'done', second['job_id']: 'queued'})
+        self.assertEqual(self.user.classifications.count(), 1)
+
+    @override_settings(INFERENCE_WORKERS=0)
+    def test_without_workers_the_job_is_done_in_the_request(self):
+        job = self.submit(LEAF_IMAGE)
+        self.assertEqual(job['status'], 'done')
+        self.assertTrue(self.user.classifications.filter(id=job['result_id']).exists())
+
+    def test_other_users_cannot_poll_a_job(self):
+        job = self.submit(LEAF_IMAGE)
+        other = User.objects.create_user('neighbour', password='pw')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(job['status_url']).status_code, 404)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, HISTORY_PAGE_SIZE=4)
+class ClassificationHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('farmer', password='rice-pass-123')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        # Pairs of rows share an upload time, so pages must break ties by id
+        self.results = ClassificationResult.objects.bulk_create([
+            ClassificationResult(
+                user=self.user, image=f'classification_images/{i}.jpg', predicted_class='Brown Spot',
+                confidence=90.0, class_probabilities={'Brown Spot': 90.0},
+                uploaded_at=now - timedelta(minutes=i // 2),
+            )
+            for i in range(10)
+        ])
+        record_results(self.results)
+
+    def test_pages_cover_every_row_once_newest_first(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(ClassificationResult.objects.filter(user=self.user), cursor, size=4)
+            seen.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual([r.id for r in seen], [r.id for r in sorted(
+            self.results, key=lambda r: (r.uploaded_at, r.id), reverse=True)])
+
+    def test_history_loads_card_columns_and_scrolls_by_cursor(self):
+        response = self.client.get('/history/')
+        page = response.context['classifications']
+        self.assertEqual(len(page), 4)
+        self.assertIn('model_version', page[0].get_deferred_fields())
+        self.assertEqual(response.context['total_count'], 10)
+
+        more = self.client.get('/history/', {'after': response.context['next_cursor']},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTemplateNotUsed(more, 'classification_history.html')
+        self.assertEqual(len(more.context['classifications']), 4)
+        self.assertFalse({r.id for r in page} & {r.id for r in more.context['classifications']})
+
+    def test_history_query_count_does_not_grow_with_cards(self):
+        # Cards with thumbnails read thumbnails_ready and image_width
+        ClassificationResult.objects.update(thumbnails_ready=True, image_width=1200)
+        self.client.get('/history/')  # the session is cached from here on
+        # The user, the page and the stats rollup, however many cards there are
+        with self.assertNumQueries(3):
+            self.client.get('/history/')
+
+
+class UserClassificationStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('farmer', password='rice-pass-123')
+
+    def add(self, predicted_class, confidence, minutes_ago=0):
+        return ClassificationResult.objects.create(
+            user=self.user, image='classification_images/leaf.jpg', predicted_class=predicted_class,
+            confidence=confidence, class_probabilities={}, uploaded_at=timezone.now() - timedelta(minutes=minutes_ago),
+        )
+
+    def stats(self):
+        return UserClassificationStats.objects.get(user=self.user)
+
+    def test_rollup_follows_inserts_and_deletes(self):
+        newest = self.add('Brown Spot', 80.0)
+        self.add('Healthy Rice Leaf', 90.0, minutes_ago=5)
+        self.add('Brown Spot', 70.0, minutes_ago=10)
+        stats = self.stats()
+        self.assertEqual((stats.total_count, stats.healthy_count, stats.disease_count), (3, 1, 2))
+        self.assertEqual(stats.class_counts, {'Brown Spot': 2, 'Healthy Rice Leaf': 1})
+        self.assertAlmostEqual(stats.avg_confidence, 80.0)
+
+        newest.delete()
+        ClassificationResult.objects.filter(predicted_class='Healthy Rice Leaf').delete()
+        stats = self.stats()
+        self.assertEqual((stats.total_count, stats.class_counts), (1, {'Brown Spot': 1}))
+        self.assertAlmostEqual(stats.confidence_sum, 70.0)
+        self.assertEqual(stats.last_uploaded_at, ClassificationResult.objects.get().uploaded_at)
+
+        # Deleting the user cascades through results and rollup without recreating it
+        self.user.delete()
+        self.assertFalse(UserClassificationStats.objects.exists())
+
+    def test_rebuild_matches_incremental_rollup(self):
+        for i, (predicted_class, confidence) in enumerate([('Leaf Blast', 60.5), ('Brown Spot', 99.0), ('Leaf Blast', 75.25)]):
+            self.add(predicted_class, confidence, minutes_ago=i)
+        incremental = self.stats()
+        UserClassificationStats.objects.all().delete()
+        self.assertEqual(rebuild_user_stats(), 1)
+        rebuilt = self.stats()
+        for field in ('total_count', 'class_counts', 'confidence_sum', 'last_uploaded_at'):
+            self.assertEqual(getattr(rebuilt, field), getattr(incremental, field))
+
+    def test_rescore_moves_results_between_classes_of_their_user_only(self):
+        result = self.add('Leaf Blast', 60.0)
+        self.add('Leaf Blast', 70.0)
+        other = User.objects.create_user('neighbour')
+        ClassificationResult.objects.create(
+            user=other, image='classification_images/leaf.jpg', predicted_class='Leaf Blast', confidence=50.0,
+            class_probabilities={},
+        )
+        rescored = ClassificationResult(id=result.id, predicted_class='Brown Spot', confidence=95.0)
+        rescore_results([(result, rescored)])
+        stats = self.stats()
+        self.assertEqual((stats.total_count, stats.class_counts), (2, {'Leaf Blast': 1, 'Brown Spot': 1}))
+        self.assertAlmostEqual(stats.confidence_sum, 165.0)
+        other_stats = UserClassificationStats.objects.get(user=other)
+        self.assertEqual((other_stats.class_counts, other_stats.confidence_sum), ({'Leaf Blast': 1}, 50.0))
+
+
+class DiseaseInfoVersionTests(ClassifyViewTestCase):
+    def test_results_share_one_row_per_content_and_keep_their_version(self):
+        first = self.classify().context['result_id']
+        self.client.post('/classify/', {'image': self.reencoded()})
+        results = ClassificationResult.objects.filter(user=self.user)
+        self.assertEqual(results.count(), 2)
+        self.assertEqual(results.values('disease_info_version').distinct().count(), 1)
+
+        # Editing the knowledge base adds a version; the earlier result still shows the old text
+        shown = ClassificationResult.objects.get(id=first).disease_info
+        edited = dict(shown, scientific_name='Revised name')
+        newer = disease_info_version(ClassificationResult.objects.get(id=first).predicted_class, edited)
+        self.assertEqual(newer.version, 2)
+        response = self.client.get(f'/history/{first}/')
+        self.assertEqual(response.context['disease_info'], shown)
+
+
+class ResultPageCacheTests(ClassifyViewTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+
+    def test_repeat_views_are_304_or_served_from_the_cache(self):
+        result_id = self.classify().context['result_id']
+        url = f'/history/{result_id}/'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('private', first['Cache-Control'])
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        # Without a validator the cached page is sent: no template rendering
+        with self.assertTemplateNotUsed('classification_result.html'):
+            again = self.client.get(url)
+        self.assertEqual(again.content, first.content)
+
+        # Thumbnails change the page, so the ETag too
+        ClassificationResult.objects.filter(id=result_id).update(thumbnails_ready=True, image_width=224)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_deleted_result_is_dropped_from_the_cache(self):
+        result_id = self.classify().context['result_id']
+        self.client.get(f'/history/{result_id}/')
+        self.assertIsNotNone(caches['default'].get(f'result-page:{result_id}'))
+        ClassificationResult.objects.get(id=result_id).delete()
+        self.assertIsNone(caches['default'].get(f'result-page:{result_id}'))
+        self.assertEqual(self.client.get(f'/history/{result_id}/').status_code, 404)
+
+    def test_other_users_get_404(self):
+        result_id = self.classify().context['result_id']
+        self.client.force_login(User.objects.create_user('neighbour', password='rice-pass-123'))
+        self.assertEqual(self.client.get(f'/history/{result_id}/').status_code, 404)
+
+
+class SessionQueryTests(TestCase):
+    def test_logged_in_pages_read_the_session_from_the_cache(self):
+        self.client.force_login(User.objects.create_user('farmer', password='rice-pass-123'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/', secure=True).status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if 'django_session' in q['sql']])
+        # A logged-out session is gone from the cache too
+        cache_key = f'django.contrib.sessions.cached_db{self.client.session.session_key}'
+        self.assertIsNotNone(caches[settings.SESSION_CACHE_ALIAS].get(cache_key))
+        self.client.logout()
+        self.assertIsNone(caches[settings.SESSION_CACHE_ALIAS].get(cache_key))
+
+
+class MetricsTests(ClassifyViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+        override = override_settings(METRICS_DIR=self.metrics_dir, METRICS_TOKEN='scrape-secret')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_stage_timings_and_predictions_are_exported(self):
+        self.classify()
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        text = self.client.get('/metrics').content.decode()
+        for stage in ('hash', 'media_write', 'db_insert', 'post_insert'):
+            self.assertIn(f'rice_stage_seconds_count{{stage="{stage}"}}', text)
+        self.assertIn('rice_stage_seconds_bucket{stage="db_insert",le="+Inf"}', text)
+        self.assertIn('rice_predictions_total{predicted_class=', text)
+
+    def test_processes_are_summed(self):
+        other = Metrics()
+        other.inc('rice_leaf_check_rejections_total', 2)
+        other.observe('rice_stage_seconds', 0.02, stage='predict')
+        with open(os.path.join(self.metrics_dir, '999999.json'), 'w') as f:
+            json.dump(other.snapshot(), f)
+        mine = Metrics()
+        mine.inc('rice_leaf_check_rejections_total')
+        mine.observe('rice_stage_seconds', 0.2, stage='predict')
+
+        text = mine.render()
+        self.assertIn('rice_leaf_check_rejections_total 3', text)
+        self.assertIn('rice_stage_seconds_bucket{stage="predict",le="0.025"} 1', text)
+        self.assertIn('rice_stage_seconds_bucket{stage="predict",le="0.25"} 2', text)
+        self.assertIn('rice_stage_seconds_count{stage="predict"} 2', text)
+
+    def test_scraper_token(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE rice_stage_seconds histogram', response.content.decode())
+
+
+class LoadTestReportTests(TestCase):
+    def report(self, p95_ms, rps):
+        stats = {'p50_ms': 10, 'p95_ms': p95_ms, 'p99_ms': p95_ms, 'rps': rps, 'errors': 0, 'peak_rss_mb': [300]}
+        return {'mode': 'inprocess', 'concurrency': 4, 'requests': 50, 'workers': 1, 'scenarios': {'classify': stats}}
+
+    def test_regressions_beyond_the_threshold_fail(self):
+        from .management.commands.load_test import Command, percentile
+
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        fd, path = tempfile.mkstemp(suffix='.json')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.report(p95_ms=100, rps=20), f)
+        command = Command(stdout=io.StringIO())
+        command.compare(self.report(p95_ms=115, rps=17), path, max_regression=0.2)
+        with self.assertRaisesMessage(CommandError, 'classify: p95 100 -> 130 ms'):
+            command.compare(self.report(p95_ms=130, rps=20), path, max_regression=0.2)
+        with self.assertRaisesMessage(CommandError, 'concurrency=4'):
+            command.compare(dict(self.report(p95_ms=100, rps=20), concurrency=8), path, max_regression=0.2)
+
+
+class KnowledgeBaseTests(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        with open(settings.DISEASE_INFO_PATH, encoding='utf-8') as f:
+            self.data = json.load(f)
+
+    def write(self, data, mtime):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+        os.utime(self.path, (mtime, mtime))
+
+    def test_reloads_only_when_the_file_changes(self):
+        self.write(self.data, 1_000_000)
+        kb = KnowledgeBase(self.path)
+        loaded = kb.get()
+        self.assertIs(kb.get(), loaded)  # same mtime: no re-read
+
+        edited = json.loads(json.dumps(self.data))
+        edited['Brown Spot']['scientific_name'] = 'Bipolaris oryzae'
+        self.write(edited, 1_000_100)
+        self.assertEqual(kb.entry('Brown Spot')['scientific_name'], 'Bipolaris oryzae')
+
+        # A broken edit keeps serving the last good copy
+        self.write('{"Brown Spot": {"disease_name": "Brown Spot"}}', 1_000_200)
+        self.assertEqual(kb.entry('Brown Spot')['scientific_name'], 'Bipolaris oryzae')
+
+    def test_invalid_file_is_rejected_at_first_load(self):
+        broken = json.loads(json.dumps(self.data))
+        broken['Leaf Blast']['symptoms'] = 'Diamond-shaped lesions'
+        self.write(broken, 1_000_000)
+        with self.assertRaises(ImproperlyConfigured):
+            KnowledgeBase(self.path).get()
+
+    def test_guide_is_rendered_once_per_content(self):
+        self.write(self.data, 1_000_000)
+        kb = KnowledgeBase(self.path)
+        guide = kb.guide_html('Brown Spot')
+        self.assertIn(self.data['Brown Spot']['symptoms'][0], guide)
+        self.assertIs(kb.guide_html('Brown Spot'), guide)
+        self.assertIn('Healthy Characteristics', kb.guide_html('Healthy Rice Leaf'))
+
+
+class QueryPlanTests(TestCase):
+    def test_history_and_stats_queries_use_indexes(self):
+        user = User.objects.create_user('farmer', password='rice-pass-123')
+        # Raises CommandError if any plan scans the table or sorts
+        call_command('check_query_plans', user_id=user.id, stdout=io.StringIO())
+
+    def test_unindexed_order_is_reported(self):
+        queryset = ClassificationResult.objects.filter(user_id=1).order_by('-confidence')
+        self.assertEqual(plan_problems(explain(str(queryset.query))), ['sort'])
+
+
+class ThumbnailTests(ClassifyViewTestCase):
+    def test_derivatives_are_resized_and_never_upscaled(self):
+        from django.core.files.storage import default_storage
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), (30, 160, 40)).save(buffer, 'JPEG')
+        name = default_storage.save('classification_images/small.jpg', ContentFile(buffer.getvalue()))
+        image_width, written = generate_thumbnails(name, widths=[160, 320, 640])
+        self.assertEqual(image_width, 400)
+        self.assertEqual(len(written), 4)  # 160 and 320, as WebP and JPEG
+        with default_storage.open(thumbnail_name(name, 160, 'webp')) as f, Image.open(f) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (160, 120)))
+        self.assertFalse(default_storage.exists(thumbnail_name(name, 640, 'jpeg')))
+        # Existing derivatives are left alone
+        self.assertEqual(generate_thumbnails(name, widths=[160, 320, 640]), (400, []))
+
+    def test_saved_results_get_thumbnails_served_with_srcset(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.classify()
+        result = ClassificationResult.objects.get(id=response.context['result_id'])
+        self.assertTrue(result.thumbnails_ready)
+        # The small sample gets a 160w derivative and is itself the largest candidate
+        with Image.open(LEAF_IMAGE) as image:
+            self.assertEqual(result.image_width, image.width)
+        self.assertContains(
+            self.client.get('/history/'),
+            f'srcset="{settings.MEDIA_URL}{thumbnail_name(result.image.name, 160, "webp")} 160w, '
+            f'{result.image.url} {result.image_width}w"',
+        )
+
+    @override_settings(THUMBNAILS_IN_BACKGROUND=True)
+    def test_classify_leaves_thumbnails_to_the_background_thread(self):
+        with mock.patch.object(thumbnail_executor, 'submit') as submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.classify()
+        result = ClassificationResult.objects.get(id=response.context['result_id'])
+        submit.assert_called_once()
+        self.assertEqual(submit.call_args.args[1].id, result.id)
+        self.assertFalse(result.thumbnails_ready)
+        # Until then the page shows the original
+        self.assertContains(self.client.get(f'/history/{result.id}/'), f'src="{result.image.url}"')
+
+    def test_backfill_command_marks_existing_results(self):
+        with open(LEAF_IMAGE, 'rb') as f:
+            result = ClassificationResult(
+                user=self.user, predicted_class='Brown Spot', confidence=90.0, class_probabilities={},
+            )
+            result.image.save('leaf.jpg', ContentFile(f.read()), save=False)
+        # Saved outside captureOnCommitCallbacks, so nothing was generated yet
+        result.save()
+        self.assertFalse(ClassificationResult.objects.get(id=result.id).thumbnails_ready)
+        call_command('generate_thumbnails', processes=2, stdout=io.StringIO())
+        self.assertTrue(ClassificationResult.objects.get(id=result.id).thumbnails_ready)
+
+
+class ContentAddressedStorageTests(ClassifyViewTestCase):
+    def test_identical_uploads_are_stored_once(self):
+        first, second = self.classify(), self.classify()
+        names = list(ClassificationResult.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 2)
+        self.assertEqual(names[0], names[1])
+        self.assertRegex(names[0], r'^classification_images/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(StoredFile.objects.get(name=names[0]).refcount, 2)
+
+        ClassificationResult.objects.get(id=first.context['result_id']).delete()
+        self.assertEqual(StoredFile.objects.get(name=names[0]).refcount, 1)
+
+    def test_gc_removes_only_expired_unreferenced_files(self):
+        from django.core.files.storage import default_storage
+
+        self.classify()
+        kept = ClassificationResult.objects.get().image.name
+        anonymous = default_storage.save('anonymous_uploads/leaf.jpg', self.reencoded())
+
+        call_command('gc_uploads', stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(anonymous))  # still within the TTL
+
+        StoredFile.objects.update(touched_at=timezone.now() - timedelta(hours=48))
+        out = io.StringIO()
+        call_command('gc_uploads', stdout=out)
+        self.assertIn('Deleted 1 file(s)', out.getvalue())
+        self.assertFalse(default_storage.exists(anonymous))
+        self.assertFalse(StoredFile.objects.filter(name=anonymous).exists())
+        self.assertTrue(default_storage.exists(kept))
+
+
+class ReclassifyCommandTests(ClassifyViewTestCase):
+    def test_rescores_stale_results_and_resumes_from_checkpoint(self):
+        self.classify()
+        result = ClassificationResult.objects.get()
+        expected = (result.predicted_class, result.confidence)
+        # As scored by an older model, with a rollup to match
+        ClassificationResult.objects.update(model_version='1-tensorflow', confidence=1.0)
+        rebuild_user_stats([self.user.id])
+        checkpoint = os.path.join(self.media_root, 'reclassify.json')
+
+        out = io.StringIO()
+        call_command('reclassify', processes=1, nice=0, checkpoint=checkpoint, stdout=out)
+        self.assertIn('Done: 1 re-scored, 0 unreadable', out.getvalue())
+        result.refresh_from_db()
+        self.assertEqual(result.model_version, ModelRegistry().model_tag())
+        self.assertEqual((result.predicted_class, result.confidence), expected)
+        self.assertEqual(UserClassificationStats.objects.get(user=self.user).confidence_sum, expected[1])
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f)['last_id'], result.id)
+
+        out = io.StringIO()
+        call_command('reclassify', processes=1, nice=0, checkpoint=checkpoint, stdout=out)
+        self.assertIn('0 result(s) to re-score', out.getvalue())
+
+    def test_max_rate_paces_the_rows_handed_to_the_pool(self):
+        start = time.perf_counter()
+        self.assertEqual(list(paced(range(5), 100)), list(range(5)))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.04)
+
+
+class CompareModelsTests(TestCase):
+    def test_reports_throughput_accuracy_and_disagreement(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        os.makedirs(os.path.join(folder, 'Brown Spot'))
+        shutil.copy(LEAF_IMAGE, os.path.join(folder, 'Brown Spot', 'leaf.jpg'))
+        shutil.copy(LEAF_IMAGE, os.path.join(folder, 'unlabelled.jpg'))
+        report_path = os.path.join(folder, 'report.json')
+        # models/2 again, by path and with its labels given explicitly
+        copy = str(settings.BASE_DIR / 'models' / '2')
+        labels_path = os.path.join(folder, 'labels.json')
+        with open(labels_path, 'w') as f:
+            json.dump(DEFAULT_CLASS_NAMES, f)
+
+        call_command(
+            'compare_models', '2', copy, images=folder, batch_sizes=[1, 2], repeat=1, json=report_path,
+            class_names=[f'{copy}={labels_path}'], stdout=io.StringIO(),
+        )
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual((report['images'], report['labelled']), (2, 1))
+        current = report['models']['2']
+        self.assertEqual(set(current['throughput']), {'1', '2'})
+        self.assertEqual(sum(current['confusion']['Brown Spot'].values()), 1)
+        disagreement = report['disagreement'][f'2 vs {copy}']
+        self.assertEqual(disagreement['rate'], 0.0)
+        self.assertEqual(sum(map(sum, (row.values() for row in disagreement['matrix'].values()))), 2)
+
+    def test_models_with_different_classes_get_a_cross_tab_but_no_rate(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        shutil.copy(LEAF_IMAGE, os.path.join(folder, 'leaf.jpg'))
+        report_path = os.path.join(folder, 'report.json')
+        # Model 1 has four unnamed outputs, model 2 the five production classes
+        call_command(
+            'compare_models', '1', '2', images=folder, batch_sizes=[1], repeat=1, json=report_path,
+            stdout=io.StringIO(),
+        )
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(report['models']['1']['class_names'], [f'Class {i}' for i in range(4)])
+        disagreement = report['disagreement']['1 vs 2']
+        self.assertNotIn('rate', disagreement)
+        self.assertEqual(set(disagreement['matrix']), {f'Class {i}' for i in range(4)})
+        self.assertEqual(sum(map(sum, (row.values() for row in disagreement['matrix'].values()))), 1)
+
+    def test_class_names_are_checked_before_any_model_loads(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        shutil.copy(LEAF_IMAGE, os.path.join(folder, 'leaf.jpg'))
+        labels_path = os.path.join(folder, 'labels.json')
+        with open(labels_path, 'w') as f:
+            json.dump(['Healthy', 'Sick'], f)
+        with mock.patch('riceapp.inference.InferenceModel') as model:
+            with self.assertRaisesMessage(CommandError, '1 has 4 outputs but 2 class names'):
+                call_command(
+                    'compare_models', '2', '1', images=folder, class_names=[f'1={labels_path}'],
+                    stdout=io.StringIO(),
+                )
+        model.assert_not_called()
+
+
+class AsyncViewTests(ClassifyViewTestCase):
+    def test_middleware_runs_natively_in_async_mode(self):
+        # A sync-only middleware would park every async request on a thread
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), 'async_capable', False), path)
+
+    async def test_classify_through_asgi_handler(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        with open(LEAF_IMAGE, 'rb') as f:
+            response = await self.async_client.post('/classify/', {'image': f})
+        self.assertEqual(response.status_code, 200)
+        result = await ClassificationResult.objects.aget(user=self.user)
+        self.assertEqual(response.context['result_id'], result.id)
+
+        response = await self.async_client.get('/history/')
+        self.assertContains(response, result.predicted_class)
+        await sync_to_async(self.async_client.logout)()
+        response = await self.async_client.get('/history/')
+        self.assertEqual(response.status_code, 302)
+
+
+class StartupTests(TestCase):
+    def test_manage_check_does_not_import_ml_libraries(self):
+        # `check` loads the URLconf and with it every view module
+        script = (
+            "import sys\n"
+            "from django.core.management import execute_from_command_line\n"
+            "execute_from_command_line(['manage.py', 'check'])\n"
+            "print(' '.join(m for m in ('tensorflow', 'keras', 'cv2') if m in sys.modules) or 'none')\n"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='rice_detect.settings')
+        process = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertEqual(process.stdout.strip().splitlines()[-1], 'none')
@@ -0,0 +1,117 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Derivative formats: WebP for browsers that take it, JPEG as the <img> fallback
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+EXIF_ORIENTATION = 0x0112
+
+
+def thumbnail_name(name, width, fmt):
+    """Storage name of one derivative, e.g. thumbnails/classification_images/leaf_320w.webp"""
+    return f"thumbnails/{os.path.splitext(name)[0]}_{width}w.{EXTENSIONS[fmt]}"
+
+
+def thumbnail_widths(image_width, widths=None):
+    """Configured widths narrower than the original; nothing is ever upscaled."""
+    return [width for width in sorted(widths or settings.THUMBNAIL_WIDTHS) if width < image_width]
+
+
+def generate_thumbnails(name, storage=None, widths=None, overwrite=False):
+    """Write the width x format derivatives of a stored image.
+
+    The original is decoded once, at the smallest JPEG draft scale that still
+    covers the largest width, and turned upright by its EXIF orientation
+    (derivatives carry no EXIF). Only widths below the original's are made;
+    a smaller original is served as it is. Existing derivatives are kept
+    unless ``overwrite``. Returns ``(original width, names written)``.
+    """
+    storage = storage or default_storage
+    widths = sorted(widths or settings.THUMBNAIL_WIDTHS)
+    written = []
+    with storage.open(name, 'rb') as f, Image.open(f) as original:
+        # Width of the upright original; EXIF orientations 5-8 swap the sides
+        rotated = original.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8)
+        image_width = original.height if rotated else original.width
+        # Square request: still wide enough if the rotation swaps the sides
+        original.draft('RGB', (widths[-1], widths[-1]))
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    for width in thumbnail_widths(image_width, widths):
+        resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS, reducing_gap=3.0)
+        for fmt, (pil_format, options) in FORMATS.items():
+            target = thumbnail_name(name, width, fmt)
+            if storage.exists(target):
+                if not overwrite:
+                    continue
+                storage.delete(target)
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **options)
+            written.append(storage.save(target, ContentFile(buffer.getvalue())))
+    return image_width, written
+
+
+def delete_thumbnails(name, storage=None):
+    """Remove every derivative a stored image may have."""
+    storage = storage or default_storage
+    for width in settings.THUMBNAIL_WIDTHS:
+        for fmt in FORMATS:
+            storage.delete(thumbnail_name(name, width, fmt))
+
+
+def ensure_thumbnails(result):
+    """Generate a result's derivatives and record them; returns success."""
+    from .models import ClassificationResult
+
+    try:
+        image_width, _ = generate_thumbnails(result.image.name, result.image.storage)
+    except (OSError, UnidentifiedImageError) as e:
+        # The templates keep serving the original
+        print(f"Thumbnails for {result.image.name} failed: {e}")
+        return False
+    ClassificationResult.objects.filter(id=result.id).update(thumbnails_ready=True, image_width=image_width)
+    result.thumbnails_ready, result.image_width = True, image_width
+    return True
+
+
+# One thread per worker: derivatives are made one photo at a time after the
+# response. Results of a worker that stops first keep thumbnails_ready False,
+# which `manage.py generate_thumbnails` picks up.
+thumbnail_executor = ThreadPoolExecutor(1, thread_name_prefix='thumbnails')
+
+
+def schedule_thumbnails(result):
+    """Have a committed result's derivatives made off the request path.
+
+    The templates serve the original until thumbnails_ready is set.
+    """
+    if not settings.THUMBNAILS_IN_BACKGROUND:
+        ensure_thumbnails(result)
+        return
+    thumbnail_executor.submit(_ensure_in_background, result)
+
+
+def _ensure_in_background(result):
+    try:
+        ensure_thumbnails(result)
+    except Exception as e:
+        print(f"Thumbnails for {result.image.name} failed: {e}")
+    finally:
+        # The thread outlives requests, so it doesn't keep a connection open
+        connection.close()
+
+
+def srcset(name, fmt, widths, storage=None):
+    storage = storage or default_storage
+    return ', '.join(f"{storage.url(thumbnail_name(name, width, fmt))} {width}w" for width in widths)
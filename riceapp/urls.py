@@ -7,7 +7,12 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('classify/', views.classify_rice_disease, name='classify_rice_disease'),
+    path('classify/batch/', views.classify_batch, name='classify_batch'),
+    path('classify/jobs/', views.classify_job, name='classify_job'),
+    path('classify/jobs/<int:job_id>/', views.classification_job_status, name='classification_job_status'),
     path('history/', views.classification_history, name='classification_history'),
     path('history/<int:result_id>/', views.classification_result_detail, name='classification_result_detail'),
+    path('inference/stats/', views.inference_stats, name='inference_stats'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
 
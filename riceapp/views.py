@@ -1,344 +1,51 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+from django.core.files.storage import default_storage
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.db.models import Avg
-import tensorflow as tf
-import numpy as np
-from PIL import Image
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_POST
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.core.files.base import File
+from django.db import transaction
+from asgiref.sync import sync_to_async
 import os
 import json
-import cv2 
-from .models import ClassificationResult
+import itertools
+from functools import wraps
+import zipfile
+import shutil
+import tempfile
+from .models import ClassificationResult, ClassificationJob, UserClassificationStats
+from .registry import registry, ModelUnavailable
+from .disease_info import knowledge_base
+from .classification import aclassify_upload, batcher, build_result, classify_uploads
+from .prediction_cache import prediction_cache
+from .jobs import enqueue, queue_stats
+from .metrics import metrics
+from .pagination import HISTORY_CARD_FIELDS, keyset_page
+from .page_cache import cache_result_page, cached_result_page, result_etag, result_last_modified
+from .signals import results_inserted
+from .phash import perceptual_index
 from .forms import CustomUserCreationForm, CustomAuthenticationForm, ImageUploadForm
 from django.conf import settings
 
-# Load trained model with fallback for production
-try:
-    # Try absolute path first (for local development)
-    model = tf.keras.models.load_model(r'C:\Users\HP\Documents\clinton\rice_project\rice website\rice_detect\models\2')
-    print("Model loaded from absolute path")
-except Exception as e:
-    try:
-        # Try relative path for production
-        model_path = os.path.join(settings.BASE_DIR, 'models', '2')
-        model = tf.keras.models.load_model(model_path)
-        print("Model loaded from relative path")
-    except Exception as e2:
-        # Create a dummy model for initial deployment
-        print(f"Model loading failed: {e2}")
-        # You'll need to upload your model files to GitHub
-        model = None
+def async_login_required(view):
+    """login_required for async views; Django 4.2's only wraps sync ones"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Resolving request.user loads the session, which can query the database
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
 
-#CLASS NAMES
-class_names = ['Bacterial Leaf Blight', 'Brown Spot', 'Healthy Rice Leaf', 'Leaf Blast', 'Sheath Blight']
-
-# Load disease information from JSON
-def load_disease_info():
-    try:
-        with open('rice_disease_info.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # Fallback data if JSON file is not found
-        return {
-            'Bacterial Leaf Blight': {
-                'disease_name': 'Bacterial Leaf Blight',
-                'scientific_name': 'Xanthomonas oryzae pv. oryzae',
-                'symptoms': [
-                    'Water-soaked lesions on leaf edges',
-                    'Yellowish-white stripes along veins',
-                    'Lesions with wavy margins',
-                    'Milky dew droplets in morning'
-                ],
-                'causes': [
-                    'Bacterial infection through wounds',
-                    'Contaminated seeds or plant debris',
-                    'High humidity and temperature',
-                    'Poor field sanitation'
-                ],
-                'prevention_methods': [
-                    'Use certified disease-free seeds',
-                    'Avoid overhead irrigation',
-                    'Practice field sanitation',
-                    'Plant resistant varieties'
-                ],
-                'organic_cures': [
-                    {
-                        'name': 'Copper-based Sprays',
-                        'type': 'Bactericide',
-                        'examples': ['Copper hydroxide', 'Copper oxychloride'],
-                        'application': 'Spray every 7-10 days',
-                        'cost': 'Low to Medium'
-                    },
-                    {
-                        'name': 'Bio-control Agents',
-                        'type': 'Biological',
-                        'examples': ['Pseudomonas fluorescens', 'Bacillus subtilis'],
-                        'application': 'Seed treatment and foliar spray',
-                        'cost': 'Medium'
-                    }
-                ],
-                'chemical_pesticides': [
-                    {
-                        'name': 'Streptomycin',
-                        'dosage': '500-1000 ppm',
-                        'application': 'Spray at first symptom appearance',
-                        'safety_period': '14 days',
-                        'cost': 'Medium'
-                    },
-                    {
-                        'name': 'Copper Compounds',
-                        'dosage': 'As per manufacturer',
-                        'application': 'Preventive spray during humid conditions',
-                        'safety_period': '7 days',
-                        'cost': 'Low'
-                    }
-                ],
-                'cultural_controls': [
-                    'Avoid nitrogen over-fertilization',
-                    'Ensure proper drainage',
-                    'Remove infected plants',
-                    'Practice crop rotation'
-                ]
-            },
-            'Brown Spot': {
-                'disease_name': 'Brown Spot',
-                'scientific_name': 'Cochliobolus miyabeanus',
-                'symptoms': [
-                    'Circular brown spots on leaves',
-                    'Spots with yellow halos',
-                    'Lesions may coalesce',
-                    'Reduced grain quality'
-                ],
-                'causes': [
-                    'Fungal infection',
-                    'Nutrient deficiency (especially silicon)',
-                    'High humidity',
-                    'Poor soil conditions'
-                ],
-                'prevention_methods': [
-                    'Balanced fertilization',
-                    'Silicon application',
-                    'Proper field drainage',
-                    'Use resistant varieties'
-                ],
-                'organic_cures': [
-                    {
-                        'name': 'Neem-based Products',
-                        'type': 'Antifungal',
-                        'examples': ['Neem oil', 'Neem cake'],
-                        'application': 'Spray every 10-15 days',
-                        'cost': 'Low'
-                    },
-                    {
-                        'name': 'Garlic and Chili Extract',
-                        'type': 'Natural fungicide',
-                        'examples': ['Homemade extract'],
-                        'application': 'Weekly spray',
-                        'cost': 'Very Low'
-                    }
-                ],
-                'chemical_pesticides': [
-                    {
-                        'name': 'Carbendazim',
-                        'dosage': '1g per liter of water',
-                        'application': 'Spray at disease onset',
-                        'safety_period': '21 days',
-                        'cost': 'Low'
-                    },
-                    {
-                        'name': 'Mancozeb',
-                        'dosage': '2g per liter of water',
-                        'application': 'Preventive spray',
-                        'safety_period': '15 days',
-                        'cost': 'Low'
-                    }
-                ],
-                'cultural_controls': [
-                    'Improve soil fertility',
-                    'Avoid water stress',
-                    'Remove infected debris',
-                    'Practice proper spacing'
-                ]
-            },
-            'Healthy Rice Leaf': {
-                'disease_name': 'Healthy Rice Leaf',
-                'characteristics': [
-                    'Vibrant green color',
-                    'Uniform leaf surface',
-                    'No spots or discoloration',
-                    'Proper leaf orientation'
-                ],
-                'maintenance_practices': [
-                    'Regular monitoring for early detection',
-                    'Balanced nutrient management',
-                    'Proper water management',
-                    'Weed control'
-                ],
-                'monitoring_recommendations': [
-                    'Check leaves weekly for any changes',
-                    'Monitor weather conditions',
-                    'Watch for pest activity',
-                    'Maintain field records'
-                ]
-            },
-            'Leaf Blast': {
-                'disease_name': 'Leaf Blast',
-                'scientific_name': 'Pyricularia oryzae',
-                'symptoms': [
-                    'Diamond-shaped lesions with gray centers',
-                    'Brown or reddish borders',
-                    'Lesions may coalesce',
-                    'Complete leaf drying in severe cases'
-                ],
-                'causes': [
-                    'Fungal pathogen',
-                    'High humidity and cool temperatures',
-                    'Excessive nitrogen fertilization',
-                    'Poor air circulation'
-                ],
-                'prevention_methods': [
-                    'Use blast-resistant varieties',
-                    'Avoid excessive nitrogen',
-                    'Proper planting time',
-                    'Field sanitation'
-                ],
-                'organic_cures': [
-                    {
-                        'name': 'Trichoderma-based Products',
-                        'type': 'Bio-fungicide',
-                        'examples': ['Trichoderma harzianum', 'Trichoderma viride'],
-                        'application': 'Seed treatment and soil application',
-                        'cost': 'Medium'
-                    },
-                    {
-                        'name': 'Plant Extracts',
-                        'type': 'Natural antifungal',
-                        'examples': ['Tulsi extract', 'Eucalyptus oil'],
-                        'application': 'Foliar spray every 10 days',
-                        'cost': 'Low'
-                    }
-                ],
-                'chemical_pesticides': [
-                    {
-                        'name': 'Tricyclazole',
-                        'dosage': '0.5-1.0 g per liter',
-                        'application': 'Spray at disease appearance',
-                        'safety_period': '30 days',
-                        'cost': 'Medium'
-                    },
-                    {
-                        'name': 'Isoprothiolane',
-                        'dosage': 'As per manufacturer',
-                        'application': 'Preventive and curative',
-                        'safety_period': '21 days',
-                        'cost': 'Medium'
-                    }
-                ],
-                'cultural_controls': [
-                    'Avoid dense planting',
-                    'Ensure proper drainage',
-                    'Remove infected plants',
-                    'Time planting to avoid blast-favorable conditions'
-                ]
-            },
-            'Sheath Blight': {
-                'disease_name': 'Sheath Blight',
-                'scientific_name': 'Rhizoctonia solani',
-                'symptoms': [
-                    'Oval or elliptical greenish-gray lesions',
-                    'Lesions on leaf sheaths',
-                    'White fungal growth',
-                    'Plant lodging in severe cases'
-                ],
-                'causes': [
-                    'Soil-borne fungus',
-                    'High plant density',
-                    'High humidity',
-                    'Excessive nitrogen'
-                ],
-                'prevention_methods': [
-                    'Proper plant spacing',
-                    'Balanced fertilization',
-                    'Water management',
-                    'Use tolerant varieties'
-                ],
-                'organic_cures': [
-                    {
-                        'name': 'Bio-fungicides',
-                        'type': 'Biological control',
-                        'examples': ['Pseudomonas spp.', 'Trichoderma spp.'],
-                        'application': 'Soil and foliar application',
-                        'cost': 'Medium'
-                    },
-                    {
-                        'name': 'Botanical Extracts',
-                        'type': 'Natural fungicide',
-                        'examples': ['Neem oil', 'Garlic extract'],
-                        'application': 'Regular spray',
-                        'cost': 'Low'
-                    }
-                ],
-                'chemical_pesticides': [
-                    {
-                        'name': 'Validamycin',
-                        'dosage': '2-3 ml per liter',
-                        'application': 'Spray at disease onset',
-                        'safety_period': '14 days',
-                        'cost': 'Medium'
-                    },
-                    {
-                        'name': 'Hexaconazole',
-                        'dosage': '1-2 ml per liter',
-                        'application': 'Curative spray',
-                        'safety_period': '21 days',
-                        'cost': 'Medium'
-                    }
-                ],
-                'cultural_controls': [
-                    'Avoid water stagnation',
-                    'Practice crop rotation',
-                    'Remove infected debris',
-                    'Maintain proper plant population'
-                ]
-            }
-        }
-
-disease_info = load_disease_info()
-
-#FUNCTION FOR LEAF DETECTION
-def is_leaf_like(image):
-    """Basic checks for leaf-like characteristics"""
-    try:
-        # Convert PIL Image to numpy array
-        img_array = np.array(image)
-        
-        # Convert RGB to BGR for OpenCV (if image is RGB)
-        if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        
-        # Convert to HSV color space
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_BGR2HSV)
-        
-        # Define green color range in HSV
-        lower_green = np.array([35, 40, 40])
-        upper_green = np.array([85, 255, 255])
-        
-        # Create mask for green pixels
-        green_mask = cv2.inRange(hsv, lower_green, upper_green)
-
-        # Calculate percentage of green pixels
-        green_ratio = np.sum(green_mask > 0) / (image.size[0] * image.size[1])
-        
-        # Consider it leaf-like if at least 15% is green
-        return green_ratio > 0.15
-        
-    except Exception as e:
-        # If any error occurs in leaf detection, proceed with classification
-        print(f"Leaf detection error: {e}")
-        return True
+# Templates can touch lazy model attributes, so async views render in a thread
+arender = sync_to_async(render)
 
 def home(request):
     return render(request, 'index.html')
@@ -381,115 +88,334 @@ def logout_view(request):
     messages.info(request, 'You have been logged out successfully.')
     return redirect('home')
 
-@login_required
-def classification_history(request):
+@async_login_required
+async def classification_history(request):
     classifications = ClassificationResult.objects.filter(user=request.user)
-    # Calculate stats for the template
-    total_count = classifications.count()
-    healthy_count = classifications.filter(predicted_class='Healthy Rice Leaf').count()
-    disease_count = total_count - healthy_count
-    avg_confidence = classifications.aggregate(avg_conf=Avg('confidence'))['avg_conf'] or 0
+    page, next_cursor = await sync_to_async(keyset_page)(
+        classifications.only(*HISTORY_CARD_FIELDS),
+        request.GET.get('after'),
+        settings.HISTORY_PAGE_SIZE,
+    )
     
-    context = {
-        'classifications': classifications,
-        'total_count': total_count,
-        'healthy_count': healthy_count,
-        'disease_count': disease_count,
-        'avg_confidence': round(avg_confidence, 1)
-    }
+    # Infinite scroll fetches later pages as bare cards
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return await arender(request, 'classification_history_cards.html', {
+            'classifications': page,
+            'next_cursor': next_cursor,
+        })
     
-    return render(request, 'classification_history.html', context)
-
-@login_required
-def classification_result_detail(request, result_id):
-    """View individual classification result details"""
-    result = get_object_or_404(ClassificationResult, id=result_id, user=request.user)
+    # Stats for the template come from the user's rollup row
+    stats = await UserClassificationStats.objects.filter(user=request.user).afirst() or UserClassificationStats()
     
     context = {
-        'result': result,
-        'predicted_class': result.predicted_class,
-        'confidence': result.confidence,
-        'class_probabilities': result.class_probabilities,
-        'disease_info': result.disease_info or {},
-        'uploaded_file_url': result.image.url,
-        'user_authenticated': True,
+        'classifications': page,
+        'next_cursor': next_cursor,
+        'total_count': stats.total_count,
+        'healthy_count': stats.healthy_count,
+        'disease_count': stats.disease_count,
+        'avg_confidence': round(stats.avg_confidence, 1)
     }
     
-    return render(request, 'classification_result.html', context)
+    return await arender(request, 'classification_history.html', context)
+
+def disease_guide(result):
+    """Pre-rendered management guide for the disease info version of a result"""
+    version = result.disease_info_version
+    if version is None:
+        return knowledge_base.guide_html(result.predicted_class, {})
+    return knowledge_base.guide_html(result.predicted_class, version.content, version.content_hash)
 
 @login_required
-def classify_rice_disease(request):
-    if request.method == 'POST' and request.FILES.get('image'):
-        # Save uploaded file directly using the model's ImageField
-        uploaded_file = request.FILES['image']
-        
-        # Preprocess image from memory (no need to save temporarily)
-        image = Image.open(uploaded_file)
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        # CHECK IF IMAGE IS LEAF-LIKE BEFORE CLASSIFICATION
-        if not is_leaf_like(image):
-            context = {
-                'error': 'The uploaded image does not appear to be a rice leaf. Please upload a clear image of a rice leaf for accurate disease detection.',
-            }
-            return render(request, 'upload_image.html', context)
-            
-        # Resize to match model input
-        image = image.resize((256, 256))
-        img_array = tf.keras.preprocessing.image.img_to_array(image)
-        img_array = tf.expand_dims(img_array, 0)  # Add batch dimension
+@condition(etag_func=result_etag, last_modified_func=result_last_modified)
+def classification_result_detail(request, result_id):
+    """View individual classification result details.
+
+    Repeat views are answered with 304 (see page_cache.result_etag) and the
+    rendered page is kept in the cache until the result changes.
+    """
+    etag = result_etag(request, result_id)
+    if etag is None:
+        raise Http404('No ClassificationResult matches the given query.')
+    content = cached_result_page(result_id, etag)
+    if content is not None:
+        response = HttpResponse(content)
+    else:
+        result = get_object_or_404(
+            ClassificationResult.objects.select_related('disease_info_version'), id=result_id, user=request.user
+        )
         
-        # Make prediction
-        predictions = model.predict(img_array)
+        context = {
+            'result': result,
+            'predicted_class': result.predicted_class,
+            'confidence': result.confidence,
+            'class_probabilities': result.class_probabilities,
+            'disease_info': result.disease_info or {},
+            'disease_guide': disease_guide(result),
+            'uploaded_file_url': result.image.url,
+            'user_authenticated': True,
+        }
         
-        # Debug info
-        print(f"Raw predictions: {predictions}")
+        response = render(request, 'classification_result.html', context)
+        cache_result_page(request, result_id, etag, response.content)
+    # Browsers keep the page but check the ETag before showing it again
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+NOT_A_LEAF_ERROR = 'The uploaded image does not appear to be a rice leaf. Please upload a clear image of a rice leaf for accurate disease detection.'
+MODEL_UNAVAILABLE_ERROR = 'The classification model is temporarily unavailable. Please try again later.'
+
+@async_login_required
+async def classify_rice_disease(request):
+    """Classify one uploaded photo.
+
+    Async so that under ASGI a request waiting for its upload, the decode
+    pool or the batcher holds no thread; under WSGI Django runs it as a
+    sync view.
+    """
+    # Parsing spills large uploads to disk, so it runs in a thread
+    files = await sync_to_async(lambda: request.FILES)() if request.method == 'POST' else {}
+    if files.get('image'):
+        # Save uploaded file directly using the model's ImageField
+        uploaded_file = files['image']
         
-        predicted_class = class_names[np.argmax(predictions[0])]
-        confidence = round(100 * np.max(predictions[0]), 2)
+        # Make prediction (cached, near-duplicate or batched with other concurrent requests)
+        try:
+            outcome = await aclassify_upload(uploaded_file)
+        except ModelUnavailable as e:
+            print(f"Classification failed: {e}")
+            return await arender(request, 'upload_image.html', {'error': MODEL_UNAVAILABLE_ERROR})
         
-        class_probabilities = {
-            class_names[i]: round(float(predictions[0][i]) * 100, 2) 
-            for i in range(len(class_names))
-        }
+        # CHECK IF IMAGE IS LEAF-LIKE BEFORE CLASSIFICATION
+        if outcome.status == 'not_leaf':
+            return await arender(request, 'upload_image.html', {'error': NOT_A_LEAF_ERROR})
+        if outcome.status == 'error':
+            return await arender(request, 'upload_image.html', {'error': outcome.error})
         
-        # Get disease information
-        current_disease_info = disease_info.get(predicted_class, {})
+        classification_result = await sync_to_async(build_result)(outcome, request.user)
         
         # Save classification result to database only if user is logged in
         if request.user.is_authenticated:
-            classification_result = ClassificationResult.objects.create(
-                user=request.user,
-                image=uploaded_file,  # This will save to MEDIA_ROOT/classification_images/
-                predicted_class=predicted_class,
-                confidence=confidence,
-                class_probabilities=class_probabilities,
-                disease_info=current_disease_info
-            )
+            with metrics.timer('media_write'):
+                # The storage records the file in StoredFile
+                await sync_to_async(classification_result.image.save)(uploaded_file.name, uploaded_file, save=False)
+            # post_save times the INSERT (db_insert) apart from its bookkeeping (post_insert)
+            await classification_result.asave()
             result_id = classification_result.id
             
             # Get the actual saved image URL from the model
             uploaded_file_url = classification_result.image.url
         else:
             result_id = None
-            # For anonymous users, we need to handle file storage differently
-            fs = FileSystemStorage()
-            filename = fs.save(uploaded_file.name, uploaded_file)
-            uploaded_file_url = fs.url(filename)
+            # Anonymous uploads have no result referencing them; gc_uploads
+            # removes them after UPLOAD_GC_TTL_HOURS
+            filename = await sync_to_async(default_storage.save)(f'anonymous_uploads/{uploaded_file.name}', uploaded_file)
+            uploaded_file_url = default_storage.url(filename)
         
         context = {
             'uploaded_file_url': uploaded_file_url,  
-            'predicted_class': predicted_class,
-            'confidence': confidence,
-            'class_probabilities': class_probabilities,
-            'disease_info': current_disease_info,
+            'predicted_class': classification_result.predicted_class,
+            'confidence': classification_result.confidence,
+            'class_probabilities': classification_result.class_probabilities,
+            'disease_info': classification_result.disease_info,
+            'disease_guide': disease_guide(classification_result),
             'result_id': result_id,
+            'result': classification_result if result_id else None,
             'user_authenticated': request.user.is_authenticated,
+            'reused_result_id': outcome.reused_result.id if outcome.reused_result is not None else None,
+            'phash_distance': outcome.phash_distance,
         }
         
-        return render(request, 'classification_result.html', context)
+        return await arender(request, 'classification_result.html', context)
+    
+    return await arender(request, 'upload_image.html')
+
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+class SkippedUpload:
+    """Placeholder for an archive member that was not read"""
+
+    def __init__(self, name, error):
+        self.name = name
+        self.error = error
+
+@login_required
+@require_POST
+def classify_batch(request):
+    """Classify many photos in one request and stream results back as NDJSON.
+
+    Accepts any number of ``images`` files and/or ``archive`` ZIP files (read
+    member by member from the upload's temporary file). Photos are processed
+    in chunks of INFERENCE_MAX_BATCH_SIZE: each chunk shares forward passes and
+    is saved with one bulk insert. One JSON line is written per photo as soon
+    as its chunk is done, followed by a final ``summary`` line.
+    """
+    images = request.FILES.getlist('images')
+    archives = request.FILES.getlist('archive')
+    if not images and not archives:
+        return JsonResponse({'error': 'Send photos as "images" or a ZIP file as "archive".'}, status=400)
+    
+    for archive in archives:
+        if not zipfile.is_zipfile(archive):
+            return JsonResponse({'error': f'{archive.name} is not a ZIP archive.'}, status=400)
     
-    return render(request, 'upload_image.html')
\ No newline at end of file
+    def uploads():
+        yield from images
+        for archive in archives:
+            yield from iter_zip_images(archive)
+    
+    response = StreamingHttpResponse(
+        stream_batch_results(request.user, uploads()),
+        content_type='application/x-ndjson',
+    )
+    response['X-Accel-Buffering'] = 'no'  # let proxies pass each line through as it is written
+    return response
+
+def iter_zip_images(archive):
+    """Yield the images inside an uploaded ZIP one at a time.
+
+    Members are extracted to spooled temporary files, which only stay in
+    memory up to FILE_UPLOAD_MAX_MEMORY_SIZE, like regular uploads.
+    """
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or name.startswith('.') or '__MACOSX' in info.filename:
+                continue
+            if not name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                continue
+            if info.file_size > settings.BATCH_MAX_FILE_SIZE:
+                yield SkippedUpload(name, f'File is larger than {settings.BATCH_MAX_FILE_SIZE} bytes.')
+                continue
+            spooled = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+            with zf.open(info) as member:
+                shutil.copyfileobj(member, spooled)
+            spooled.seek(0)
+            yield File(spooled, name=name)
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_batch_results(user, uploads):
+    counts = {'ok': 0, 'not_leaf': 0, 'error': 0}
+    index = 0
+    
+    for chunk in chunked(itertools.islice(uploads, settings.BATCH_MAX_FILES), settings.INFERENCE_MAX_BATCH_SIZE):
+        readable = [upload for upload in chunk if not isinstance(upload, SkippedUpload)]
+        try:
+            outcomes = iter(classify_uploads(readable))
+        except ModelUnavailable as e:
+            print(f"Batch classification failed: {e}")
+            yield json.dumps({'status': 'error', 'error': MODEL_UNAVAILABLE_ERROR}) + '\n'
+            return
+        
+        entries = []
+        for upload in chunk:
+            entry = {'index': index, 'name': upload.name}
+            result = None
+            index += 1
+            if isinstance(upload, SkippedUpload):
+                entry.update(status='error', error=upload.error)
+            else:
+                outcome = next(outcomes)
+                entry['status'] = outcome.status
+                if outcome.status == 'ok':
+                    result = build_result(outcome, user)
+                    entry.update(
+                        predicted_class=result.predicted_class,
+                        confidence=result.confidence,
+                        class_probabilities=result.class_probabilities,
+                        # Not the id of a reused result, which may belong to another user
+                        source=outcome.source,
+                    )
+                elif outcome.status == 'error':
+                    entry['error'] = outcome.error
+            counts[entry['status']] += 1
+            entries.append((entry, result))
+        
+        # One INSERT per chunk; the image files are written as each row is prepared.
+        # bulk_create sends no post_save, so its bookkeeping is run here.
+        with transaction.atomic():
+            created = ClassificationResult.objects.bulk_create([result for _, result in entries if result is not None])
+            results_inserted(created)
+        for entry, result in entries:
+            if result is not None:
+                entry['result_id'] = result.id
+            yield json.dumps(entry) + '\n'
+    
+    summary = dict(counts, total=index)
+    if next(uploads, None) is not None:
+        summary['truncated_at'] = settings.BATCH_MAX_FILES
+    yield json.dumps({'summary': summary}) + '\n'
+
+@login_required
+@require_POST
+def classify_job(request):
+    """Queue an upload for the inference workers and return its job id right away
+
+    Without workers (INFERENCE_WORKERS = 0) the job is done before the response.
+    """
+    if not request.FILES.get('image'):
+        return JsonResponse({'error': 'Send the photo as "image".'}, status=400)
+    job = enqueue(request.user, request.FILES['image'])
+    return JsonResponse(job_payload(job), status=202)
+
+@login_required
+def classification_job_status(request, job_id):
+    """Poll a queued classification; the response says when to ask again"""
+    job = get_object_or_404(ClassificationJob.objects.select_related('result'), id=job_id, user=request.user)
+    response = JsonResponse(job_payload(job))
+    if job.status in (ClassificationJob.QUEUED, ClassificationJob.RUNNING):
+        response['Retry-After'] = max(1, round(settings.JOB_POLL_INTERVAL))
+    return response
+
+def job_payload(job):
+    payload = {
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('classification_job_status', args=[job.id]),
+        'queue_seconds': job.queue_seconds,
+    }
+    if job.status == ClassificationJob.DONE and job.result is not None:
+        payload.update(
+            result_id=job.result.id,
+            result_url=reverse('classification_result_detail', args=[job.result.id]),
+            predicted_class=job.result.predicted_class,
+            confidence=job.result.confidence,
+            class_probabilities=job.result.class_probabilities,
+        )
+    elif job.status == ClassificationJob.NOT_LEAF:
+        payload['error'] = NOT_A_LEAF_ERROR
+    elif job.status == ClassificationJob.FAILED:
+        payload['error'] = job.error
+    return payload
+
+def metrics_view(request):
+    """Prometheus text metrics summed over all worker processes.
+
+    Readable by staff users and by scrapers sending METRICS_TOKEN as a
+    bearer token.
+    """
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(settings.METRICS_TOKEN) and constant_time_compare(authorization, f'Bearer {settings.METRICS_TOKEN}')
+    if not token_ok and not request.user.is_staff:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def inference_stats(request):
+    """Model and batcher statistics for this worker, plus the shared job queue"""
+    return JsonResponse({
+        'pid': os.getpid(),
+        'models': registry.stats(),
+        'batcher': batcher.stats(),
+        'prediction_cache': prediction_cache.stats(),
+        'perceptual_index': {'model_tag': perceptual_index.model_tag, 'entries': len(perceptual_index)},
+        'job_queue': queue_stats(),
+    })